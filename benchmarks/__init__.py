@@ -0,0 +1,3 @@
+"""
+Benchmarks del motor de señales (ejecutar desde la raíz del repositorio)
+"""
@@ -0,0 +1,65 @@
+"""
+Benchmark del enriquecimiento de páginas contra servidores locales
+
+Levanta varios benchmarks.fake_site_server (uno por "host", en puertos
+distintos) y enriquece señales sin contacto que apuntan a ellos.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_enrichment --urls 2000 --hosts 20 --latency 0.02
+"""
+import argparse
+import json
+import time
+from contextlib import ExitStack
+
+import metrics
+from benchmarks.fake_site_server import FakeSiteServer
+from enrichment import enrich_signals
+
+def run(urls, hosts, latency, workers, per_host, subpages, padding_bytes):
+    with ExitStack() as stack:
+        servers = [stack.enter_context(FakeSiteServer(latency=latency, padding_bytes=padding_bytes))
+                   for _ in range(hosts)]
+        signals = [
+            {'id': f"SIG-{i}", 'url': f"{servers[i % hosts].base_url}/page/{i}", 'email': None, 'telefono': None}
+            for i in range(urls)
+        ]
+        before = metrics.snapshot()
+        t0 = time.perf_counter()
+        enriched = enrich_signals(signals, max_workers=workers, per_host=per_host, subpages=subpages)
+        seconds = time.perf_counter() - t0
+        usage = metrics.diff(before, metrics.snapshot())
+        bytes_sent = sum(server.bytes_sent for server in servers)
+
+    return {
+        'urls': urls,
+        'hosts': hosts,
+        'workers': workers,
+        'per_host': per_host,
+        'seconds': round(seconds, 3),
+        'urls_per_second': round(urls / seconds, 1) if seconds else None,
+        'enriched': enriched,
+        'with_email': sum(1 for s in signals if s['email']),
+        'with_phone': sum(1 for s in signals if s['telefono']),
+        'pages_fetched': usage['stages'].get('enrich_page', {}).get('calls', 0),
+        'bytes_read': usage['counters'].get('enrich_bytes', {}).get('read', 0),
+        'bytes_sent_by_servers': bytes_sent
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del enriquecimiento de páginas')
+    parser.add_argument('--urls', type=int, default=1000)
+    parser.add_argument('--hosts', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='Latencia simulada por página (s)')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--per-host', type=int, default=2)
+    parser.add_argument('--subpages', type=int, default=1)
+    parser.add_argument('--padding', type=int, default=200 * 1024, help='Bytes de relleno por página')
+    args = parser.parse_args()
+
+    result = run(args.urls, args.hosts, args.latency, args.workers, args.per_host,
+                 args.subpages, args.padding)
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark de la extracción de contactos en processors
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_processors --records 300000
+    python -m benchmarks.bench_processors --records 300000 --json
+"""
+import argparse
+import json
+import random
+import time
+from processors import extract_contacts, extract_email, extract_phone, process_signals
+
+WORDS = [
+    'summer', 'school', 'madrid', 'housing', 'contact', 'admissions', 'course',
+    'university', 'programme', 'students', 'spanish', 'apply', 'deadline', '2026'
+]
+DOMAINS = ['ie.edu', 'esade.edu', 'comillas.edu', 'uc3m.es', 'slu.edu', 'nyu.edu']
+
+def make_results(count, seed=42):
+    """Genera resultados sintéticos con la forma que devuelve search_google"""
+    rng = random.Random(seed)
+    results = []
+    for i in range(count):
+        domain = rng.choice(DOMAINS)
+        words = [rng.choice(WORDS) for _ in range(rng.randint(15, 35))]
+        # Aproximadamente 1/3 con email, 1/3 con teléfono, el resto sin contacto
+        kind = i % 3
+        if kind == 0:
+            words.insert(rng.randrange(len(words)), f"info{i}@{domain}")
+        elif kind == 1:
+            words.insert(rng.randrange(len(words)), f"+34 91 {rng.randint(100, 999)} {rng.randint(10, 99)} {rng.randint(10, 99)}")
+        results.append({
+            'titulo': ' '.join(words[:8]).title(),
+            'url': f"https://www.{domain}/programs/{i}",
+            'snippet': ' '.join(words[8:]),
+            'displayLink': f"www.{domain}"
+        })
+    return results
+
+def _timeit(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def run(records):
+    """Ejecuta el benchmark y devuelve un diccionario con los tiempos"""
+    results = make_results(records)
+    texts = [f"{r['titulo']} {r['snippet']}" for r in results]
+
+    timings = {
+        'extract_email+extract_phone': _timeit(lambda: [(extract_email(t), extract_phone(t)) for t in texts]),
+        'extract_contacts': _timeit(lambda: [extract_contacts(t) for t in texts]),
+        'process_signals': _timeit(lambda: process_signals(results, 'benchmark')),
+    }
+
+    return {
+        'benchmark': 'processors',
+        'records': records,
+        'stages': {
+            name: {
+                'seconds': round(seconds, 4),
+                'us_per_record': round(seconds / records * 1e6, 3),
+                'records_per_second': round(records / seconds) if seconds else None
+            }
+            for name, seconds in timings.items()
+        }
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=300000, help='Número de snippets sintéticos')
+    parser.add_argument('--json', action='store_true', help='Imprimir el resultado en JSON')
+    args = parser.parse_args()
+
+    report = run(args.records)
+    if args.json:
+        print(json.dumps(report))
+        return
+
+    print(f"📏 {report['records']} registros sintéticos")
+    for name, stage in report['stages'].items():
+        print(f"  {name:<30} {stage['seconds']:>8.3f} s  {stage['us_per_record']:>8.3f} µs/registro")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Servidor HTTP local que imita la API de Google Custom Search
+
+Sirve respuestas sintéticas deterministas (o grabadas desde un fichero de
+fixtures) con paginación por 'start'/'num', para medir la búsqueda sin
+gastar cuota.
+
+Uso independiente:
+    python -m benchmarks.fake_search_server --port 8765
+    GOOGLE_SEARCH_API_URL=http://127.0.0.1:8765/customsearch/v1 python main.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DOMAINS = ['ie.edu', 'esade.edu', 'comillas.edu', 'uc3m.es', 'slu.edu', 'nyu.edu', 'eoi.es', 'suffolk.es']
+WORDS = [
+    'summer', 'school', 'madrid', 'housing', 'contact', 'admissions', 'course',
+    'university', 'programme', 'students', 'spanish', 'apply', 'deadline', '2026'
+]
+MAX_RESULTS = 100
+
+def synthetic_items(query, total=MAX_RESULTS):
+    """Resultados deterministas para una query (mismo formato que la API)"""
+    seed = int(hashlib.sha1(query.encode('utf-8')).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    items = []
+    for i in range(total):
+        domain = rng.choice(DOMAINS)
+        words = [rng.choice(WORDS) for _ in range(rng.randint(12, 30))]
+        if i % 3 == 0:
+            words.insert(rng.randrange(len(words)), f"info{rng.randint(1, 999)}@{domain}")
+        elif i % 3 == 1:
+            words.insert(rng.randrange(len(words)), f"+34 91 {rng.randint(100, 999)} {rng.randint(10, 99)} {rng.randint(10, 99)}")
+        # Parte de los resultados se repite entre queries, como en la API real
+        path = f"programs/{rng.randint(0, 400)}" if i % 4 == 0 else f"{seed:x}/{i}"
+        items.append({
+            'title': ' '.join(words[:8]).title(),
+            'link': f"https://www.{domain}/{path}",
+            'snippet': ' '.join(words[8:]),
+            'displayLink': f"www.{domain}"
+        })
+    return items
+
+class FakeSearchServer:
+    """
+    Servidor en un hilo propio; usar como context manager
+
+    Args:
+        latency: Segundos de espera simulada por petición
+        fixtures: Diccionario {query: [items]} con respuestas grabadas; las
+            queries que no estén se responden con datos sintéticos
+        quota: Peticiones por segundo admitidas; por encima se responde
+            429 con Retry-After, como la API real al agotar la cuota
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, fixtures=None, quota=None):
+        self.latency = latency
+        self.fixtures = fixtures or {}
+        self.quota = quota
+        self.requests = 0
+        self.throttled = 0
+        self._window = (0, 0)
+        self._lock = threading.Lock()
+        self._cache = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/customsearch/v1"
+
+    def _items(self, query):
+        with self._lock:
+            items = self._cache.get(query)
+            if items is None:
+                items = self.fixtures.get(query) or synthetic_items(query)
+                self._cache[query] = items
+            return items
+
+    def _over_quota(self):
+        """Cuenta la petición en la ventana del segundo actual"""
+        second = int(time.monotonic())
+        with self._lock:
+            window, used = self._window
+            used = used + 1 if window == second else 1
+            self._window = (second, used)
+            if used > self.quota:
+                self.throttled += 1
+                return True
+        return False
+
+    def _handle(self, request):
+        with self._lock:
+            self.requests += 1
+        if self.quota and self._over_quota():
+            payload = b'{"error": {"code": 429, "message": "Quota exceeded"}}'
+            request.send_response(429)
+            request.send_header('Retry-After', '1')
+            request.send_header('Content-Type', 'application/json; charset=UTF-8')
+            request.send_header('Content-Length', str(len(payload)))
+            request.end_headers()
+            request.wfile.write(payload)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+
+        params = parse_qs(urlparse(request.path).query)
+        query = params.get('q', [''])[0]
+        start = int(params.get('start', ['1'])[0])
+        num = min(int(params.get('num', ['10'])[0]), 10)
+        items = self._items(query)
+        page = items[start - 1:start - 1 + num]
+
+        body = {'items': page, 'queries': {'request': [{'startIndex': start, 'count': len(page)}]}}
+        if start - 1 + num < len(items):
+            body['queries']['nextPage'] = [{'startIndex': start + num}]
+        payload = json.dumps(body).encode('utf-8')
+
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json; charset=UTF-8')
+        request.send_header('Content-Length', str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def load_fixtures(path):
+    """Lee un fichero JSON {query: [items]} o {query: respuesta_completa_de_la_api}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {query: value.get('items', []) if isinstance(value, dict) else value for query, value in data.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local que imita Google Custom Search')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Segundos de espera por petición')
+    parser.add_argument('--fixtures', help='Fichero JSON con respuestas grabadas')
+    parser.add_argument('--quota', type=float, help='Peticiones/segundo antes de responder 429')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else None
+    server = FakeSearchServer(port=args.port, latency=args.latency, fixtures=fixtures, quota=args.quota)
+    print(f"🔍 Custom Search falso en {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
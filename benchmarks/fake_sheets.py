@@ -0,0 +1,113 @@
+"""
+Sustituto en memoria de un worksheet de gspread para benchmarks
+
+Implementa solo las llamadas que usa sheets_writer y cuenta cada una,
+para poder medir llamadas a la API y celdas enviadas sin red.
+"""
+import re
+import threading
+import time
+from collections import Counter
+
+RANGE_RE = re.compile(r'^([A-Z]+)(\d+):([A-Z]+)(\d+)$')
+
+class FakeWorksheet:
+    """
+    Worksheet falso: una lista de filas más row_count y contadores
+
+    Args:
+        rows: Filas iniciales (la primera son los encabezados)
+        row_count: Tamaño de la rejilla; por defecto 1000 como en Sheets
+        latency: Segundos de espera simulada por llamada
+    """
+
+    def __init__(self, rows=None, row_count=1000, latency=0.0):
+        self.rows = [list(row) for row in (rows or [])]
+        self.row_count = max(row_count, len(self.rows))
+        self.latency = latency
+        self.calls = Counter()
+        self.cells_written = 0
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _last_data_row(self):
+        for index in range(len(self.rows), 0, -1):
+            if any(self.rows[index - 1]):
+                return index
+        return 0
+
+    def get_all_values(self):
+        with self._lock:
+            self._call('get_all_values')
+            last = self._last_data_row()
+            width = max((len(row) for row in self.rows[:last]), default=0)
+            return [(row + [''] * width)[:width] for row in self.rows[:last]]
+
+    def resize(self, rows=None, cols=None):
+        with self._lock:
+            self._call('resize')
+            if rows is not None:
+                del self.rows[rows:]
+                self.row_count = rows
+
+    def _set_row(self, number, values):
+        while len(self.rows) < number:
+            self.rows.append([])
+        self.rows[number - 1] = list(values)
+
+    def _write_range(self, range_name, values):
+        match = RANGE_RE.match(range_name)
+        first, last = int(match.group(2)), int(match.group(4))
+        if last > self.row_count:
+            raise ValueError(f"Rango {range_name} fuera de la rejilla ({self.row_count} filas)")
+        for offset, row in enumerate(values):
+            self._set_row(first + offset, row)
+            self.cells_written += len(row)
+
+    def update(self, values=None, range_name=None, **kwargs):
+        with self._lock:
+            self._call('update')
+            self._write_range(range_name, values)
+
+    def batch_update(self, data, **kwargs):
+        with self._lock:
+            self._call('batch_update')
+            for update in data:
+                self._write_range(update['range'], update['values'])
+
+    def batch_clear(self, ranges):
+        with self._lock:
+            self._call('batch_clear')
+            for range_name in ranges:
+                match = RANGE_RE.match(range_name)
+                for number in range(int(match.group(2)), int(match.group(4)) + 1):
+                    if number <= len(self.rows):
+                        self.rows[number - 1] = []
+
+class FakeSheetHandle:
+    """Handle compatible con sheets_writer.SheetHandle que comparte un FakeWorksheet"""
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def refresh(self):
+        pass
+
+def install_fake_sheet(worksheet=None):
+    """
+    Hace que sheets_writer use un FakeWorksheet en lugar de Google Sheets
+
+    Returns:
+        El FakeWorksheet instalado
+    """
+    import sheets_writer
+
+    worksheet = worksheet or FakeWorksheet([[column for column in sheets_writer.SHEET_COLUMNS]])
+    sheets_writer.set_worksheet_pool(
+        sheets_writer.WorksheetPool(handle_factory=lambda: FakeSheetHandle(worksheet))
+    )
+    return worksheet
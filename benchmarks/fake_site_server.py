@@ -0,0 +1,135 @@
+"""
+Servidor HTTP local con páginas sintéticas de instituciones
+
+Cada página /page/<n> es HTML determinista: un tercio lleva email y
+teléfono en la propia página, otro tercio solo enlaza a /contact/<n>
+donde están los datos, y el resto no tiene contacto. Todas llevan relleno
+al final para comprobar que el enriquecimiento deja de leer a tiempo.
+
+Uso independiente:
+    python -m benchmarks.fake_site_server --port 8766
+"""
+import argparse
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PAGE_RE = re.compile(r'^/(page|contact)/(\d+)$')
+PADDING = '<p>' + 'Programa de verano en Madrid para estudiantes internacionales. ' * 40 + '</p>\n'
+
+def page_html(kind, number, padding_bytes):
+    """HTML de /page/<n> o /contact/<n>"""
+    head = f"<html><head><title>Institución {number}</title><style>p {{ margin: 0 }}</style></head><body>"
+    variant = number % 3
+    if kind == 'contact':
+        body = (f'<h1>Contacto</h1><p>Escríbenos a <a href="mailto:info{number}@example.org">'
+                f'info{number}@example.org</a> o llama al +34 91 {number % 1000:03d} 45 67</p>')
+    elif variant == 0:
+        body = (f'<h1>Summer school {number}</h1><p>Admisiones: admissions{number}@example.org, '
+                f'tel. <a href="tel:+34910{number % 1000:03d}456">910 {number % 1000:03d} 456</a></p>')
+    elif variant == 1:
+        body = f'<h1>Summer school {number}</h1><nav><a href="/contact/{number}">Contacto</a></nav>'
+    else:
+        body = f'<h1>Summer school {number}</h1><p>Plazas limitadas para 2026.</p>'
+    padding = PADDING * max(1, padding_bytes // len(PADDING))
+    return (head + body + padding + '</body></html>').encode('utf-8')
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # El enriquecimiento corta las descargas a propósito: no es un error
+        pass
+
+class FakeSiteServer:
+    """
+    Servidor en un hilo propio; usar como context manager
+
+    Args:
+        latency: Segundos de espera simulada antes de responder
+        padding_bytes: Relleno aproximado tras el contenido de cada página
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, padding_bytes=200 * 1024):
+        self.latency = latency
+        self.padding_bytes = padding_bytes
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _QuietServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handle(self, request):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        match = PAGE_RE.match(request.path)
+        if not match:
+            request.send_error(404)
+            return
+        payload = page_html(match.group(1), int(match.group(2)), self.padding_bytes)
+
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/html; charset=utf-8')
+        request.send_header('Content-Length', str(len(payload)))
+        request.end_headers()
+        sent = 0
+        try:
+            # En trozos, para que un cliente que corta la lectura se note aquí
+            for offset in range(0, len(payload), 16 * 1024):
+                request.wfile.write(payload[offset:offset + 16 * 1024])
+                sent += min(16 * 1024, len(payload) - offset)
+        except (BrokenPipeError, ConnectionResetError):
+            request.close_connection = True
+        with self._lock:
+            self.bytes_sent += sent
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local con páginas sintéticas de instituciones')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.0, help='Segundos de espera por petición')
+    args = parser.parse_args()
+
+    server = FakeSiteServer(port=args.port, latency=args.latency)
+    print(f"🌐 Páginas sintéticas en {server.base_url}/page/<n>")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""
+Benchmark de extremo a extremo del motor sin servicios de Google
+
+Levanta un Custom Search falso (benchmarks.fake_search_server) y un sheet
+en memoria (benchmarks.fake_sheets) y mide cada etapa a varias escalas:
+búsqueda, process_signal, classify_priority, escritura en Sheets y
+/api/signals. El resultado es JSON para poder comparar ejecuciones.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --scales 12 100 1000 --latency 0.05 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+DEFAULT_SCALES = [12, 100, 1000]
+
+def _percentiles(samples):
+    """p50/p95/máx en milisegundos"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return {
+        'p50_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3)
+    }
+
+def _stage(seconds, items, **extra):
+    result = {
+        'seconds': round(seconds, 4),
+        'items': items,
+        'items_per_second': round(items / seconds, 1) if seconds else None
+    }
+    result.update(extra)
+    return result
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def _configure_environment(workdir, server_url, quota=None):
+    """Variables que deben fijarse antes de importar los módulos del motor"""
+    os.environ['GOOGLE_API_KEY'] = 'benchmark'
+    os.environ['GOOGLE_SEARCH_ENGINE_ID'] = 'benchmark'
+    os.environ['GOOGLE_SEARCH_API_URL'] = server_url
+    os.environ['SEARCH_CACHE_DISABLED'] = '1'
+    os.environ['SIGNAL_STORE_PATH'] = os.path.join(workdir, 'signals.sqlite')
+    os.environ['SIGNALS_API_SNAPSHOT_PATH'] = os.path.join(workdir, 'api_signals.snapshot')
+    os.environ['PROCESS_LOCK_DIR'] = os.path.join(workdir, 'locks')
+    os.environ['RATE_LIMIT_DIR'] = os.path.join(workdir, 'ratelimit')
+    os.environ['JOB_STATE_DIR'] = os.path.join(workdir, 'jobs')
+    os.environ['EVENTS_PATH'] = os.path.join(workdir, 'events', 'events.sse')
+    os.environ['METRICS_DIR'] = os.path.join(workdir, 'metrics')
+    # Sin réplica automática en segundo plano: se mide la escritura explícitamente
+    os.environ['SHEETS_REPLICATION_INTERVAL'] = '3600'
+    # El sheet es local: sin límite de ritmo. Con --quota el limitador de
+    # búsqueda arranca por debajo de la cuota y tiene que encontrarla solo.
+    os.environ['SHEETS_RATE_LIMIT'] = os.environ['SHEETS_RATE_LIMIT_MAX'] = '100000'
+    if quota:
+        os.environ['SEARCH_RATE_LIMIT'] = str(quota / 2)
+        os.environ['SEARCH_RATE_LIMIT_MAX'] = str(quota * 4)
+    else:
+        os.environ['SEARCH_RATE_LIMIT'] = os.environ['SEARCH_RATE_LIMIT_MAX'] = '100000'
+
+def bench_scale(num_queries, results_per_query, workers, api_requests):
+    """Ejecuta todas las etapas para num_queries queries"""
+    import google_search
+    import sheets_writer
+    import web_app
+    from benchmarks.fake_sheets import install_fake_sheet
+    from classifiers import classify_many
+    from dedup import dedup_results
+    from processors import process_signal
+    from signal_store import get_signal_store
+
+    queries = [f"benchmark query {i} madrid summer" for i in range(num_queries)]
+    stages = {}
+
+    # Búsqueda concurrente (como main.main) y latencia de queries sueltas
+    completed_after = []
+    t0 = time.perf_counter()
+    search_results = google_search.search_many(
+        queries, num_results=results_per_query, max_workers=workers, use_cache=False,
+        on_query_done=lambda query, results, error: completed_after.append(time.perf_counter() - t0)
+    )
+    elapsed = time.perf_counter() - t0
+    errors = sum(1 for _, _, error in search_results if error)
+    single = []
+    for query in queries[:20]:
+        t = time.perf_counter()
+        google_search.search_google(query, results_per_query, use_cache=False)
+        single.append(time.perf_counter() - t)
+    stages['search'] = _stage(elapsed, num_queries, errors=errors,
+                              query_latency=_percentiles(single),
+                              completed_after=_percentiles(completed_after))
+
+    successful = [(query, results) for query, results, error in search_results if not error]
+    t = time.perf_counter()
+    unique = dedup_results(successful)
+    stages['dedup'] = _stage(time.perf_counter() - t, sum(len(r) for _, r in successful), unique=len(unique))
+
+    # Extracción (una llamada por resultado, como process_signal)
+    t = time.perf_counter()
+    signals = [s for s in (process_signal(result, 'benchmark') for result in unique) if s]
+    seconds = time.perf_counter() - t
+    stages['process_signal'] = _stage(seconds, len(unique), us_per_item=_per_item_us(seconds, len(unique)))
+
+    t = time.perf_counter()
+    for signal, priority in zip(signals, classify_many(signals)):
+        signal['prioridad'] = priority
+    seconds = time.perf_counter() - t
+    stages['classify_priority'] = _stage(seconds, len(signals), us_per_item=_per_item_us(seconds, len(signals)))
+
+    # Escritura en Sheets: carga inicial y sincronización con un 10% de cambios
+    sheet = install_fake_sheet()
+    t = time.perf_counter()
+    sheets_writer.write_signals_to_sheet(signals)
+    initial = time.perf_counter() - t
+    initial_calls = dict(sheet.calls)
+    initial_cells = sheet.cells_written
+    sheet.calls.clear()
+    sheet.cells_written = 0
+    changed = [dict(s, prioridad='Alta') if i % 10 == 0 else s for i, s in enumerate(signals)]
+    t = time.perf_counter()
+    sheets_writer.write_signals_to_sheet(changed)
+    incremental = time.perf_counter() - t
+    stages['sheets_write'] = {
+        'initial': _stage(initial, len(signals), api_calls=initial_calls, cells_written=initial_cells),
+        'incremental_10pct': _stage(incremental, len(signals), api_calls=dict(sheet.calls),
+                                    cells_written=sheet.cells_written)
+    }
+
+    # /api/signals desde el almacén local
+    store = get_signal_store()
+    store.replace_signals(signals)
+    client = web_app.app.test_client()
+    web_app.signals_cache.invalidate()
+    t = time.perf_counter()
+    response = client.get('/api/signals')
+    cold = time.perf_counter() - t
+    warm, paged, not_modified = [], [], []
+    etag = response.headers.get('ETag')
+    for _ in range(api_requests):
+        t = time.perf_counter()
+        client.get('/api/signals')
+        warm.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        client.get('/api/signals?page=1&page_size=25&sort=prioridad&prioridad=Alta')
+        paged.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        client.get('/api/signals', headers={'If-None-Match': etag})
+        not_modified.append(time.perf_counter() - t)
+    stages['api_signals'] = {
+        'signals': len(signals),
+        'payload_bytes': len(response.data),
+        'cold_ms': round(cold * 1000, 3),
+        'full': _percentiles(warm),
+        'paged': _percentiles(paged),
+        'not_modified': _percentiles(not_modified)
+    }
+
+    return {'queries': num_queries, 'results_per_query': results_per_query, 'stages': stages}
+
+def _per_item_us(seconds, items):
+    return round(seconds / items * 1e6, 3) if items else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline del motor de señales')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help='Número de queries por escala')
+    parser.add_argument('--results-per-query', type=int, default=15)
+    parser.add_argument('--workers', type=int, default=8, help='Búsquedas simultáneas')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latencia simulada de Custom Search (s)')
+    parser.add_argument('--api-requests', type=int, default=50, help='Peticiones a /api/signals por escala')
+    parser.add_argument('--quota', type=float, help='Cuota simulada de Custom Search (peticiones/s, responde 429)')
+    parser.add_argument('--fixtures', help='Respuestas grabadas de Custom Search (JSON {query: items})')
+    parser.add_argument('--output', help='Fichero donde guardar el JSON (por defecto stdout)')
+    args = parser.parse_args()
+
+    from benchmarks.fake_search_server import FakeSearchServer, load_fixtures
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else None
+    with tempfile.TemporaryDirectory() as workdir, \
+            FakeSearchServer(latency=args.latency, fixtures=fixtures, quota=args.quota) as server:
+        _configure_environment(workdir, server.url, args.quota)
+        # Los módulos del motor imprimen su progreso; el informe va aparte
+        report = {
+            'benchmark': 'end_to_end',
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'settings': {
+                'workers': args.workers,
+                'latency_s': args.latency,
+                'quota_rps': args.quota,
+                'results_per_query': args.results_per_query
+            },
+            'scales': []
+        }
+        stdout = sys.stdout
+        for scale in args.scales:
+            requests_before = server.requests
+            throttled_before = server.throttled
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                result = bench_scale(scale, args.results_per_query, args.workers, args.api_requests)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            result['search_api_requests'] = server.requests - requests_before
+            result['search_throttled'] = server.throttled - throttled_before
+            report['scales'].append(result)
+            print(f"📏 {scale} queries: búsqueda {result['stages']['search']['seconds']} s", file=sys.stderr)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,273 @@
 """
 Módulo para clasificar la prioridad de las señales
+
+Las reglas (pesos por campo, listas de keywords y dominios y umbrales) se
+leen de priority_rules.json; sin ese fichero se usan las reglas por
+defecto de DEFAULT_RULES.
 """
+import hashlib
+import json
+import os
+import re
+import threading
+from urllib.parse import urlparse
+
+RULES_PATH = os.environ.get(
+    'PRIORITY_RULES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'priority_rules.json')
+)
+
+PRIORITIES = ('Alta', 'Media', 'Baja')
+
+# Combinaciones de términos cuya puntuación se memoriza por campo
+SCORE_CACHE_SIZE = 10000
+
+# Campos de texto en los que se buscan keywords
+TEXT_FIELDS = ('titulo', 'snippet')
+
+DEFAULT_RULES = {
+    'thresholds': {'Alta': 3, 'Media': 1},
+    'fields': {'email': 2, 'telefono': 1},
+    'keywords': {
+        'titulo': [
+            {'weight': 1, 'terms': ['contact', 'admissions', 'housing', 'accommodation']}
+        ],
+        'snippet': []
+    },
+    'domains': []
+}
+
+def _trie_pattern(terms):
+    """
+    Expresión regular que reconoce cualquiera de terms, en forma de trie
+
+    Los prefijos comunes se factorizan ("housing|house" pasa a
+    "hous(?:ing|e)"), así en cada posición del texto el motor compara un
+    carácter contra una rama y no contra cada término de la lista. Ante
+    varios términos que empiezan en la misma posición gana el más largo
+    (PriorityRules suma también los que contiene).
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        end = node.get('', False)
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and not end:
+            return branches[0]
+        body = '(?:' + '|'.join(branches) + ')'
+        return body + '?' if end else body
+
+    return build(trie)
+
+class PriorityRules:
+    """
+    Reglas de puntuación compiladas
+
+    Cada lista de keywords suma su peso una sola vez aunque aparezcan
+    varios de sus términos. Todos los términos de un campo se compilan en
+    una única expresión regular con forma de trie (ver _trie_pattern), así
+    el coste de buscar no crece término a término al ampliar el vocabulario.
+
+    Args:
+        config: Diccionario con las claves de DEFAULT_RULES:
+            thresholds: Puntuación mínima de 'Alta' y 'Media'
+            fields: {campo: peso} sumado si el campo tiene valor
+            keywords: {campo_de_texto: [{'weight', 'terms'}]}
+            domains: [{'domains': [...], 'weight': n}] o
+                [{'domains': [...], 'priority': 'Baja'}] para fijar la
+                prioridad (lista de exclusión o de inclusión forzada)
+    """
+
+    def __init__(self, config):
+        # Identifica la configuración: cambia si cambia cualquier regla
+        self.digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        thresholds = config.get('thresholds', DEFAULT_RULES['thresholds'])
+        self.high = thresholds['Alta']
+        self.medium = thresholds['Media']
+        self.fields = dict(config.get('fields', {}))
+
+        self.keyword_weights = {}
+        self.matchers = {}
+        self.term_groups = {}
+        self._score_cache = {}
+        for field, groups in config.get('keywords', {}).items():
+            if field not in TEXT_FIELDS:
+                raise ValueError(f"Campo de keywords desconocido: {field}")
+            self._compile_keywords(field, groups)
+
+        self.domain_rules = {}
+        for rule in config.get('domains', []):
+            if 'priority' in rule and rule['priority'] not in PRIORITIES:
+                raise ValueError(f"Prioridad desconocida: {rule['priority']}")
+            effect = ('priority', rule['priority']) if 'priority' in rule else ('weight', rule.get('weight', 0))
+            for domain in rule['domains']:
+                self.domain_rules[domain.lower().strip('.')] = effect
+
+    def _compile_keywords(self, field, groups):
+        groups_by_term = {}
+        weights = []
+        for index, group in enumerate(groups):
+            weights.append(group.get('weight', 1))
+            for term in group['terms']:
+                term = term.lower()
+                if term:
+                    groups_by_term.setdefault(term, set()).add(index)
+        if not groups_by_term:
+            return
+        # Un término largo puede contener a otro más corto de otra lista
+        # ("contacto" contiene "contact"); el match del largo cuenta para ambos
+        terms = sorted(groups_by_term, key=len, reverse=True)
+        for term in terms:
+            for other, indexes in groups_by_term.items():
+                if other != term and other in term:
+                    groups_by_term[term] = groups_by_term[term] | indexes
+        self.keyword_weights[field] = weights
+        self.term_groups[field] = {term: frozenset(indexes) for term, indexes in groups_by_term.items()}
+        # Dentro de un lookahead el match no consume texto: se prueba en
+        # cada posición y los términos que se solapan sin contenerse
+        # ("abc" y "bcd" en "abcd") se encuentran todos, como al buscar
+        # cada término por separado
+        self.matchers[field] = re.compile(f"(?=({_trie_pattern(terms)}))")
+        self._score_cache[field] = {}
+
+    def _domain_effect(self, url):
+        """Regla del dominio más específico que cubre el host de url, o None"""
+        if not self.domain_rules or not url:
+            return None
+        host = urlparse(url).hostname or ''
+        labels = host.split('.')
+        for i in range(len(labels)):
+            effect = self.domain_rules.get('.'.join(labels[i:]))
+            if effect is not None:
+                return effect
+        return None
 
-def classify_priority(signal):
+    def _keyword_score(self, field, found):
+        """Peso de los términos encontrados (memorizado por combinación)"""
+        key = frozenset(found)
+        cache = self._score_cache[field]
+        score = cache.get(key)
+        if score is None:
+            term_groups = self.term_groups[field]
+            groups = set()
+            for term in key:
+                groups |= term_groups[term]
+            weights = self.keyword_weights[field]
+            score = sum(weights[index] for index in groups)
+            if len(cache) >= SCORE_CACHE_SIZE:
+                cache.clear()
+            cache[key] = score
+        return score
+
+    def _base_score(self, signal):
+        score = 0
+        for field, weight in self.fields.items():
+            if signal.get(field):
+                score += weight
+        return score
+
+    def _finish(self, signal, score):
+        if self.domain_rules:
+            effect = self._domain_effect(signal.get('url'))
+            if effect is not None:
+                kind, value = effect
+                if kind == 'priority':
+                    return value
+                score += value
+        if score >= self.high:
+            return 'Alta'
+        elif score >= self.medium:
+            return 'Media'
+        else:
+            return 'Baja'
+
+    def classify(self, signal):
+        """Prioridad de una sola señal"""
+        return self.classify_many([signal])[0]
+
+    def classify_many(self, signals):
+        """
+        Prioridades de una lista de señales, en el mismo orden
+
+        Las reglas se recorren una vez por lote y no por señal, y la
+        puntuación de cada combinación de términos encontrados se calcula
+        una sola vez.
+        """
+        scores = [self._base_score(signal) for signal in signals]
+        for field, matcher in self.matchers.items():
+            findall = matcher.findall
+            for index, signal in enumerate(signals):
+                text = signal.get(field)
+                if text:
+                    found = findall(text.lower())
+                    if found:
+                        scores[index] += self._keyword_score(field, found)
+        return [self._finish(signal, score) for signal, score in zip(signals, scores)]
+
+def load_rules(path=RULES_PATH):
+    """
+    Lee y compila las reglas de un fichero JSON
+
+    Returns:
+        PriorityRules con el contenido del fichero, o con DEFAULT_RULES si
+        no existe o no es válido
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return PriorityRules(json.load(f))
+    except FileNotFoundError:
+        return PriorityRules(DEFAULT_RULES)
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"⚠️  Reglas de prioridad no válidas en {path}, usando las de por defecto: {e}")
+        return PriorityRules(DEFAULT_RULES)
+
+_rules = None
+_rules_lock = threading.Lock()
+
+def get_rules():
+    """Reglas compartidas del proceso (se cargan en el primer uso)"""
+    global _rules
+    if _rules is None:
+        with _rules_lock:
+            if _rules is None:
+                _rules = load_rules()
+    return _rules
+
+def reload_rules(path=RULES_PATH):
+    """Vuelve a leer el fichero de reglas (p. ej. tras editarlo)"""
+    global _rules
+    with _rules_lock:
+        _rules = load_rules(path)
+    return _rules
+
+def classify_priority(signal, rules=None):
     """
     Clasifica la prioridad de una señal basándose en la información disponible
-    
+
     Args:
         signal: Diccionario con los datos de la señal
-    
+        rules: PriorityRules a aplicar; por defecto las de priority_rules.json
+
     Returns:
         'Alta', 'Media' o 'Baja'
     """
-    score = 0
-    
-    # Tiene email (+2 puntos)
-    if signal.get('email'):
-        score += 2
-    
-    # Tiene teléfono (+1 punto)
-    if signal.get('telefono'):
-        score += 1
-    
-    # Keywords de alta prioridad
-    high_priority_keywords = ['contact', 'admissions', 'housing', 'accommodation']
-    titulo_lower = signal.get('titulo', '').lower()
-    
-    for keyword in high_priority_keywords:
-        if keyword in titulo_lower:
-            score += 1
-            break
-    
-    # Clasificación
-    if score >= 3:
-        return 'Alta'
-    elif score >= 1:
-        return 'Media'
-    else:
-        return 'Baja'
+    return (rules or get_rules()).classify(signal)
+
+def classify_many(signals, rules=None):
+    """
+    Clasifica una lista de señales en una sola pasada
+
+    Args:
+        signals: Lista de diccionarios con los datos de las señales
+        rules: PriorityRules a aplicar; por defecto las de priority_rules.json
+
+    Returns:
+        Lista de prioridades ('Alta', 'Media' o 'Baja') en el mismo orden
+    """
+    return (rules or get_rules()).classify_many(signals)
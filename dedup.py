@@ -0,0 +1,92 @@
+"""
+Módulo para canonicalizar URLs y eliminar resultados duplicados entre búsquedas
+"""
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Parámetros de seguimiento que no cambian el contenido de la página
+TRACKING_PARAMS = {
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'igshid', 'srsltid', 'ref', 'ref_src'
+}
+TRACKING_PREFIXES = ('utm_', 'hsa_', 'pk_')
+
+def _is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+def canonicalize_url(url):
+    """
+    Normaliza una URL para que variantes de la misma página coincidan
+
+    Unifica el esquema a https, quita 'www.', el puerto por defecto, el
+    fragmento, la barra final y los parámetros de seguimiento, y ordena
+    el resto de parámetros. Si la URL no se puede analizar se devuelve
+    sin cambios.
+    """
+    url = url.strip()
+    if not url:
+        return ''
+
+    try:
+        parts = urlsplit(url if '://' in url else f"https://{url}")
+        port = parts.port
+    except ValueError:
+        # Puerto o host mal formado: la URL tal cual, sin romper la ejecución
+        return url
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if port and port not in (80, 443):
+        host = f"{host}:{port}"
+
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+
+    params = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking_param(k)]
+    query = urlencode(sorted(params))
+
+    return urlunsplit(('https', host, path, query, ''))
+
+def url_digest(url):
+    """Huella estable (SHA-1 hex) de la URL canonicalizada"""
+    return hashlib.sha1(canonicalize_url(url).encode('utf-8')).hexdigest()
+
+def make_signal_id(url):
+    """ID de señal estable entre ejecuciones, derivado de la URL canónica"""
+    return f"SIG-{url_digest(url)[:12].upper()}"
+
+def dedup_results(search_results):
+    """
+    Fusiona los resultados que apuntan a la misma página canónica
+
+    Args:
+        search_results: Lista de tuplas (query, resultados) en orden
+
+    Returns:
+        Lista de resultados únicos en orden de primera aparición. Cada uno
+        es una copia del primero encontrado con 'url_canonica' y 'keywords'
+        (todas las queries que lo devolvieron, sin repetir). Los snippets
+        distintos de las copias se concatenan para no perder contactos.
+    """
+    index = {}
+    unique = []
+    for query, results in search_results:
+        for result in results:
+            canonical = canonicalize_url(result.get('url', ''))
+            if not canonical:
+                continue
+            merged = index.get(canonical)
+            if merged is None:
+                merged = dict(result, url_canonica=canonical, keywords=[])
+                index[canonical] = merged
+                unique.append(merged)
+            else:
+                snippet = result.get('snippet', '')
+                current = merged.get('snippet', '')
+                if snippet and snippet not in current:
+                    merged['snippet'] = f"{current} … {snippet}" if current else snippet
+            if query not in merged['keywords']:
+                merged['keywords'].append(query)
+    return unique
@@ -0,0 +1,284 @@
+"""
+Enriquecimiento de señales: visita las páginas de los resultados para
+buscar el email y el teléfono que no aparecen en el snippet
+
+Es una etapa opcional del motor (ENRICH_PAGES=1). Las páginas se
+descargan en paralelo con un límite de conexiones por host, se cortan al
+llegar a ENRICH_MAX_BYTES y se analizan a medida que llegan: en cuanto
+aparecen email y teléfono se deja de leer.
+"""
+import codecs
+import os
+import re
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from processors import extract_email, extract_phone
+
+ENRICHMENT_ENABLED = os.environ.get('ENRICH_PAGES', '0') == '1'
+# Páginas descargándose a la vez en total y por host
+ENRICH_WORKERS = int(os.environ.get('ENRICH_WORKERS', 16))
+ENRICH_PER_HOST = int(os.environ.get('ENRICH_PER_HOST', 2))
+# Bytes máximos leídos por página y timeout (s) de conexión y lectura
+ENRICH_MAX_BYTES = int(os.environ.get('ENRICH_MAX_BYTES', 512 * 1024))
+ENRICH_TIMEOUT = float(os.environ.get('ENRICH_TIMEOUT', 8))
+# Subpáginas de contacto a visitar si la página principal no basta
+ENRICH_SUBPAGES = int(os.environ.get('ENRICH_SUBPAGES', 1))
+
+USER_AGENT = 'SignalsMadridBot/1.0'
+CHUNK_SIZE = 16 * 1024
+
+# Enlaces que suelen llevar a la página de contacto
+CONTACT_LINK_RE = re.compile(
+    r'contact|contacto|kontakt|about|quienes|sobre-nosotros|aviso-legal|legal|impressum',
+    re.IGNORECASE
+)
+# Un teléfono español tiene 9 dígitos; menos suele ser una fecha o un código
+MIN_PHONE_DIGITS = 9
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Sesión HTTP compartida para las descargas de páginas"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=ENRICH_WORKERS, pool_maxsize=ENRICH_WORKERS)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['User-Agent'] = USER_AGENT
+                _session = session
+    return _session
+
+def _plausible_phone(phone):
+    return phone is not None and sum(c.isdigit() for c in phone) >= MIN_PHONE_DIGITS
+
+class ContactParser(HTMLParser):
+    """
+    Analizador incremental que busca un email y un teléfono
+
+    Prefiere los enlaces mailto: y tel: y, si no los hay, aplica
+    extract_email/extract_phone al texto visible. También recoge los
+    enlaces que parecen páginas de contacto.
+    """
+
+    SKIP_TAGS = ('script', 'style', 'noscript', 'template')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.email = None
+        self.phone = None
+        self.contact_links = []
+        self._skip = 0
+
+    @property
+    def complete(self):
+        return self.email is not None and self.phone is not None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+            return
+        if tag != 'a':
+            return
+        href = (dict(attrs).get('href') or '').strip()
+        lower = href.lower()
+        if lower.startswith('mailto:'):
+            if self.email is None:
+                self.email = extract_email(href[7:].split('?')[0])
+        elif lower.startswith('tel:'):
+            if self.phone is None:
+                phone = extract_phone(href[4:])
+                if _plausible_phone(phone):
+                    self.phone = phone
+        elif href and CONTACT_LINK_RE.search(href):
+            self.contact_links.append(href)
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if self._skip or self.complete:
+            return
+        if self.email is None:
+            self.email = extract_email(data)
+        if self.phone is None:
+            phone = extract_phone(data)
+            if _plausible_phone(phone):
+                self.phone = phone
+
+class HostLimiter:
+    """Semáforo por host para no abrir más de limit conexiones a cada uno"""
+
+    def __init__(self, limit=ENRICH_PER_HOST):
+        self.limit = limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def semaphore(self, host):
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return semaphore
+
+def _decoder(response, content_type):
+    """Decodificador incremental; sin charset declarado se asume UTF-8"""
+    encoding = response.encoding if 'charset' in content_type.lower() else 'utf-8'
+    try:
+        return codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+def fetch_contacts(url, host_limiter, max_bytes=ENRICH_MAX_BYTES, timeout=ENRICH_TIMEOUT,
+                   session=None):
+    """
+    Descarga una página y devuelve el ContactParser con lo encontrado
+
+    Solo lee HTML y como mucho max_bytes; corta la descarga en cuanto el
+    analizador tiene email y teléfono.
+
+    Returns:
+        ContactParser, o None si la página no es HTML
+
+    Raises:
+        requests.RequestException si falla la descarga
+    """
+    parser = ContactParser()
+    host = urlparse(url).netloc.lower()
+    with host_limiter.semaphore(host), metrics.timed('enrich_page'):
+        with (session or get_session()).get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            if 'html' not in content_type.lower():
+                return None
+            decoder = _decoder(response, content_type)
+            read = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                read += len(chunk)
+                parser.feed(decoder.decode(chunk))
+                if parser.complete or read >= max_bytes:
+                    break
+            metrics.count('enrich_bytes', 'read', read)
+    return parser
+
+def _contact_subpages(url, parser, limit):
+    """URLs absolutas de las páginas de contacto del mismo host"""
+    host = urlparse(url).netloc.lower()
+    seen = {url.split('#')[0]}
+    pages = []
+    for href in parser.contact_links:
+        absolute = urljoin(url, href).split('#')[0]
+        parsed = urlparse(absolute)
+        if parsed.scheme not in ('http', 'https') or parsed.netloc.lower() != host or absolute in seen:
+            continue
+        seen.add(absolute)
+        pages.append(absolute)
+        if len(pages) >= limit:
+            break
+    return pages
+
+def enrich_url(url, host_limiter, subpages=ENRICH_SUBPAGES, should_cancel=None):
+    """
+    Busca email y teléfono en una URL y, si faltan, en sus páginas de contacto
+
+    Returns:
+        Tupla (email, telefono); cualquiera puede ser None
+    """
+    email = phone = None
+    pending = [url]
+    visited = 0
+    while pending and visited <= subpages:
+        if should_cancel and should_cancel():
+            break
+        page = pending.pop(0)
+        visited += 1
+        try:
+            parser = fetch_contacts(page, host_limiter)
+        except requests.RequestException:
+            # Solo el fallo de la página principal invalida la señal
+            if page == url:
+                raise
+            continue
+        if parser is None:
+            continue
+        email = email or parser.email
+        phone = phone or parser.phone
+        if email and phone:
+            break
+        if page == url and subpages:
+            pending = _contact_subpages(url, parser, subpages)
+    return email, phone
+
+def _interleave_by_host(signals):
+    """Reordena las señales alternando hosts para no bloquear hilos en un mismo host"""
+    queues = defaultdict(deque)
+    for signal in signals:
+        queues[urlparse(signal['url']).netloc.lower()].append(signal)
+    ordered = []
+    while queues:
+        for host in list(queues):
+            ordered.append(queues[host].popleft())
+            if not queues[host]:
+                del queues[host]
+    return ordered
+
+def enrich_signals(signals, max_workers=ENRICH_WORKERS, per_host=ENRICH_PER_HOST,
+                   subpages=ENRICH_SUBPAGES, should_cancel=None):
+    """
+    Completa en el sitio el email y el teléfono de las señales que no los tienen
+
+    Args:
+        signals: Lista de señales (process_signals)
+        max_workers: Descargas simultáneas en total
+        per_host: Descargas simultáneas por host
+        subpages: Páginas de contacto a visitar por señal si la principal
+            no tiene ambos datos
+        should_cancel: Función opcional; si devuelve True no se descargan
+            más páginas
+
+    Returns:
+        Número de señales a las que se añadió algún dato
+    """
+    pending = [s for s in signals if s.get('url') and not (s.get('email') and s.get('telefono'))]
+    if not pending:
+        return 0
+
+    host_limiter = HostLimiter(per_host)
+
+    def enrich_one(signal):
+        if should_cancel and should_cancel():
+            return False
+        try:
+            email, phone = enrich_url(signal['url'], host_limiter, subpages, should_cancel)
+        except Exception as e:
+            metrics.count('enrichment', 'error')
+            print(f"  ⚠️  No se pudo enriquecer {signal['url']}: {e}")
+            return False
+        changed = False
+        if email and not signal.get('email'):
+            signal['email'] = email
+            metrics.count('enrichment', 'email')
+            changed = True
+        if phone and not signal.get('telefono'):
+            signal['telefono'] = phone
+            metrics.count('enrichment', 'phone')
+            changed = True
+        return changed
+
+    with metrics.timed('enrich_signals', items=len(pending)):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            enriched = sum(executor.map(enrich_one, _interleave_by_host(pending)))
+    print(f"🔗 {enriched} de {len(pending)} señales enriquecidas con datos de su página")
+    return enriched
@@ -0,0 +1,347 @@
+"""
+Bus de eventos para emitir el avance del motor por Server-Sent Events
+
+En un solo proceso los eventos se reparten en memoria. Con varios workers
+WSGI (EventBus.share) se escriben en un fichero que leen los clientes de
+cualquier worker, así el progreso llega aunque el motor corra en otro.
+"""
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+
+# Eventos que se guardan para reenviar a clientes que se conectan a mitad de ejecución
+HISTORY_SIZE = 5000
+# Eventos pendientes por cliente antes de desconectarlo por lento
+SUBSCRIBER_QUEUE_SIZE = 1000
+# Fichero compartido entre workers (ver EventBus.share)
+EVENTS_PATH = os.environ.get('EVENTS_PATH', '/app/data/events/events.sse')
+# Segundos entre lecturas del fichero compartido
+POLL_INTERVAL = 0.25
+# Un cliente conectado a otro worker cuenta como suscriptor durante estos segundos
+LISTENER_TTL = 20
+
+_CLOSE = object()
+
+class SubscriptionClosed(Exception):
+    """La suscripción se cerró porque el cliente no consumía a tiempo"""
+
+def format_sse(event_id, event_type, data):
+    """Serializa un evento en formato text/event-stream"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n"
+
+class Subscription:
+    """Cola de eventos ya serializados de un cliente"""
+
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def get(self, timeout=None):
+        """
+        Devuelve el siguiente evento serializado
+
+        Returns:
+            El texto SSE del evento, o None si venció el timeout sin eventos
+
+        Raises:
+            SubscriptionClosed: si el bus cerró la suscripción
+        """
+        try:
+            item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if item is _CLOSE:
+            raise SubscriptionClosed()
+        return item
+
+    def _put(self, chunk):
+        try:
+            self._queue.put_nowait(chunk)
+            return True
+        except queue.Full:
+            return False
+
+    def _close(self):
+        self.closed = True
+        # Vaciar para que la marca de cierre siempre quepa
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._queue.put_nowait(_CLOSE)
+
+class _FileTail:
+    """
+    Lector del fichero compartido (EventBus.share): uno por proceso
+
+    Un hilo de fondo (greenlet con el worker gevent) lee cada
+    POLL_INTERVAL los eventos nuevos y los reparte con EventBus._dispatch
+    a los clientes del proceso, así el coste no crece con el número de
+    clientes. Cuando el fichero se sustituye (nueva ejecución) termina de
+    leer el anterior antes de pasar al nuevo, así no se pierde el
+    'run_finished'.
+    """
+
+    def __init__(self, bus, path):
+        self.bus = bus
+        self.path = path
+        self.inode = None
+        self._file = None
+        self._buffer = b''
+        self._touched = 0
+        self._thread = threading.Thread(target=self._run, name='events-tail', daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        if self._file is not None:
+            self._file.close()
+        self._buffer = b''
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            self._file, self.inode = None, None
+            return
+        self.inode = os.fstat(self._file.fileno()).st_ino
+
+    def _replaced(self):
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return False
+
+    def _read(self):
+        """Eventos completos escritos desde la última lectura"""
+        if self._file is None:
+            return []
+        data = self._buffer + self._file.read()
+        *chunks, self._buffer = data.split(b'\n\n')
+        return [chunk.decode('utf-8') + '\n\n' for chunk in chunks]
+
+    def _touch(self):
+        """Avisa al motor (en cualquier worker) de que hay alguien escuchando"""
+        now = time.monotonic()
+        if now - self._touched < LISTENER_TTL / 4:
+            return
+        self._touched = now
+        try:
+            with open(self.path + '.listeners', 'a'):
+                pass
+            os.utime(self.path + '.listeners')
+        except OSError:
+            pass
+
+    def poll(self):
+        """Lee y reparte lo nuevo; cambia de fichero si se ha sustituido"""
+        if self.bus.subscriber_count():
+            self._touch()
+        chunks = self._read()
+        if self._file is None or self._replaced():
+            # Ya nadie escribe en el anterior: lo último que quede va con él
+            chunks += self._read()
+            if chunks:
+                self.bus._dispatch(self.inode, chunks)
+            previous = self.inode
+            self._open()
+            if self.inode != previous:
+                self.bus._dispatch(self.inode, self._read(), new_file=True)
+        elif chunks:
+            self.bus._dispatch(self.inode, chunks)
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"⚠️  Error leyendo el fichero de eventos: {e}")
+            time.sleep(POLL_INTERVAL)
+
+class EventBus:
+    """
+    Reparte eventos a todos los clientes conectados
+
+    Cada evento se serializa una sola vez al publicarlo; los clientes solo
+    copian el texto ya preparado, así que añadir clientes no multiplica el
+    trabajo del motor. Un cliente que no consume a tiempo se desconecta
+    (el navegador reconecta con Last-Event-ID y recupera lo perdido del
+    historial).
+
+    Con share el historial y el reparto a los clientes de cada proceso
+    los hace un único lector del fichero (_FileTail).
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self._subscribers = set()
+        self._history = deque(maxlen=history_size)
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self.path = None
+        self._file = None
+        self._file_pid = None
+        self._inode = None
+        self._tail = None
+        self._tail_pid = None
+        self._tail_lock = threading.Lock()
+
+    def share(self, path=EVENTS_PATH):
+        """
+        Reparte los eventos a través de un fichero en lugar de la memoria
+
+        Con varios workers el motor publica en el worker que lo ejecuta y
+        los clientes SSE pueden estar en cualquier otro. El fichero solo
+        tiene los eventos de la ejecución en curso: reset_history lo
+        sustituye por uno vacío.
+        """
+        self.path = path
+
+    def _ensure_tail(self):
+        """Arranca el lector del fichero de este proceso (también tras un fork)"""
+        with self._tail_lock:
+            if self._tail is None or self._tail_pid != os.getpid():
+                self._tail = _FileTail(self, self.path)
+                self._tail_pid = os.getpid()
+
+    def _dispatch(self, inode, chunks, new_file=False):
+        """
+        Reparte a los clientes del proceso los eventos leídos del fichero
+
+        Args:
+            inode: Inodo del fichero del que salen (parte del id de evento)
+            chunks: Eventos ya serializados, en orden
+            new_file: True si empieza un fichero nuevo (se olvida el historial)
+        """
+        with self._lock:
+            if new_file:
+                self._history.clear()
+                self._next_id = 1
+            for chunk in chunks:
+                self._history.append(((inode, self._next_id), chunk))
+                self._next_id += 1
+                slow = [sub for sub in self._subscribers if not sub._put(chunk)]
+                for sub in slow:
+                    self._subscribers.discard(sub)
+                    sub._close()
+
+    def _is_after(self, last_event_id):
+        """Función que dice si un id del historial es posterior a last_event_id"""
+        if self.path:
+            # '<inodo>-<número>': en otro fichero todo es posterior
+            inode, _, seq = (last_event_id or '').partition('-')
+            if inode.isdigit() and seq.isdigit():
+                return lambda event_id: event_id[0] != int(inode) or event_id[1] > int(seq)
+            return lambda event_id: True
+        try:
+            after = int(last_event_id) if last_event_id else 0
+        except ValueError:
+            after = 0
+        return lambda event_id: event_id > after
+
+    def _rotate(self):
+        """Sustituye el fichero compartido por uno vacío"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.events-', suffix='.tmp')
+        os.chmod(tmp_path, 0o644)
+        new_file = os.fdopen(fd, 'a', encoding='utf-8')
+        os.replace(tmp_path, self.path)
+        if self._file is not None and self._file_pid == os.getpid():
+            self._file.close()
+        self._file, self._file_pid = new_file, os.getpid()
+        self._inode = os.fstat(fd).st_ino
+        self._write_seq = 1
+
+    def _append(self, event_type, data):
+        # El id lleva el inodo del fichero para reanudar solo en el mismo
+        if self._file is None or self._file_pid != os.getpid():
+            self._rotate()
+        event_id = f"{self._inode}-{self._write_seq}"
+        self._write_seq += 1
+        self._file.write(format_sse(event_id, event_type, data))
+        self._file.flush()
+        return event_id
+
+    def publish(self, event_type, data):
+        """Publica un evento y lo encola para todos los suscriptores"""
+        with self._lock:
+            event_id = self._publish(event_type, data)
+        # Con el worker gevent el motor comparte hilo con las peticiones:
+        # cada evento es un punto en el que les cede el turno
+        time.sleep(0)
+        return event_id
+
+    def _publish(self, event_type, data):
+        if self.path:
+            try:
+                return self._append(event_type, data)
+            except OSError as e:
+                print(f"⚠️  No se pudo publicar el evento {event_type}: {e}")
+                return None
+        event_id = self._next_id
+        self._next_id += 1
+        chunk = format_sse(event_id, event_type, data)
+        self._history.append((event_id, chunk))
+        slow = [sub for sub in self._subscribers if not sub._put(chunk)]
+        for sub in slow:
+            self._subscribers.discard(sub)
+            sub._close()
+        return event_id
+
+    def subscribe(self, last_event_id=None):
+        """
+        Registra un cliente nuevo
+
+        Args:
+            last_event_id: Último id recibido por el cliente (cabecera
+                Last-Event-ID); se le reenvían los eventos posteriores que
+                sigan en el historial. Sin él se reenvía todo el historial.
+        """
+        sub = Subscription()
+        is_after = self._is_after(last_event_id)
+        with self._lock:
+            for event_id, chunk in self._history:
+                if is_after(event_id) and not sub._put(chunk):
+                    break
+            self._subscribers.add(sub)
+        if self.path:
+            self._ensure_tail()
+        return sub
+
+    def unsubscribe(self, sub):
+        """Da de baja a un cliente"""
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def reset_history(self):
+        """Olvida el historial (al empezar y al terminar cada ejecución)"""
+        with self._lock:
+            if not self.path:
+                self._history.clear()
+                return
+            # El lector de cada proceso vacía su historial al ver el fichero nuevo
+            try:
+                self._rotate()
+            except OSError as e:
+                print(f"⚠️  No se pudo vaciar el fichero de eventos: {e}")
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def has_subscribers(self):
+        """True si hay clientes conectados a este proceso o, con share, a otro worker"""
+        if self.subscriber_count():
+            return True
+        if not self.path:
+            return False
+        try:
+            return time.time() - os.path.getmtime(self.path + '.listeners') < LISTENER_TTL
+        except OSError:
+            return False
+
+# Bus compartido por el motor y la web dentro del mismo proceso
+event_bus = EventBus()
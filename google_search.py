@@ -2,50 +2,262 @@
 Módulo para realizar búsquedas en Google usando Custom Search API
 """
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from search_cache import DEFAULT_TTL, get_search_cache
+from rate_limit import call_with_retry
+import metrics
 
-def search_google(query, num_results=10):
+# Se puede apuntar a un servidor local (benchmarks) con GOOGLE_SEARCH_API_URL
+SEARCH_API_URL = os.environ.get('GOOGLE_SEARCH_API_URL', "https://www.googleapis.com/customsearch/v1")
+
+# Custom Search no devuelve resultados más allá de la posición 100
+MAX_SEARCH_DEPTH = 100
+PAGE_SIZE = 10  # Google API max 10 per request
+
+# Tamaño del pool de conexiones HTTP compartido entre hilos
+HTTP_POOL_SIZE = int(os.environ.get('SEARCH_HTTP_POOL_SIZE', 16))
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
     """
-    Realiza una búsqueda en Google y devuelve los resultados
-    
+    Devuelve una sesión HTTP compartida con pool de conexiones
+
+    La sesión reutiliza las conexiones TLS con googleapis.com entre
+    búsquedas y entre hilos, en lugar de abrir una conexión nueva por query.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+def _get_credentials():
+    """Devuelve (api_key, search_engine_id) desde variables de entorno"""
+    return os.environ.get('GOOGLE_API_KEY'), os.environ.get('GOOGLE_SEARCH_ENGINE_ID')
+
+def _fetch_page(query, start, num, api_key, search_engine_id, api_calls=None):
+    """
+    Pide una página de resultados a la API y la devuelve normalizada
+
     Args:
         query: Término de búsqueda
-        num_results: Número de resultados a devolver
-    
+        start: Posición (base 1) del primer resultado de la página
+        num: Número de resultados de la página (máximo 10)
+        api_calls: Dict opcional {query: llamadas} donde se suma cada
+            intento (reintentos incluidos, aunque falle)
+
     Returns:
-        Lista de diccionarios con los resultados
+        Tupla (resultados, hay_mas_paginas). Los 429/5xx se reintentan con
+        el limitador compartido; el resto de excepciones (y las que sigan
+        tras agotar los reintentos) se propagan para que el llamador decida
+        si registrarlas o descartarlas.
     """
-    api_key = os.environ.get('GOOGLE_API_KEY')
-    search_engine_id = os.environ.get('GOOGLE_SEARCH_ENGINE_ID')
-    
-    if not api_key or not search_engine_id:
-        print("⚠️  Error: Faltan variables de entorno GOOGLE_API_KEY o GOOGLE_SEARCH_ENGINE_ID")
-        return []
-    
-    url = "https://www.googleapis.com/customsearch/v1"
     params = {
         'key': api_key,
         'cx': search_engine_id,
         'q': query,
-        'num': min(num_results, 10)  # Google API max 10 per request
+        'num': num,
+        'start': start
     }
-    
+
+    def request():
+        # Cada intento consume una unidad de la cuota diaria de Custom Search
+        metrics.add_api_units('custom_search', 1)
+        if api_calls is not None:
+            api_calls[query] = api_calls.get(query, 0) + 1
+        with metrics.timed('search_page'):
+            response = get_session().get(SEARCH_API_URL, params=params, timeout=10)
+            response.raise_for_status()
+        return response
+
+    data = call_with_retry('custom_search', request).json()
+
+    results = []
+    for item in data.get('items', []):
+        results.append({
+            'titulo': item.get('title', ''),
+            'url': item.get('link', ''),
+            'snippet': item.get('snippet', ''),
+            'displayLink': item.get('displayLink', '')
+        })
+
+    has_more = len(results) == num and 'nextPage' in data.get('queries', {})
+    return results, has_more
+
+def _get_page(query, start, num, api_key, search_engine_id, ttl=DEFAULT_TTL, use_cache=True, api_calls=None):
+    """
+    Igual que _fetch_page pero consultando antes la caché en disco
+
+    Solo se cachean las respuestas correctas; los errores se propagan sin
+    guardar nada. Los aciertos de caché no cuentan en api_calls.
+    """
+    cache = get_search_cache() if use_cache else None
+    if cache is not None:
+        try:
+            cached = cache.get(query, start, num, search_engine_id, ttl)
+        except Exception as e:
+            print(f"⚠️  Error leyendo caché de búsquedas: {e}")
+            cached = None
+        if cached is not None:
+            metrics.count('search_cache', 'hit')
+            return cached['results'], cached['has_more']
+        metrics.count('search_cache', 'miss')
+
+    results, has_more = _fetch_page(query, start, num, api_key, search_engine_id, api_calls)
+
+    if cache is not None:
+        try:
+            cache.set(query, start, num, search_engine_id, {'results': results, 'has_more': has_more})
+        except Exception as e:
+            print(f"⚠️  Error escribiendo caché de búsquedas: {e}")
+
+    return results, has_more
+
+def _iter_pages(query, max_results, api_key, search_engine_id, stop_when=None,
+                ttl=DEFAULT_TTL, use_cache=True, api_calls=None):
+    """Genera los resultados página a página, propagando los errores"""
+    max_results = min(max_results, MAX_SEARCH_DEPTH)
+    collected = []
+    start = 1
+
+    while len(collected) < max_results:
+        num = min(PAGE_SIZE, max_results - len(collected), MAX_SEARCH_DEPTH - start + 1)
+        if num <= 0:
+            return
+        results, has_more = _get_page(query, start, num, api_key, search_engine_id, ttl, use_cache, api_calls)
+
+        for result in results:
+            collected.append(result)
+            yield result
+            if stop_when and stop_when(collected):
+                return
+
+        if not has_more:
+            return
+        start += len(results)
+
+def iter_search_results(query, max_results=10, stop_when=None, ttl=DEFAULT_TTL, use_cache=True):
+    """
+    Recorre los resultados de una búsqueda paginando con el offset 'start'
+
+    Los resultados se generan en cuanto llega su página, así el llamador
+    puede procesarlos mientras se pide la siguiente.
+
+    Args:
+        query: Término de búsqueda
+        max_results: Profundidad máxima (la API no pasa de 100)
+        stop_when: Función opcional que recibe la lista de resultados
+            generados hasta el momento; si devuelve True no se piden más
+            páginas
+        ttl: Antigüedad máxima en segundos de las páginas cacheadas
+        use_cache: False para ignorar la caché en disco e ir siempre a la API
+
+    Yields:
+        Diccionarios con los resultados
+    """
+    api_key, search_engine_id = _get_credentials()
+
+    if not api_key or not search_engine_id:
+        print("⚠️  Error: Faltan variables de entorno GOOGLE_API_KEY o GOOGLE_SEARCH_ENGINE_ID")
+        return
+
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        results = []
-        for item in data.get('items', []):
-            results.append({
-                'titulo': item.get('title', ''),
-                'url': item.get('link', ''),
-                'snippet': item.get('snippet', ''),
-                'displayLink': item.get('displayLink', '')
-            })
-        
-        return results
-    
+        yield from _iter_pages(query, max_results, api_key, search_engine_id, stop_when, ttl, use_cache)
     except Exception as e:
+        metrics.count('errors', 'search_google')
         print(f"❌ Error en búsqueda de Google: {e}")
+
+def search_google(query, num_results=10, stop_when=None, ttl=DEFAULT_TTL, use_cache=True):
+    """
+    Realiza una búsqueda en Google y devuelve los resultados
+
+    Args:
+        query: Término de búsqueda
+        num_results: Número de resultados a devolver (paginando si pasa de 10)
+        stop_when: Condición de parada anticipada (ver iter_search_results)
+        ttl: Antigüedad máxima en segundos de las páginas cacheadas
+        use_cache: False para ignorar la caché en disco
+
+    Returns:
+        Lista de diccionarios con los resultados
+    """
+    with metrics.timed('search_google'):
+        return list(iter_search_results(query, num_results, stop_when, ttl, use_cache))
+
+def search_many(queries, num_results=10, max_workers=8, stop_when=None,
+                ttl=DEFAULT_TTL, use_cache=True, on_query_done=None, should_cancel=None, api_calls=None):
+    """
+    Ejecuta varias búsquedas en paralelo sobre la sesión compartida
+
+    Args:
+        queries: Lista de términos de búsqueda
+        num_results: Número de resultados por búsqueda; puede ser un número
+            o un dict {query: num_results} (ver query_planner)
+        max_workers: Número máximo de búsquedas simultáneas
+        stop_when: Condición de parada anticipada aplicada a cada query
+        ttl: Antigüedad máxima en segundos de las páginas cacheadas; puede
+            ser un número o un dict {query: ttl} con valores por query
+        use_cache: False para ignorar la caché en disco
+        on_query_done: Callback opcional on_query_done(query, resultados, error)
+            que se llama desde el hilo de trabajo al terminar cada query
+        should_cancel: Función opcional; si devuelve True, las queries que
+            aún no han empezado se marcan como canceladas sin llamar a la API
+        api_calls: Dict opcional que se rellena con {query: llamadas pagadas}:
+            peticiones reales a la API, reintentos y páginas fallidas
+            incluidos y aciertos de caché excluidos
+
+    Returns:
+        Lista de tuplas (query, resultados, error) en el mismo orden que
+        queries. error es None si la búsqueda terminó bien; en caso
+        contrario resultados es una lista vacía.
+    """
+    api_key, search_engine_id = _get_credentials()
+
+    if not api_key or not search_engine_id:
+        print("⚠️  Error: Faltan variables de entorno GOOGLE_API_KEY o GOOGLE_SEARCH_ENGINE_ID")
+        error = 'Faltan credenciales de Google Custom Search'
+        return [(query, [], error) for query in queries]
+
+    def search_one(query):
+        if should_cancel and should_cancel():
+            return query, [], 'cancelada'
+        try:
+            query_ttl = ttl.get(query, DEFAULT_TTL) if isinstance(ttl, dict) else ttl
+            query_results = num_results.get(query, PAGE_SIZE) if isinstance(num_results, dict) else num_results
+            with metrics.timed('search_google'):
+                pages = _iter_pages(query, query_results, api_key, search_engine_id, stop_when,
+                                    query_ttl, use_cache, api_calls)
+                return query, list(pages), None
+        except Exception as e:
+            # Como en iter_search_results; el error se devuelve con la query
+            metrics.count('errors', 'search_google')
+            return query, [], str(e)
+
+    def run(query):
+        outcome = search_one(query)
+        if on_query_done:
+            # Un fallo del callback no debe tirar la ejecución ni las demás queries
+            try:
+                on_query_done(*outcome)
+            except Exception as e:
+                metrics.count('errors', 'on_query_done')
+                print(f"⚠️  Error en on_query_done para '{query}': {e}")
+        return outcome
+
+    if not queries:
         return []
+
+    workers = max(1, min(max_workers, len(queries)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # executor.map conserva el orden de entrada aunque terminen desordenadas
+        return list(executor.map(run, queries))
@@ -0,0 +1,51 @@
+"""
+Configuración de gunicorn para producción (se lee sola desde /app)
+
+Uso:
+    gunicorn web_app:app
+
+La aplicación se importa una vez en el proceso maestro (preload_app) y los
+workers la heredan al hacer fork: la plantilla ya generada y comprimida y
+los módulos cargados se comparten en memoria. Cada worker arranca después
+sus hilos de fondo (web_app.start_background_tasks).
+
+Lo que comparten los workers pasa por /app/data: estado de los trabajos
+(JOB_STATE_DIR), instantánea de /api/signals, eventos SSE (EVENTS_PATH) y
+métricas (METRICS_DIR), que /metrics suma sea cual sea el worker que
+responde.
+
+Los workers son gevent: cada conexión es un greenlet, así los clientes de
+/events (abiertos mientras dure la página) no agotan un número fijo de
+hilos y no dejan sin servir /, /api/signals ni /regenerate. El parcheo de
+gevent se hace aquí, antes de que preload_app importe la aplicación, para
+que sus cerrojos y colas ya sean cooperativos.
+"""
+import multiprocessing
+import os
+
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gevent')
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get('WEB_WORKERS', min(4, multiprocessing.cpu_count() * 2 + 1)))
+# Conexiones simultáneas por worker (incluidas las SSE de /events)
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+keepalive = 5
+preload_app = True
+accesslog = '-'
+errorlog = '-'
+
+def on_starting(server):
+    # Aún no hay workers: los trabajos sin terminar y las métricas publicadas
+    # son de un arranque anterior
+    from jobs import JOB_STATE_DIR, abandon_unfinished
+    from metrics import SharedMetrics
+    abandon_unfinished(JOB_STATE_DIR)
+    SharedMetrics().clear()
+
+def post_fork(server, worker):
+    import web_app
+    web_app.start_background_tasks()
@@ -0,0 +1,436 @@
+"""
+Gestor de ejecuciones del motor: una sola en curso y como mucho una en cola
+"""
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from datetime import datetime
+
+from process_lock import ProcessLock
+
+# Número de trabajos terminados que se conservan para /jobs/<id>
+JOB_HISTORY_SIZE = 50
+# Directorio donde cada trabajo publica su estado para que cualquier worker
+# WSGI pueda contestar /jobs/<id> y pasar la cancelación al que lo ejecuta
+JOB_STATE_DIR = os.environ.get('JOB_STATE_DIR', '/app/data/jobs')
+
+JOB_ID_RE = re.compile(r'^job-\d+-(\d+)-\d+$')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
+
+def _state_path(state_dir, job_id, suffix='.json'):
+    return os.path.join(state_dir, job_id + suffix)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _read_state(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _external_requests(state_dir, job_id):
+    """Peticiones de otros procesos agrupadas en un trabajo: un byte cada una en <id>.requests"""
+    try:
+        return os.path.getsize(_state_path(state_dir, job_id, '.requests'))
+    except FileNotFoundError:
+        return 0
+
+def _load_state(state_dir, job_id):
+    """Estado publicado de un trabajo, con las peticiones agrupadas desde otros procesos"""
+    state = _read_state(_state_path(state_dir, job_id))
+    if state is not None:
+        state['requests'] += _external_requests(state_dir, job_id)
+    return state
+
+def _write_state(state_dir, state):
+    """Escribe el estado de un trabajo en state_dir (escritura atómica)"""
+    os.makedirs(state_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=state_dir, prefix='.job-', suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, _state_path(state_dir, state['id']))
+
+def abandon_unfinished(state_dir=JOB_STATE_DIR):
+    """
+    Marca como fallidos los trabajos publicados que no terminaron
+
+    Se llama al arrancar el servidor, antes de crear los workers: un
+    trabajo en cola o en curso de una ejecución anterior ya no tiene
+    proceso, y su pid puede haberlo reutilizado uno nuevo.
+    """
+    try:
+        names = [name for name in os.listdir(state_dir) if name.endswith('.json')]
+    except FileNotFoundError:
+        return
+    for name in names:
+        state = _read_state(os.path.join(state_dir, name))
+        if state is not None and state.get('state') not in FINISHED_STATES:
+            state.update(state=FAILED, error='Interrumpido al reiniciar el servidor', finished_at=_now())
+            _write_state(state_dir, state)
+
+class Job:
+    """
+    Una ejecución del motor con su estado, tiempos y progreso por query
+
+    Args:
+        state_dir: Directorio compartido opcional donde publicar el estado
+            (to_dict) en cada cambio y donde buscar peticiones de cancelación
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, state_dir=None):
+        # El pid distingue los trabajos creados por distintos workers
+        self.id = f"job-{int(time.time())}-{os.getpid()}-{next(self._ids)}"
+        self.state_dir = state_dir
+        self.state = QUEUED
+        self.stage = None
+        self.error = None
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self.requests = 1
+        self.queries = OrderedDict()
+        self.cancel_event = threading.Event()
+        self._started = None
+        self._duration = None
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+
+    def is_cancelled(self):
+        """True si se ha pedido cancelar el trabajo (también desde otro worker)"""
+        if not self.cancel_event.is_set() and self.state_dir \
+                and os.path.exists(_state_path(self.state_dir, self.id, '.cancel')):
+            self.cancel_event.set()
+        return self.cancel_event.is_set()
+
+    def publish(self):
+        """Escribe el estado en state_dir (escritura atómica)"""
+        if not self.state_dir:
+            return
+        try:
+            # En orden: el progreso llega desde varios hilos de búsqueda
+            with self._publish_lock:
+                state = self.to_dict()
+                # Las peticiones de otros procesos se suman al leer (_load_state)
+                state['requests'] = self.requests
+                _write_state(self.state_dir, state)
+        except OSError as e:
+            print(f"⚠️  No se pudo publicar el estado de {self.id}: {e}")
+
+    def record_progress(self, stage, query=None, results=None, error=None, queries=None):
+        """
+        Callback de progreso para main.main
+
+        Args:
+            stage: Etapa actual ('waiting', 'search', 'query_done', 'processing',
+                'writing'...)
+            query: Query afectada (solo en 'query_done')
+            results: Número de resultados de la query
+            error: Error de la query, si falló
+            queries: Lista completa de queries (solo en 'search')
+        """
+        with self._lock:
+            if stage == 'search' and queries:
+                for q in queries:
+                    self.queries[q] = {'state': 'pending', 'results': 0, 'error': None}
+            if stage == 'query_done' and query is not None:
+                self.queries[query] = {
+                    'state': 'failed' if error else 'done',
+                    'results': results or 0,
+                    'error': error
+                }
+            else:
+                self.stage = stage
+        self.publish()
+
+    def _mark_started(self):
+        self.state = RUNNING
+        if self.stage == 'waiting':
+            self.stage = None
+        self.started_at = _now()
+        self._started = time.monotonic()
+        self.publish()
+
+    def _mark_finished(self, state, error=None):
+        self.state = state
+        self.error = error
+        self.finished_at = _now()
+        if self._started is not None:
+            self._duration = time.monotonic() - self._started
+        self.publish()
+
+    def to_dict(self):
+        """Representación JSON del trabajo para la API"""
+        with self._lock:
+            queries = [dict(info, query=q) for q, info in self.queries.items()]
+        done = sum(1 for q in queries if q['state'] != 'pending')
+        duration = self._duration
+        if duration is None and self._started is not None:
+            duration = time.monotonic() - self._started
+        external = _external_requests(self.state_dir, self.id) if self.state_dir else 0
+        return {
+            'id': self.id,
+            'state': self.state,
+            'stage': self.stage,
+            'error': self.error,
+            'requests': self.requests + external,
+            'cancel_requested': self.is_cancelled(),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration_seconds': round(duration, 3) if duration is not None else None,
+            'progress': {
+                'queries_total': len(queries),
+                'queries_done': done,
+                'queries': queries
+            }
+        }
+
+class JobManager:
+    """
+    Ejecuta target(job) en segundo plano sin solapar ejecuciones
+
+    Si llega una petición con un trabajo en curso, se encola un único
+    trabajo de seguimiento; las peticiones siguientes se agrupan en ese
+    mismo trabajo en lugar de crear más.
+
+    Con state_dir el estado de cada trabajo se publica en ese directorio:
+    get_state y cancel funcionan también con trabajos de otros procesos,
+    y submit se agrupa con el trabajo en cola de cualquier proceso. Con
+    lock (un ProcessLock) cada trabajo espera en cola a tenerlo antes de
+    ejecutarse, así entre todos los procesos hay como mucho uno en curso
+    y uno en cola.
+    """
+
+    def __init__(self, target, history_size=JOB_HISTORY_SIZE, state_dir=None, lock=None):
+        self.target = target
+        self.history_size = history_size
+        self.state_dir = state_dir
+        self.lock = lock
+        self._jobs = OrderedDict()
+        self._running = None
+        self._queued = None
+        self._lock = threading.Lock()
+        self._submit_lock = ProcessLock('jobs-submit') if state_dir else None
+
+    def submit(self):
+        """
+        Pide una ejecución
+
+        Returns:
+            Tupla (estado, coalesced): estado (to_dict) del trabajo creado
+            o del que ya estaba en cola, en este proceso o en otro;
+            coalesced es True si la petición se agrupó en ese trabajo
+        """
+        with self._lock:
+            pending = self._coalesce_local()
+            if pending is not None:
+                return pending, True
+        # El cerrojo entre procesos se toma sin tener _lock: mientras otro
+        # proceso hace su submit, los demás hilos de este siguen atendiendo
+        with self._submit_lock or nullcontext():
+            with self._lock:
+                pending = self._coalesce_local()
+                if pending is not None:
+                    return pending, True
+                state = self._coalesce_elsewhere()
+                if state is not None:
+                    return state, True
+                job = Job(self.state_dir)
+                self._remember(job)
+                if self._running is None:
+                    self._start(job)
+                else:
+                    self._queued = job
+                # Publicar antes de soltar _submit_lock: el siguiente submit
+                # de otro proceso debe verlo
+                job.publish()
+                return job.to_dict(), False
+
+    def _coalesce_local(self):
+        """Agrupa la petición en el trabajo en cola de este proceso; su estado, o None"""
+        pending = self._queued
+        if pending is None and self._running is not None and self._running.state == QUEUED:
+            # El trabajo de este proceso aún espera a que termine el de otro
+            pending = self._running
+        if pending is None:
+            return None
+        pending.requests += 1
+        pending.publish()
+        return pending.to_dict()
+
+    def _coalesce_elsewhere(self):
+        """
+        Agrupa la petición en el trabajo en cola de otro proceso vivo
+
+        La petición se anota con un byte en <id>.requests en lugar de
+        reescribir el estado: el proceso dueño puede estar publicando a la
+        vez que el trabajo empieza. Se llama con _submit_lock tomado.
+
+        Returns:
+            Estado del trabajo, o None si ningún otro proceso tiene uno en cola
+        """
+        state = self._queued_elsewhere()
+        if state is None:
+            return None
+        with open(_state_path(self.state_dir, state['id'], '.requests'), 'ab') as f:
+            f.write(b'.')
+        state['requests'] += 1
+        return state
+
+    def _queued_elsewhere(self):
+        """Estado del trabajo en cola de otro proceso vivo, o None"""
+        if not self.state_dir:
+            return None
+        try:
+            names = [name for name in os.listdir(self.state_dir) if name.endswith('.json')]
+        except FileNotFoundError:
+            return None
+        for name in names:
+            match = JOB_ID_RE.match(name[:-len('.json')])
+            if match is None or int(match.group(1)) == os.getpid() or not _pid_alive(int(match.group(1))):
+                continue
+            state = _load_state(self.state_dir, name[:-len('.json')])
+            if state is not None and state['state'] == QUEUED and not state.get('cancel_requested') \
+                    and not os.path.exists(_state_path(self.state_dir, state['id'], '.cancel')):
+                return state
+        return None
+
+    def get(self, job_id):
+        """Devuelve el trabajo con ese id o None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_state(self, job_id):
+        """
+        Estado (to_dict) de un trabajo de este proceso o publicado por otro
+
+        Returns:
+            Diccionario del estado, o None si no existe
+        """
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if not self.state_dir or not JOB_ID_RE.match(job_id):
+            return None
+        return _load_state(self.state_dir, job_id)
+
+    def current(self):
+        """Devuelve el trabajo en curso, o None"""
+        return self._running
+
+    def cancel(self, job_id):
+        """
+        Cancela un trabajo en cola o pide parar uno en curso
+
+        Los trabajos de otro proceso se cancelan dejando un fichero
+        <id>.cancel que su is_cancelled() detecta.
+
+        Returns:
+            Estado del trabajo (to_dict), o None si no existe
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if job.state not in FINISHED_STATES:
+                    job.cancel_event.set()
+                    if job is self._queued:
+                        self._queued = None
+                        job._mark_finished(CANCELLED)
+                return job.to_dict()
+
+        state = self.get_state(job_id)
+        if state is None or state['state'] in FINISHED_STATES:
+            return state
+        with open(_state_path(self.state_dir, job_id, '.cancel'), 'w'):
+            pass
+        return dict(state, cancel_requested=True)
+
+    def _remember(self, job):
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.history_size:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.state not in FINISHED_STATES:
+                break
+            del self._jobs[oldest_id]
+        if self.state_dir:
+            self._prune_state_dir()
+
+    def _prune_state_dir(self):
+        """Borra los estados publicados más antiguos (de cualquier proceso)"""
+        try:
+            names = [name for name in os.listdir(self.state_dir) if name.endswith('.json')]
+        except FileNotFoundError:
+            return
+        if len(names) <= self.history_size:
+            return
+        paths = sorted((os.path.join(self.state_dir, name) for name in names), key=_mtime)
+        for path in paths[:len(paths) - self.history_size]:
+            base = path[:-len('.json')]
+            for stale in (path, base + '.cancel', base + '.requests'):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+    def _start(self, job):
+        self._running = job
+        # Si otro proceso tiene lock, el trabajo sigue en cola hasta que lo suelte
+        acquired = self.lock is None or self.lock.acquire(blocking=False)
+        if acquired:
+            job._mark_started()
+        thread = threading.Thread(target=self._run, args=(job, acquired), daemon=True)
+        thread.start()
+
+    def _run(self, job, acquired):
+        try:
+            if not acquired:
+                job.record_progress('waiting')
+                acquired = self.lock.acquire(should_cancel=job.is_cancelled)
+                if not acquired:
+                    job._mark_finished(CANCELLED)
+                    return
+                job._mark_started()
+            self.target(job)
+        except Exception as e:
+            job._mark_finished(FAILED, str(e))
+        else:
+            job._mark_finished(CANCELLED if job.is_cancelled() else SUCCEEDED)
+        finally:
+            if acquired and self.lock is not None:
+                self.lock.release()
+            with self._lock:
+                self._running = None
+                if self._queued is not None:
+                    next_job, self._queued = self._queued, None
+                    self._start(next_job)
@@ -3,66 +3,341 @@
 Motor de Captación de Señales - Madrid
 Genera señales de oportunidades de negocio sin base de datos
 """
-import json
 import os
 from datetime import datetime
-from google_search import search_google
-from processors import process_signal
-from classifiers import classify_priority
-from sheets_writer import write_signals_to_sheet
+from google_search import search_many
+from processors import preview_signals, process_signals
+from dedup import dedup_results, make_signal_id
+from near_dedup import NEAR_DEDUP_ENABLED, collapse_near_duplicates
+from events import event_bus
+import metrics
+from classifiers import classify_many, get_rules
+from enrichment import ENRICHMENT_ENABLED, enrich_signals
+from signal_store import SIGNAL_BACKEND, get_signal_store, was_searched
+from sheets_replicator import get_replicator
+from seen_index import INCREMENTAL_RUNS, fingerprint, get_seen_index, url_key
+from snapshot_file import SNAPSHOT_PATH, write_snapshot
+from query_planner import get_query_planner, get_search_budget, measure_yield
 
 # Configuración
-OUTPUT_FILE = '/app/signals_today.json'
-SEARCH_QUERIES = [
-    "summer school Madrid 2026 contact",
-    "business school summer course Madrid email",
-    "IE summer school contact",
-    "ESADE summer madrid admissions",
-    "Comillas summer school housing",
-    "EOI summer madrid contact",
-    "UC3M study abroad housing",
-    "Saint Louis University Madrid housing",
-    "SLU Madrid accommodation contact",
-    "Suffolk University Madrid study abroad contact",
-    "NYU Madrid study abroad housing",
-    "spanish school madrid summer course contact"
-]
+OUTPUT_FILE = SNAPSHOT_PATH
+# Las queries se leen de queries.json y query_planner reparte entre ellas
+# el presupuesto de llamadas (SEARCH_API_BUDGET)
+# Profundidad por query cuando el presupuesto es 0 (se pagina de 10 en 10, máximo 100)
+RESULTS_PER_QUERY = int(os.environ.get('RESULTS_PER_QUERY', 15))
+# Búsquedas simultáneas contra Custom Search (1 = secuencial)
+SEARCH_WORKERS = int(os.environ.get('SEARCH_WORKERS', 8))
 
-def main():
-    """Ejecuta el motor de captación de señales"""
+def save_signals(signals, started_at=None, failed_queries=None, active_ids=None, searched_queries=None):
+    """
+    Guarda las señales de la ejecución en el backend configurado
+    
+    Con el almacén local la escritura es inmediata y Google Sheets se
+    actualiza después en segundo plano; si no hay replicador en marcha
+    (ejecución desde línea de comandos) se replica antes de volver.
+    
+    Args:
+        signals: Señales de la ejecución (sustituyen a las anteriores)
+        started_at: Inicio de la ejecución, para el historial de ejecuciones
+        failed_queries: Queries fallidas, para el historial de ejecuciones
+        active_ids: En ejecuciones incrementales, ids (en orden) de todas
+            las señales vigentes; signals contiene solo las nuevas o
+            modificadas y el resto se conserva en el almacén
+        searched_queries: Queries que se buscaron sin error; las señales
+            de las demás (pausadas, sin presupuesto, fallidas) se conservan
+            aunque no estén en signals
+    """
+    if SIGNAL_BACKEND == 'sheets':
+        # gspread y google-auth solo se importan si de verdad se escribe en Sheets
+        from sheets_writer import get_signals_from_sheet, write_signals_to_sheet
+        if searched_queries is not None:
+            ids = {signal['id'] for signal in signals}
+            signals = signals + [
+                signal for signal in get_signals_from_sheet()
+                if signal['id'] not in ids and not was_searched(signal, searched_queries)
+            ]
+        write_signals_to_sheet(signals)
+        return
+    
+    store = get_signal_store()
+    if active_ids is None:
+        changed = store.replace_signals(signals, searched_queries)
+    else:
+        changed = store.update_signals(signals, active_ids, searched_queries)
+    total = store.count()
+    store.record_run(started_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'succeeded',
+                     total=total, details={'cambios': changed, 'queries_fallidas': failed_queries or []})
+    print(f"💾 {total} señales en el almacén local ({changed} cambios)")
+    
+    replicator = get_replicator()
+    if replicator.is_running():
+        replicator.notify()
+    else:
+        replicator.sync_once()
+
+def plan_incremental(results, today, skip_unchanged=True):
+    """
+    Compara los resultados con el índice de URLs vistas
+    
+    Un resultado no cambia si su URL ya estaba en el índice con la misma
+    huella de contenido (y de reglas de prioridad) y su señal sigue activa
+    en el almacén; esos no se vuelven a procesar ni escribir.
+    
+    Args:
+        results: Resultados únicos (dedup_results)
+        today: Fecha 'YYYY-MM-DD' de la ejecución
+        skip_unchanged: False para procesar todos (solo se usan las fechas)
+    
+    Returns:
+        Diccionario con:
+            to_process: Resultados nuevos o modificados
+            first_seen: {id de señal: fecha de primera detección}
+            active_ids: Ids de todas las señales de la ejecución, en orden
+            seen: Entradas (clave, huella) para SeenIndex.mark_seen
+            stats: Número de resultados nuevos, modificados y sin cambios
+    """
+    salt = get_rules().digest
+    keyed = [
+        (url_key(result['url_canonica']), fingerprint(result, salt), make_signal_id(result['url']), result)
+        for result in results
+    ]
+    known = get_seen_index().lookup(key for key, _, _, _ in keyed)
+    stored = set()
+    if skip_unchanged:
+        candidates = [signal_id for key, fp, signal_id, _ in keyed if known.get(key, (None,))[0] == fp]
+        stored = get_signal_store().active_ids(candidates)
+    
+    to_process = []
+    first_seen = {}
+    stats = {'nuevas': 0, 'modificadas': 0, 'sin_cambios': 0}
+    for key, fp, signal_id, result in keyed:
+        record = known.get(key)
+        if record is None:
+            stats['nuevas'] += 1
+        elif record[0] == fp and signal_id in stored:
+            stats['sin_cambios'] += 1
+            continue
+        else:
+            stats['modificadas'] += 1
+        first_seen[signal_id] = record[1] if record else today
+        to_process.append(result)
+    
+    return {
+        'to_process': to_process,
+        'first_seen': first_seen,
+        'active_ids': [signal_id for _, _, signal_id, _ in keyed],
+        'seen': [(key, fp) for key, fp, _, _ in keyed],
+        'stats': stats
+    }
+
+def split_search_results(search_results):
+    """
+    Separa las búsquedas correctas de las fallidas (con una línea de log por query)
+    
+    Returns:
+        Tupla (correctas, fallidas): [(query, resultados)] y
+        [{'query', 'error'}]
+    """
+    successful = []
+    failed_queries = []
+    for query, results, error in search_results:
+        print(f"\n🔍 {query}: {len(results)} resultados")
+        if error:
+            print(f"  ❌ Error en búsqueda: {error}")
+            failed_queries.append({'query': query, 'error': error})
+            continue
+        successful.append((query, results))
+    return successful, failed_queries
+
+def result_counts(search_results):
+    """{query: número de resultados} de las búsquedas sin error"""
+    return {query: len(results) for query, results, error in search_results if not error}
+
+def merge_results(successful):
+    """
+    Fusiona la misma página devuelta por varias queries y agrupa los casi duplicados
+    
+    Args:
+        successful: Lista de (query, resultados) en orden
+    
+    Returns:
+        Resultados únicos en orden de primera aparición
+    """
+    with metrics.timed('dedup_results', items=sum(len(results) for _, results in successful)):
+        unique_results = dedup_results(successful)
+    total_results = sum(len(results) for _, results in successful)
+    print(f"\n🧹 {total_results} resultados, {len(unique_results)} únicos tras deduplicar")
+    
+    # Agrupar el mismo programa publicado en varias URLs
+    if NEAR_DEDUP_ENABLED:
+        # Con el almacén local, los grupos conservan la señal que ya estaba guardada
+        known_ids = get_signal_store().active_ids if SIGNAL_BACKEND != 'sheets' else None
+        with metrics.timed('near_dedup', items=len(unique_results)):
+            collapsed = collapse_near_duplicates(unique_results, known_ids=known_ids)
+        print(f"🧬 {len(unique_results) - len(collapsed)} casi duplicados agrupados")
+        unique_results = collapsed
+    return unique_results
+
+def build_signals(results, first_seen, today, should_cancel=None, on_stage=None):
+    """
+    Convierte resultados en señales: extracción, enriquecimiento y prioridad
+    
+    Args:
+        results: Resultados únicos a procesar
+        first_seen: {id de señal: fecha de primera detección}
+        today: Fecha 'YYYY-MM-DD' para las señales nuevas
+        should_cancel: Función opcional para parar el enriquecimiento
+        on_stage: Callback opcional on_stage(stage) al empezar cada etapa
+    
+    Returns:
+        Lista de señales clasificadas (incompleta si se canceló)
+    """
+    signals = process_signals(results)
+    for signal in signals:
+        signal['fecha_detectada'] = first_seen.get(signal['id'], today)
+    
+    # Visitar las páginas para completar email y teléfono (antes de clasificar)
+    if ENRICHMENT_ENABLED:
+        if on_stage:
+            on_stage('enriching')
+        enrich_signals(signals, should_cancel=should_cancel)
+        if should_cancel and should_cancel():
+            return signals
+    
+    for signal in classify_signals(signals):
+        print(f"  ✅ {signal['titulo'][:50]}... [{signal['prioridad']}]")
+    return signals
+
+def classify_signals(signals):
+    """
+    Asigna la prioridad a cada señal de la lista (en el sitio)
+    
+    Returns:
+        La misma lista de señales
+    """
+    with metrics.timed('classify_priority', items=len(signals)):
+        for signal, priority in zip(signals, classify_many(signals)):
+            signal['prioridad'] = priority
+    return signals
+
+def main(use_cache=True, on_progress=None, should_cancel=None):
+    """
+    Ejecuta el motor de captación de señales
+    
+    Args:
+        use_cache: False para ignorar la caché de búsquedas y forzar
+            llamadas nuevas a Custom Search
+        on_progress: Callback opcional on_progress(stage, **info) con el
+            avance de la ejecución (ver jobs.Job.record_progress)
+        should_cancel: Función opcional; si devuelve True la ejecución se
+            detiene antes de la siguiente etapa sin escribir nada
+    
+    Returns:
+        Lista de señales generadas, o None si se canceló
+    """
+    def progress(stage, **info):
+        if on_progress:
+            on_progress(stage, **info)
+        event_bus.publish('progress', dict(info, stage=stage))
+    
+    def cancelled():
+        if should_cancel and should_cancel():
+            print("\n⛔ Ejecución cancelada")
+            return True
+        return False
+    
+    def on_query_done(query, results, error):
+        progress('query_done', query=query, results=len(results), error=error)
+        # Vista previa para los clientes SSE: la señal definitiva (con todas
+        # sus keywords fusionadas) se calcula al terminar todas las búsquedas.
+        # Sin clientes conectados no se construye
+        if not event_bus.has_subscribers():
+            return
+        previews = preview_signals(results, query)
+        for signal, priority in zip(previews, classify_many(previews)):
+            signal['prioridad'] = priority
+            event_bus.publish('signal', signal)
+    
+    event_bus.reset_history()
+    metrics_before = metrics.snapshot()
+    started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     print("🎯 Iniciando Motor de Captación de Señales - Madrid")
-    print(f"📅 Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"📅 Fecha: {started_at}")
     
     all_signals = []
     
-    for query in SEARCH_QUERIES:
-        print(f"\n🔍 Buscando: {query}")
-        results = search_google(query, num_results=15)
-        
-        for result in results:
-            signal = process_signal(result, query)
-            if signal:
-                signal['prioridad'] = classify_priority(signal)
-                all_signals.append(signal)
-                print(f"  ✅ {signal['titulo'][:50]}... [{signal['prioridad']}]")
-    
-    # Guardar en Google Sheets
-    write_signals_to_sheet(all_signals)
-    
-    # También guardar en JSON como backup
-    output_data = {
-        'fecha_generacion': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'total_senales': len(all_signals),
-        'senales': all_signals
-    }
+    # Más páginas para las queries que más señales 'Alta' dan por llamada
+    planner = get_query_planner()
+    query_plan = planner.plan(get_search_budget(), default_results=RESULTS_PER_QUERY)
+    queries = query_plan['queries']
+    print(f"\n🧭 {query_plan['pages']} llamadas planificadas en {len(queries)} queries "
+          f"({len(query_plan['pausadas'])} pausadas, {len(query_plan['sin_presupuesto'])} sin presupuesto)")
+    print(f"🔍 Lanzando {len(queries)} búsquedas ({SEARCH_WORKERS} en paralelo)")
+    progress('search', queries=queries)
+    api_calls = {}
+    search_results = search_many(
+        queries, num_results=query_plan['num_results'], max_workers=SEARCH_WORKERS,
+        use_cache=use_cache, should_cancel=should_cancel, on_query_done=on_query_done,
+        api_calls=api_calls
+    )
+    if cancelled():
+        return None
     
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    successful, failed_queries = split_search_results(search_results)
+    unique_results = merge_results(successful)
+    
+    progress('processing')
+    today = datetime.now().strftime('%Y-%m-%d')
+    # El almacén conserva las señales sin cambios; Sheets necesita la lista completa
+    incremental = INCREMENTAL_RUNS and SIGNAL_BACKEND != 'sheets'
+    plan = plan_incremental(unique_results, today, skip_unchanged=incremental)
+    stats = plan['stats']
+    print(f"🆕 {stats['nuevas']} nuevas, {stats['modificadas']} modificadas, "
+          f"{stats['sin_cambios']} sin cambios desde la última ejecución")
+    signals = build_signals(plan['to_process'], plan['first_seen'], today,
+                            should_cancel=should_cancel, on_stage=progress)
+    if cancelled():
+        return None
+    all_signals.extend(signals)
+    
+    # Guardar en el almacén (y Google Sheets)
+    progress('writing')
+    with metrics.timed('save_signals', items=len(all_signals)):
+        save_signals(all_signals, started_at, failed_queries,
+                     active_ids=plan['active_ids'] if incremental else None,
+                     searched_queries=set(result_counts(search_results)))
+    get_seen_index().mark_seen(plan['seen'], today)
+    if SIGNAL_BACKEND != 'sheets':
+        # Las señales sin cambios y las de queries no lanzadas no pasaron
+        # por el proceso: leerlas del almacén
+        all_signals = get_signal_store().get_signals()
+    planner.record_run(measure_yield(result_counts(search_results), all_signals, today, api_calls),
+                       budget=query_plan['budget'])
+    
+    # También guardar la instantánea como backup (NDJSON, escritura atómica)
+    write_snapshot(
+        all_signals, OUTPUT_FILE,
+        header={
+            'fecha_generacion': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'incremental': stats,
+            'num_queries_fallidas': len(failed_queries)
+        },
+        meta={
+            'queries_fallidas': failed_queries,
+            'plan_busqueda': query_plan,
+            'metricas': metrics.diff(metrics_before, metrics.snapshot())
+        }
+    )
     
     print(f"\n✅ Proceso completado: {len(all_signals)} señales generadas")
+    if failed_queries:
+        print(f"⚠️  {len(failed_queries)} búsquedas fallidas: {', '.join(q['query'] for q in failed_queries)}")
     print(f"📊 Google Sheets: https://docs.google.com/spreadsheets/d/1-6e0U1SATcgs2V8u2fOoDoKIrLjzwJi8GxJtUwy9t_U/edit")
-    print(f"📄 Backup JSON: {OUTPUT_FILE}")
+    if SIGNAL_BACKEND != 'sheets':
+        print(f"💾 Almacén local: {get_signal_store().path}")
+    print(f"📄 Instantánea: {OUTPUT_FILE}")
+    
+    return all_signals
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,310 @@
+"""
+Instrumentación ligera: tiempos por etapa, contadores y cuota de API consumida
+
+Expone los datos en formato Prometheus (/metrics) y como resumen por
+ejecución para el backup JSON.
+"""
+import bisect
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Límites (segundos) de los buckets del histograma de duración
+DURATION_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Directorio donde cada worker WSGI publica sus métricas para sumarlas en /metrics
+METRICS_DIR = os.environ.get('METRICS_DIR', '/app/data/metrics')
+# Segundos entre publicaciones de cada worker
+METRICS_PUBLISH_INTERVAL = float(os.environ.get('METRICS_PUBLISH_INTERVAL', 5))
+
+class _Stage:
+    """Contadores e histograma de una etapa"""
+
+    __slots__ = ('calls', 'errors', 'items', 'seconds', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+
+class MetricsRegistry:
+    """Registro de métricas del proceso, seguro entre hilos"""
+
+    def __init__(self):
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, items=1, error=False):
+        """Registra una llamada a una etapa con su duración"""
+        index = bisect.bisect_left(DURATION_BUCKETS, seconds)
+        with self._lock:
+            data = self._stages.get(stage)
+            if data is None:
+                data = self._stages[stage] = _Stage()
+            data.calls += 1
+            data.items += items
+            data.seconds += seconds
+            data.buckets[index] += 1
+            if error:
+                data.errors += 1
+
+    def inc(self, name, label, amount=1):
+        """Incrementa un contador con una etiqueta (p. ej. api_units, 'custom_search')"""
+        key = (name, label)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """Copia de los valores actuales como diccionario JSON-serializable"""
+        with self._lock:
+            stages = {
+                name: {
+                    'calls': data.calls,
+                    'errors': data.errors,
+                    'items': data.items,
+                    'seconds': round(data.seconds, 6)
+                }
+                for name, data in self._stages.items()
+            }
+            counters = {}
+            for (name, label), value in self._counters.items():
+                counters.setdefault(name, {})[label] = value
+        return {'stages': stages, 'counters': counters}
+
+    def export(self):
+        """Valores actuales con los buckets del histograma (ver render_prometheus)"""
+        with self._lock:
+            return {
+                'stages': {
+                    name: [data.calls, data.errors, data.items, data.seconds, list(data.buckets)]
+                    for name, data in self._stages.items()
+                },
+                'counters': [[name, label, value] for (name, label), value in self._counters.items()]
+            }
+
+    def render_prometheus(self):
+        """Texto en el formato de exposición de Prometheus"""
+        return render_prometheus(self.export())
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+def merge_exports(exports):
+    """Suma varios MetricsRegistry.export() (p. ej. uno por worker)"""
+    stages = {}
+    counters = {}
+    for data in exports:
+        for name, (calls, errors, items, seconds, buckets) in data['stages'].items():
+            total = stages.setdefault(name, [0, 0, 0, 0.0, [0] * (len(DURATION_BUCKETS) + 1)])
+            total[0] += calls
+            total[1] += errors
+            total[2] += items
+            total[3] += seconds
+            total[4] = [a + b for a, b in zip(total[4], buckets)]
+        for name, label, value in data['counters']:
+            counters[(name, label)] = counters.get((name, label), 0) + value
+    return {
+        'stages': stages,
+        'counters': [[name, label, value] for (name, label), value in counters.items()]
+    }
+
+def render_prometheus(data):
+    """
+    Texto en el formato de exposición de Prometheus
+
+    Args:
+        data: MetricsRegistry.export() o merge_exports()
+    """
+    stages = [(name, *values) for name, values in sorted(data['stages'].items())]
+    counters = sorted(((name, label), value) for name, label, value in data['counters'])
+
+    lines = [
+        '# HELP signals_stage_calls_total Llamadas por etapa del motor',
+        '# TYPE signals_stage_calls_total counter'
+    ]
+    lines += [f'signals_stage_calls_total{{stage="{s[0]}"}} {s[1]}' for s in stages]
+    lines += [
+        '# HELP signals_stage_errors_total Llamadas con error por etapa',
+        '# TYPE signals_stage_errors_total counter'
+    ]
+    lines += [f'signals_stage_errors_total{{stage="{s[0]}"}} {s[2]}' for s in stages]
+    lines += [
+        '# HELP signals_stage_items_total Elementos procesados por etapa',
+        '# TYPE signals_stage_items_total counter'
+    ]
+    lines += [f'signals_stage_items_total{{stage="{s[0]}"}} {s[3]}' for s in stages]
+    lines += [
+        '# HELP signals_stage_duration_seconds Duración de cada llamada por etapa',
+        '# TYPE signals_stage_duration_seconds histogram'
+    ]
+    for name, calls, _, _, seconds, buckets in stages:
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS, buckets):
+            cumulative += count
+            lines.append(f'signals_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'signals_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {calls}')
+        lines.append(f'signals_stage_duration_seconds_sum{{stage="{name}"}} {seconds:.6f}')
+        lines.append(f'signals_stage_duration_seconds_count{{stage="{name}"}} {calls}')
+
+    names = []
+    for (name, _), _ in counters:
+        if name not in names:
+            names.append(name)
+    for name in names:
+        lines.append(f'# TYPE signals_{name}_total counter')
+        for (counter, label), value in counters:
+            if counter == name:
+                lines.append(f'signals_{name}_total{{key="{label}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+class SharedMetrics:
+    """
+    Métricas de todos los workers WSGI a través de un directorio
+
+    Cada worker escribe periódicamente su registro en un fichero propio;
+    /metrics, lo sirva el worker que lo sirva, suma todos los ficheros. Los
+    de workers que ya terminaron se conservan para que los contadores no
+    bajen; clear() los borra al arrancar el servidor.
+
+    Args:
+        directory: Directorio compartido por los workers
+        source: Registro que se publica (por defecto el del proceso)
+    """
+
+    def __init__(self, directory=METRICS_DIR, source=None):
+        self.directory = directory
+        self.source = source or registry
+        self._path = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _own_path(self):
+        # Tras un fork el proceso hijo necesita su propio fichero; la hora
+        # evita pisar el de un worker anterior que tuvo el mismo pid
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._path = os.path.join(self.directory, f"worker-{self._pid}-{time.time_ns()}.json")
+        return self._path
+
+    def publish(self):
+        """Escribe el registro de este proceso (escritura atómica)"""
+        with self._lock:
+            path = self._own_path()
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.metrics-', suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self.source.export(), f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️  No se pudieron publicar las métricas: {e}")
+
+    def start(self, interval=METRICS_PUBLISH_INTERVAL):
+        """Publica cada interval segundos en un hilo de fondo"""
+        def loop():
+            while True:
+                self.publish()
+                time.sleep(interval)
+        threading.Thread(target=loop, name='metrics-publisher', daemon=True).start()
+
+    def collect(self):
+        """Suma de las métricas publicadas por todos los workers (incluido este)"""
+        self.publish()
+        exports = []
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith('.json')]
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    exports.append(json.load(f))
+            except (FileNotFoundError, ValueError):
+                continue
+        return merge_exports(exports) if exports else self.source.export()
+
+    def render_prometheus(self):
+        return render_prometheus(self.collect())
+
+    def clear(self):
+        """Borra lo publicado (al arrancar, antes de crear los workers)"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+@contextmanager
+def timed(stage, items=1):
+    """
+    Mide la duración del bloque como una llamada a stage
+
+    Para etapas por registro (process_signal, classify_priority) se mide
+    el lote completo indicando items, así el coste de medir no depende
+    del número de registros.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.observe(stage, time.perf_counter() - start, items, error=True)
+        raise
+    registry.observe(stage, time.perf_counter() - start, items)
+
+def instrumented(stage):
+    """Decorador equivalente a envolver la función en timed(stage)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def add_api_units(api, units=1):
+    """Anota unidades de cuota consumidas de una API"""
+    registry.inc('api_units', api, units)
+
+def count(name, label, amount=1):
+    """Incrementa un contador genérico"""
+    registry.inc(name, label, amount)
+
+def snapshot():
+    return registry.snapshot()
+
+def diff(before, after):
+    """
+    Diferencia entre dos snapshot(): lo consumido durante una ejecución
+
+    Incluye lo que otros hilos del proceso (p. ej. lecturas de Flask)
+    hayan hecho en el mismo intervalo.
+    """
+    stages = {}
+    for name, data in after['stages'].items():
+        previous = before['stages'].get(name, {})
+        delta = {key: round(value - previous.get(key, 0), 6) for key, value in data.items()}
+        if delta['calls']:
+            stages[name] = delta
+    counters = {}
+    for name, labels in after['counters'].items():
+        previous = before['counters'].get(name, {})
+        delta = {label: value - previous.get(label, 0) for label, value in labels.items()}
+        delta = {label: value for label, value in delta.items() if value}
+        if delta:
+            counters[name] = delta
+    return {'stages': stages, 'counters': counters}
@@ -0,0 +1,205 @@
+"""
+Agrupación de resultados casi duplicados (mismo programa en varias URLs)
+
+dedup_results solo fusiona URLs que son la misma página canónica. Aquí se
+juntan las copias con título y snippet casi iguales (espejos, versiones en
+otro idioma con el mismo texto, agregadores) usando firmas MinHash y LSH
+por bandas, en tiempo casi lineal con el número de resultados.
+"""
+import operator
+import os
+import re
+import unicodedata
+import zlib
+
+from dedup import canonicalize_url, make_signal_id
+from processors import extract_contacts
+
+NEAR_DEDUP_ENABLED = os.environ.get('NEAR_DEDUP', '1') == '1'
+# Similitud de Jaccard estimada a partir de la cual dos resultados se agrupan
+NEAR_DUP_THRESHOLD = float(os.environ.get('NEAR_DUP_THRESHOLD', 0.7))
+
+# Firma de NUM_BINS mínimos (potencia de 2) dividida en BANDS bandas: dos
+# textos son candidatos si coinciden en todas las filas de alguna banda
+NUM_BINS = 64
+BANDS = 16
+ROWS = NUM_BINS // BANDS
+SHINGLE_SIZE = 3
+# Textos con menos shingles ("Contact", "Home") no se agrupan nunca
+MIN_SHINGLES = 4
+
+TOKEN_RE = re.compile(r'\w+')
+_BIN_BITS = NUM_BINS.bit_length() - 1
+_EMPTY = 1 << 32
+
+def _tokens(text):
+    """Palabras en minúsculas y sin tildes"""
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    return TOKEN_RE.findall(text)
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Conjunto de secuencias de size palabras consecutivas"""
+    tokens = _tokens(text)
+    if len(tokens) <= size:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+def minhash_signature(shingle_set):
+    """
+    Firma MinHash de un conjunto de shingles
+
+    Usa one-permutation hashing: cada shingle se hashea una sola vez y va
+    al bin que indican sus bits bajos, que se queda con el mínimo. Los bins
+    vacíos copian el siguiente bin lleno (densificación), así la firma
+    cuesta O(shingles) y no O(shingles x NUM_BINS).
+    """
+    bins = [_EMPTY] * NUM_BINS
+    for shingle in shingle_set:
+        h = zlib.crc32(shingle.encode('utf-8'))
+        index = h & (NUM_BINS - 1)
+        value = h >> _BIN_BITS
+        if value < bins[index]:
+            bins[index] = value
+    filled = [i for i, value in enumerate(bins) if value != _EMPTY]
+    if filled and len(filled) < NUM_BINS:
+        original = bins[:]
+        # Recorrido hacia atrás: next_filled es el siguiente bin lleno en
+        # orden circular; el desplazamiento distingue el valor copiado
+        next_filled = filled[0] + NUM_BINS
+        for i in range(NUM_BINS - 1, -1, -1):
+            if original[i] != _EMPTY:
+                next_filled = i
+            else:
+                distance = next_filled - i
+                bins[i] = original[next_filled % NUM_BINS] + distance * _EMPTY
+    return tuple(bins)
+
+def estimated_similarity(a, b):
+    """Fracción de bins iguales: estimación de la similitud de Jaccard"""
+    return sum(map(operator.eq, a, b)) / NUM_BINS
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # La raíz es siempre el índice menor: el grupo sale en orden de aparición
+            if root_b < root_a:
+                root_a, root_b = root_b, root_a
+            self.parent[root_b] = root_a
+
+def find_clusters(texts, threshold=NEAR_DUP_THRESHOLD):
+    """
+    Agrupa textos casi iguales
+
+    Cada texto se compara solo con el primero que cayó en cada uno de sus
+    cubos LSH, y la pareja se confirma con la similitud estimada de las
+    firmas antes de unirla.
+
+    Returns:
+        Lista de grupos (listas de índices en orden creciente), incluidos
+        los de un solo elemento, ordenados por su primer índice
+    """
+    union_find = _UnionFind(len(texts))
+    signatures = {}
+    buckets = {}
+    for i, text in enumerate(texts):
+        shingle_set = shingles(text)
+        if len(shingle_set) < MIN_SHINGLES:
+            continue
+        signature = signatures[i] = minhash_signature(shingle_set)
+        compared = set()
+        for band in range(BANDS):
+            key = (band, signature[band * ROWS:(band + 1) * ROWS])
+            anchor = buckets.setdefault(key, i)
+            if anchor == i or anchor in compared:
+                continue
+            compared.add(anchor)
+            if union_find.find(anchor) != union_find.find(i) \
+                    and estimated_similarity(signatures[anchor], signature) >= threshold:
+                union_find.union(anchor, i)
+
+    groups = {}
+    for i in range(len(texts)):
+        groups.setdefault(union_find.find(i), []).append(i)
+    return [groups[root] for root in sorted(groups)]
+
+def representative(urls, known_ids=()):
+    """
+    Posición del representante de un grupo de casi duplicados
+
+    No depende de qué otros miembros aparecieron en la ejecución, así la
+    señal (su id) no cambia de una a otra: la URL canónica más baja entre
+    las que ya tienen señal guardada (known_ids) o, si ninguna la tiene,
+    entre todas.
+
+    Args:
+        urls: URLs de los miembros del grupo
+        known_ids: Ids de señal ya guardados
+    """
+    canonical = [canonicalize_url(url) for url in urls]
+    candidates = [i for i, url in enumerate(urls) if make_signal_id(url) in known_ids] or range(len(urls))
+    return min(candidates, key=lambda i: (canonical[i], i))
+
+def collapse_near_duplicates(results, threshold=NEAR_DUP_THRESHOLD, known_ids=None):
+    """
+    Fusiona los resultados casi duplicados
+
+    Args:
+        results: Resultados únicos por URL (dedup_results)
+        threshold: Similitud mínima estimada para agrupar
+        known_ids: Función opcional known_ids(ids) que devuelve cuáles de
+            esos ids de señal ya están guardados (para conservarlos como
+            representantes)
+
+    Returns:
+        Lista de resultados en orden de primera aparición de cada grupo.
+        El representante de cada grupo (ver representative) conserva su
+        URL, título y snippet y recibe las keywords de todos los miembros,
+        'urls_duplicadas' con las URLs de los demás y, en 'email' y
+        'telefono', el primer contacto que se extraiga de los miembros.
+    """
+    texts = [f"{r.get('titulo', '')} {r.get('snippet', '')}" for r in results]
+    groups = find_clusters(texts, threshold)
+    known = set()
+    if known_ids is not None:
+        grouped = [results[i].get('url', '') for group in groups if len(group) > 1 for i in group]
+        known = known_ids([make_signal_id(url) for url in grouped]) if grouped else set()
+
+    collapsed = []
+    for group in groups:
+        if len(group) == 1:
+            collapsed.append(results[group[0]])
+            continue
+        rep_index = group[representative([results[i].get('url', '') for i in group], known)]
+        rep = results[rep_index]
+        merged = dict(rep, keywords=list(rep.get('keywords') or []), urls_duplicadas=[])
+        for i in group:
+            if i == rep_index:
+                continue
+            member = results[i]
+            merged['urls_duplicadas'].append(member.get('url', ''))
+            for keyword in member.get('keywords') or []:
+                if keyword not in merged['keywords']:
+                    merged['keywords'].append(keyword)
+        # Contactos del grupo, empezando por el representante
+        for i in [rep_index] + [i for i in group if i != rep_index]:
+            email, phone = extract_contacts(texts[i])
+            if email and not merged.get('email'):
+                merged['email'] = email
+            if phone and not merged.get('telefono'):
+                merged['telefono'] = phone
+        collapsed.append(merged)
+    return collapsed
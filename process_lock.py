@@ -0,0 +1,100 @@
+"""
+Cerrojo entre procesos basado en flock sobre un fichero
+
+Con varios workers WSGI cada uno tiene sus propios locks de threading; lo
+que no puede ocurrir dos veces a la vez en la máquina (una ejecución del
+motor, una réplica hacia Sheets, la reconstrucción de la instantánea
+compartida) se protege además con uno de estos. El sistema operativo
+suelta el cerrojo si el proceso muere.
+"""
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo exclusión dentro del proceso
+    fcntl = None
+
+LOCK_DIR = os.environ.get('PROCESS_LOCK_DIR', '/app/data/locks')
+
+class ProcessLock:
+    """
+    Cerrojo exclusivo con nombre, válido entre procesos y entre hilos
+
+    Args:
+        name: Nombre del cerrojo (fichero <LOCK_DIR>/<name>.lock)
+        directory: Directorio de los ficheros de cerrojo
+    """
+
+    def __init__(self, name, directory=None):
+        self.path = os.path.join(directory or LOCK_DIR, f"{name}.lock")
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    @property
+    def held(self):
+        """True si este proceso tiene el cerrojo"""
+        return self._fd is not None
+
+    def acquire(self, blocking=True, should_cancel=None, poll_interval=0.5):
+        """
+        Toma el cerrojo
+
+        Args:
+            blocking: False para volver enseguida si otro lo tiene
+            should_cancel: Función opcional; si devuelve True mientras se
+                espera, se deja de esperar
+            poll_interval: Segundos entre intentos mientras se espera
+
+        Returns:
+            True si se tomó el cerrojo
+        """
+        if not self._thread_lock.acquire(blocking=blocking):
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        try:
+            while True:
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if not blocking or (should_cancel and should_cancel()):
+                        os.close(fd)
+                        self._thread_lock.release()
+                        return False
+                    time.sleep(poll_interval)
+        except BaseException:
+            # Cualquier otro error (o una interrupción mientras se espera):
+            # no dejar el descriptor abierto
+            os.close(fd)
+            self._thread_lock.release()
+            raise
+        self._fd = fd
+        return True
+
+    def release(self):
+        """Suelta el cerrojo"""
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
@@ -3,23 +3,43 @@ Módulo para procesar y extraer información de las señales
 """
 import re
 from datetime import datetime
+from dedup import make_signal_id
+from metrics import instrumented, timed
+
+# Patrones compilados una sola vez al importar el módulo
+EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+# El lookahead descarta de inmediato las posiciones que no pueden iniciar un teléfono
+PHONE_RE = re.compile(r'(?=[\d(+])(?:\+?\d{1,3}[-.\s]?)?\(?\d{2,4}\)?[-.\s]?\d{2,4}[-.\s]?\d{2,4}')
+DOMAIN_RE = re.compile(r'https?://(?:www\.)?([^/]+)')
 
 def extract_email(text):
     """Extrae emails del texto"""
-    pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    emails = re.findall(pattern, text)
-    return emails[0] if emails else None
+    # Todo email contiene '@': si no hay, no hace falta recorrer el texto
+    at = text.find('@')
+    if at < 0:
+        return None
+    # Empezar en la palabra que contiene la primera '@'
+    match = EMAIL_RE.search(text, text.rfind(' ', 0, at) + 1)
+    return match.group(0) if match else None
 
 def extract_phone(text):
     """Extrae teléfonos del texto"""
-    pattern = r'(\+?\d{1,3}[-.\s]?)?\(?\d{2,4}\)?[-.\s]?\d{2,4}[-.\s]?\d{2,4}'
-    phones = re.findall(pattern, text)
-    return phones[0] if phones else None
+    match = PHONE_RE.search(text)
+    return match.group(0) if match else None
+
+def extract_contacts(text):
+    """
+    Extrae el primer email y el primer teléfono del texto
+
+    Returns:
+        Tupla (email, telefono); cualquiera de los dos puede ser None
+    """
+    return extract_email(text), extract_phone(text)
 
 def extract_institution(url, title):
     """Extrae el nombre de la institución desde URL o título"""
     # Extraer dominio
-    domain_match = re.search(r'https?://(?:www\.)?([^/]+)', url)
+    domain_match = DOMAIN_RE.search(url)
     if domain_match:
         domain = domain_match.group(1)
         # Limpiar dominio
@@ -27,33 +47,83 @@ def extract_institution(url, title):
         return domain
     return None
 
-def process_signal(result, keyword):
-    """
-    Procesa un resultado de búsqueda y extrae información relevante
-    
-    Args:
-        result: Diccionario con datos del resultado de Google
-        keyword: Keyword de búsqueda original
-    
-    Returns:
-        Diccionario con la señal procesada o None si no es válida
-    """
+def _build_signal(result, keyword, today):
+    """Construye la señal de un resultado con la fecha ya formateada"""
     if not result.get('url') or not result.get('titulo'):
         return None
-    
+
     text = f"{result.get('titulo', '')} {result.get('snippet', '')}"
-    
+    email, phone = extract_contacts(text)
+    # Los grupos de near_dedup traen el contacto de cualquiera de sus miembros
+    email = email or result.get('email')
+    phone = phone or result.get('telefono')
+    # Los resultados fusionados por dedup_results traen todas sus queries
+    if result.get('keywords'):
+        keyword = ' | '.join(result['keywords'])
+
     signal = {
-        'id': f"SIG-{datetime.now().strftime('%Y%m%d%H%M')}-{abs(hash(result['url'])) % 1000}",
+        'id': make_signal_id(result['url']),
         'titulo': result.get('titulo', ''),
         'url': result.get('url', ''),
+        'snippet': result.get('snippet', ''),
         'tipo_senal': 'Institucional - Programa 2026',
-        'email': extract_email(text),
-        'telefono': extract_phone(text),
+        'email': email,
+        'telefono': phone,
         'nombre_persona_o_institucion': extract_institution(result['url'], result['titulo']),
         'keyword_origen': keyword,
-        'fecha_detectada': datetime.now().strftime('%Y-%m-%d'),
+        'fecha_detectada': today,
         'fecha_evento': '2026'
     }
-    
+    # Otras URLs del mismo programa agrupadas por near_dedup
+    if result.get('urls_duplicadas'):
+        signal['urls_duplicadas'] = result['urls_duplicadas']
+
     return signal
+
+@instrumented('process_signal')
+def process_signal(result, keyword):
+    """
+    Procesa un resultado de búsqueda y extrae información relevante
+
+    Args:
+        result: Diccionario con datos del resultado de Google
+        keyword: Keyword de búsqueda original
+
+    Returns:
+        Diccionario con la señal procesada o None si no es válida
+    """
+    return _build_signal(result, keyword, datetime.now().strftime('%Y-%m-%d'))
+
+def process_signals(results, keyword=None):
+    """
+    Procesa una lista completa de resultados
+
+    Args:
+        results: Lista de diccionarios con datos de resultados de Google
+            (o resultados fusionados por dedup.dedup_results)
+        keyword: Keyword de búsqueda original, para resultados sin 'keywords'
+
+    Returns:
+        Lista de señales válidas, en el mismo orden que results
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    signals = []
+    # Un solo registro de métricas por lote: coste de medir independiente del volumen
+    with timed('process_signal', items=len(results)):
+        for result in results:
+            signal = _build_signal(result, keyword, today)
+            if signal:
+                signals.append(signal)
+    return signals
+
+def preview_signals(results, keyword):
+    """
+    Señales provisionales de los resultados de una query (vista previa SSE)
+
+    Igual que process_signals pero fuera de las métricas: la señal
+    definitiva se construye después en process_signals y es la que cuenta
+    en la etapa process_signal.
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    signals = (_build_signal(result, keyword, today) for result in results)
+    return [signal for signal in signals if signal]
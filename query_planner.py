@@ -0,0 +1,394 @@
+"""
+Planificador de búsquedas: reparte las llamadas a Custom Search por query
+
+Las queries se leen de queries.json (agrupadas en conjuntos) y de cada
+ejecución se guarda su rendimiento: páginas pagadas, URLs nuevas,
+contactos y la mezcla de prioridades de sus señales. Con un presupuesto
+de llamadas por ejecución, las queries que más señales 'Alta' dan por
+llamada reciben más páginas y las que no dan nada se pausan y solo se
+vuelven a probar de vez en cuando.
+"""
+import heapq
+import json
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+QUERIES_PATH = os.environ.get(
+    'SEARCH_QUERIES_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'queries.json')
+)
+QUERY_STATS_PATH = os.environ.get('QUERY_STATS_PATH', '/app/data/query_stats.sqlite')
+# Llamadas a la API por ejecución; si no se indica se usa el 'budget' del
+# fichero de queries. 0 desactiva el planificador (misma profundidad para todas)
+SEARCH_API_BUDGET = os.environ.get('SEARCH_API_BUDGET')
+
+PAGE_SIZE = 10
+# Custom Search no pasa de la posición 100
+MAX_PAGES = 10
+
+# Peso de cada ejecución anterior frente a la siguiente: el rendimiento
+# antiguo se va olvidando si la query cambia de comportamiento
+DECAY = 0.8
+# Rendimiento supuesto de una query sin historial, con el peso de
+# PRIOR_PAGES páginas: las nuevas empiezan con una media razonable
+PRIOR_VALUE = 1.0
+PRIOR_PAGES = 2.0
+# Cada página más profunda de una misma query rinde menos que la anterior
+DEPTH_DISCOUNT = 0.7
+# Una query con al menos MIN_EVIDENCE páginas y menos de DEAD_YIELD de
+# valor por página se pausa y solo se repite cada REVISIT_EVERY ejecuciones
+MIN_EVIDENCE = 3
+DEAD_YIELD = 0.05
+REVISIT_EVERY = 5
+# Parte del presupuesto reservada a queries nunca probadas
+EXPLORE_SHARE = 0.2
+
+DEFAULT_WEIGHTS = {'Alta': 3, 'Media': 1, 'Baja': 0, 'nuevas': 0.5, 'contactos': 0.5}
+
+DEFAULT_CONFIG = {
+    'budget': 24,
+    'max_pages': 5,
+    'weights': DEFAULT_WEIGHTS,
+    'sets': [
+        {
+            'name': 'default',
+            'queries': [
+                "summer school Madrid 2026 contact",
+                "business school summer course Madrid email",
+                "IE summer school contact",
+                "ESADE summer madrid admissions",
+                "Comillas summer school housing",
+                "EOI summer madrid contact",
+                "UC3M study abroad housing",
+                "Saint Louis University Madrid housing",
+                "SLU Madrid accommodation contact",
+                "Suffolk University Madrid study abroad contact",
+                "NYU Madrid study abroad housing",
+                "spanish school madrid summer course contact"
+            ]
+        }
+    ]
+}
+
+YIELD_FIELDS = ('pages', 'results', 'nuevas', 'contactos', 'Alta', 'Media', 'Baja')
+
+class QueryConfig:
+    """
+    Catálogo de queries
+
+    Args:
+        config: Diccionario con las claves de DEFAULT_CONFIG:
+            budget: Llamadas a la API por ejecución
+            max_pages: Páginas máximas por query (1-10)
+            weights: Valor de cada señal según prioridad, de cada URL
+                nueva y de cada contacto
+            sets: [{'name', 'queries', 'max_pages'?, 'enabled'?}]
+    """
+
+    def __init__(self, config):
+        self.budget = int(config.get('budget', DEFAULT_CONFIG['budget']))
+        self.weights = dict(DEFAULT_WEIGHTS, **config.get('weights', {}))
+        default_pages = min(int(config.get('max_pages', DEFAULT_CONFIG['max_pages'])), MAX_PAGES)
+        self.queries = []
+        self.max_pages = {}
+        self.sets = {}
+        for query_set in config['sets']:
+            if not query_set.get('enabled', True):
+                continue
+            pages = min(int(query_set.get('max_pages', default_pages)), MAX_PAGES)
+            for query in query_set['queries']:
+                query = query.strip()
+                if not query or query in self.max_pages:
+                    continue
+                self.queries.append(query)
+                self.max_pages[query] = max(1, pages)
+                self.sets[query] = query_set.get('name', '')
+
+def load_query_config(path=QUERIES_PATH):
+    """
+    Lee el catálogo de queries de un fichero JSON
+
+    Returns:
+        QueryConfig con el contenido del fichero, o con DEFAULT_CONFIG si
+        no existe o no es válido
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return QueryConfig(json.load(f))
+    except FileNotFoundError:
+        return QueryConfig(DEFAULT_CONFIG)
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"⚠️  Catálogo de queries no válido en {path}, usando el de por defecto: {e}")
+        return QueryConfig(DEFAULT_CONFIG)
+
+def measure_yield(result_counts, signals, today, api_calls=None):
+    """
+    Rendimiento de cada query en una ejecución
+
+    Una señal devuelta por varias queries (keyword_origen con ' | ') se
+    reparte a partes iguales entre ellas.
+
+    Args:
+        result_counts: {query: número de resultados} de las búsquedas que
+            terminaron sin error
+        signals: Señales finales clasificadas de la ejecución
+        today: Fecha 'YYYY-MM-DD'; las señales detectadas hoy son nuevas
+        api_calls: {query: llamadas pagadas} de search_many. Las queries
+            servidas por completo desde la caché no se cuentan (no dicen
+            nada del rendimiento por llamada) y las fallidas cuentan sus
+            llamadas sin valor. Sin él se estiman las páginas a partir de
+            los resultados.
+
+    Returns:
+        {query: {'pages', 'results', 'nuevas', 'contactos', 'Alta', 'Media', 'Baja'}}
+    """
+    if api_calls is None:
+        # Estimación: la paginación para al acabarse los resultados
+        pages = {query: max(1, math.ceil(count / PAGE_SIZE)) for query, count in result_counts.items()}
+    else:
+        pages = {query: calls for query, calls in api_calls.items() if calls}
+    yields = {}
+    for query, paid in pages.items():
+        yields[query] = dict.fromkeys(YIELD_FIELDS, 0.0)
+        yields[query]['pages'] = paid
+        yields[query]['results'] = result_counts.get(query, 0)
+
+    for signal in signals:
+        origins = [q.strip() for q in (signal.get('keyword_origen') or '').split(' | ')]
+        origins = [q for q in origins if q in yields and q in result_counts]
+        if not origins:
+            continue
+        share = 1.0 / len(origins)
+        for query in origins:
+            stats = yields[query]
+            if signal.get('fecha_detectada') == today:
+                stats['nuevas'] += share
+            if signal.get('email') or signal.get('telefono'):
+                stats['contactos'] += share
+            if signal.get('prioridad') in ('Alta', 'Media', 'Baja'):
+                stats[signal['prioridad']] += share
+    return yields
+
+class QueryPlanner:
+    """
+    Historial de rendimiento por query y reparto del presupuesto
+
+    El historial se guarda en SQLite como sumas con olvido exponencial
+    (DECAY por ejecución en la que se lanzó la query). Una sola conexión
+    protegida por lock.
+    """
+
+    def __init__(self, path=QUERY_STATS_PATH, config=None):
+        self.path = path
+        self.config = config or load_query_config()
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS query_yield (
+                query TEXT PRIMARY KEY,
+                runs INTEGER NOT NULL DEFAULT 0,
+                last_run INTEGER NOT NULL DEFAULT 0,
+                pages REAL NOT NULL DEFAULT 0,
+                results REAL NOT NULL DEFAULT 0,
+                nuevas REAL NOT NULL DEFAULT 0,
+                contactos REAL NOT NULL DEFAULT 0,
+                alta REAL NOT NULL DEFAULT 0,
+                media REAL NOT NULL DEFAULT 0,
+                baja REAL NOT NULL DEFAULT 0,
+                updated_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS planner_runs (
+                run INTEGER PRIMARY KEY,
+                fecha TEXT NOT NULL,
+                budget INTEGER NOT NULL,
+                pages INTEGER NOT NULL
+            );
+        ''')
+        self._conn.commit()
+
+    def _load_stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT query, runs, last_run, pages, nuevas, contactos, alta, media, baja FROM query_yield'
+            ).fetchall()
+            last_run = self._conn.execute('SELECT COALESCE(MAX(run), 0) FROM planner_runs').fetchone()[0]
+        stats = {}
+        for query, runs, query_last_run, pages, nuevas, contactos, alta, media, baja in rows:
+            stats[query] = {
+                'runs': runs, 'last_run': query_last_run, 'pages': pages, 'nuevas': nuevas,
+                'contactos': contactos, 'Alta': alta, 'Media': media, 'Baja': baja
+            }
+        return stats, last_run + 1
+
+    def _value(self, stats):
+        weights = self.config.weights
+        return sum(weights[field] * stats[field] for field in ('Alta', 'Media', 'Baja', 'nuevas', 'contactos'))
+
+    def score(self, stats):
+        """Valor esperado por página, suavizado hacia PRIOR_VALUE"""
+        if not stats:
+            return PRIOR_VALUE
+        return (self._value(stats) + PRIOR_VALUE * PRIOR_PAGES) / (stats['pages'] + PRIOR_PAGES)
+
+    def _is_dead(self, stats):
+        return stats['pages'] >= MIN_EVIDENCE and self._value(stats) / stats['pages'] < DEAD_YIELD
+
+    def plan(self, budget=None, default_results=PAGE_SIZE):
+        """
+        Decide cuántos resultados pedir a cada query
+
+        Primero una página para cada query elegible (las nunca probadas
+        tienen reservada EXPLORE_SHARE del presupuesto y el resto va por
+        puntuación); después cada página extra va a la query cuyo valor
+        esperado para esa página (puntuación x DEPTH_DISCOUNT^páginas) es
+        mayor, sin pasar de su max_pages.
+
+        Args:
+            budget: Llamadas a la API disponibles; None usa el del
+                catálogo, 0 o negativo pide default_results a todas
+            default_results: Resultados por query sin planificador
+
+        Returns:
+            Diccionario con:
+                queries: Queries a lanzar, en el orden del catálogo
+                num_results: {query: resultados a pedir}
+                pausadas: Queries sin rendimiento que no se lanzan
+                sin_presupuesto: Queries que no caben en el presupuesto
+                pages: Llamadas planificadas
+                budget: Presupuesto usado para el reparto
+        """
+        queries = self.config.queries
+        if budget is None:
+            budget = self.config.budget
+        if budget <= 0:
+            num_results = {query: default_results for query in queries}
+            return {
+                'queries': list(queries), 'num_results': num_results, 'pausadas': [], 'sin_presupuesto': [],
+                'pages': sum(math.ceil(n / PAGE_SIZE) for n in num_results.values()), 'budget': budget
+            }
+
+        stats, run = self._load_stats()
+        scores = {query: self.score(stats.get(query)) for query in queries}
+        eligible, paused, unexplored = [], [], []
+        for query in queries:
+            query_stats = stats.get(query)
+            if query_stats is None or query_stats['runs'] == 0:
+                unexplored.append(query)
+            elif self._is_dead(query_stats) and run - query_stats['last_run'] < REVISIT_EVERY:
+                paused.append(query)
+            else:
+                eligible.append(query)
+
+        # Primera página: las nuevas (hasta su cupo) y luego por puntuación
+        explore = unexplored[:max(1, int(budget * EXPLORE_SHARE))]
+        ranked = explore + sorted(eligible + unexplored[len(explore):], key=lambda q: -scores[q])
+        pages = {query: 1 for query in ranked[:budget]}
+        remaining = budget - len(pages)
+
+        # Páginas extra, una a una, a la de mayor valor marginal
+        heap = [(-scores[query] * DEPTH_DISCOUNT, query) for query in pages
+                if self.config.max_pages[query] > 1]
+        heapq.heapify(heap)
+        while remaining > 0 and heap:
+            _, query = heapq.heappop(heap)
+            pages[query] += 1
+            remaining -= 1
+            if pages[query] < self.config.max_pages[query]:
+                heapq.heappush(heap, (-scores[query] * DEPTH_DISCOUNT ** pages[query], query))
+
+        planned = [query for query in queries if query in pages]
+        skipped = set(ranked[budget:])
+        return {
+            'queries': planned,
+            'num_results': {query: pages[query] * PAGE_SIZE for query in planned},
+            'pausadas': paused,
+            'sin_presupuesto': [query for query in queries if query in skipped],
+            'pages': sum(pages.values()),
+            'budget': budget
+        }
+
+    def record_run(self, yields, budget=0, day=None):
+        """
+        Guarda el rendimiento de una ejecución
+
+        Args:
+            yields: {query: {...}} de measure_yield
+            budget: Presupuesto con el que se planificó la ejecución
+            day: Fecha de la ejecución (por defecto ahora)
+
+        Returns:
+            Número de la ejecución registrada
+        """
+        day = day or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            run = self._conn.execute('SELECT COALESCE(MAX(run), 0) + 1 FROM planner_runs').fetchone()[0]
+            self._conn.executemany(f'''
+                INSERT INTO query_yield (query, runs, last_run, pages, results, nuevas, contactos,
+                                         alta, media, baja, updated_at)
+                VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(query) DO UPDATE SET
+                    runs = runs + 1,
+                    last_run = excluded.last_run,
+                    pages = pages * {DECAY} + excluded.pages,
+                    results = results * {DECAY} + excluded.results,
+                    nuevas = nuevas * {DECAY} + excluded.nuevas,
+                    contactos = contactos * {DECAY} + excluded.contactos,
+                    alta = alta * {DECAY} + excluded.alta,
+                    media = media * {DECAY} + excluded.media,
+                    baja = baja * {DECAY} + excluded.baja,
+                    updated_at = excluded.updated_at
+            ''', (
+                (query, run, stats['pages'], stats['results'], stats['nuevas'], stats['contactos'],
+                 stats['Alta'], stats['Media'], stats['Baja'], day)
+                for query, stats in yields.items()
+            ))
+            self._conn.execute(
+                'INSERT INTO planner_runs (run, fecha, budget, pages) VALUES (?, ?, ?, ?)',
+                (run, day, budget, int(sum(stats['pages'] for stats in yields.values())))
+            )
+            self._conn.commit()
+        return run
+
+    def report(self):
+        """
+        Rendimiento acumulado de las queries del catálogo
+
+        Returns:
+            Lista de diccionarios ordenada por puntuación descendente
+        """
+        stats, run = self._load_stats()
+        rows = []
+        for query in self.config.queries:
+            query_stats = stats.get(query)
+            rows.append(dict(
+                query_stats or {'runs': 0, 'pages': 0},
+                query=query,
+                conjunto=self.config.sets[query],
+                puntuacion=round(self.score(query_stats), 3),
+                pausada=bool(query_stats and self._is_dead(query_stats)
+                             and run - query_stats['last_run'] < REVISIT_EVERY)
+            ))
+        return sorted(rows, key=lambda row: -row['puntuacion'])
+
+_planner = None
+_planner_lock = threading.Lock()
+
+def get_query_planner():
+    """Devuelve el planificador compartido del proceso (se crea en el primer uso)"""
+    global _planner
+    if _planner is None:
+        with _planner_lock:
+            if _planner is None:
+                _planner = QueryPlanner()
+    return _planner
+
+def get_search_budget():
+    """Presupuesto de llamadas por ejecución (SEARCH_API_BUDGET o el del catálogo)"""
+    if SEARCH_API_BUDGET not in (None, ''):
+        return int(SEARCH_API_BUDGET)
+    return get_query_planner().config.budget
@@ -0,0 +1,283 @@
+"""
+Limitador de ritmo adaptativo y reintentos para las APIs de Google
+
+Cada API (Custom Search, Sheets) tiene un cubo de tokens compartido por
+todos los hilos y procesos de la máquina (workers WSGI, shards): su estado
+vive en RATE_LIMIT_DIR y se lee y escribe con un ProcessLock. El ritmo
+sube poco a poco mientras las llamadas van bien y se reduce a la mitad con
+cada 429, así se mantiene cerca del límite de cuota sin rebasarlo de forma
+sostenida.
+"""
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+import metrics
+from process_lock import ProcessLock
+
+# Códigos HTTP que indican saturación o un fallo transitorio del servidor
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# Reintentos por llamada antes de propagar el error
+MAX_RETRIES = int(os.environ.get('GOOGLE_API_MAX_RETRIES', 5))
+# Espera base y máxima (segundos) del backoff exponencial
+BACKOFF_BASE = float(os.environ.get('GOOGLE_API_BACKOFF_BASE', 0.5))
+BACKOFF_MAX = float(os.environ.get('GOOGLE_API_BACKOFF_MAX', 60))
+
+# Ritmo inicial y máximo (peticiones por segundo) de cada API. Custom Search
+# admite 100 peticiones/minuto por proyecto y Sheets 60 por usuario; el
+# máximo es para todos los procesos juntos.
+API_RATES = {
+    'custom_search': (
+        float(os.environ.get('SEARCH_RATE_LIMIT', 1.5)),
+        float(os.environ.get('SEARCH_RATE_LIMIT_MAX', 100 / 60))
+    ),
+    'sheets': (
+        float(os.environ.get('SHEETS_RATE_LIMIT', 0.8)),
+        float(os.environ.get('SHEETS_RATE_LIMIT_MAX', 1))
+    )
+}
+# Directorio con el estado de los limitadores compartido entre procesos
+RATE_LIMIT_DIR = os.environ.get('RATE_LIMIT_DIR', '/app/data/ratelimit')
+# Segundos entre intentos de tomar el cerrojo del estado compartido
+LOCK_POLL_INTERVAL = 0.005
+
+class AdaptiveRateLimiter:
+    """
+    Cubo de tokens con ajuste AIMD del ritmo
+
+    Args:
+        rate: Peticiones por segundo iniciales
+        max_rate: Techo del ritmo; las subidas nunca lo pasan
+        min_rate: Suelo del ritmo tras reducciones sucesivas
+        burst: Tokens acumulables como máximo (ráfaga permitida)
+        increase: Peticiones/segundo que se suman por cada llamada correcta
+            (repartido entre las llamadas de un segundo de ritmo actual)
+    """
+
+    _clock = staticmethod(time.monotonic)
+
+    def __init__(self, rate, max_rate=None, min_rate=0.05, burst=None, increase=0.5):
+        self.max_rate = max(max_rate or rate, rate)
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._max_burst = self.burst
+        self.increase = increase
+        self._last_decrease = 0.0
+        self._tokens = 1.0
+        self._updated = self._clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _guard(self):
+        """Exclusión alrededor de cada cambio de estado"""
+        return self._lock
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + max(0.0, now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Bloquea hasta que se pueda hacer una petición y consume su token"""
+        while True:
+            with self._guard():
+                now = self._clock()
+                self._refill(now)
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def on_success(self):
+        """Subida aditiva: una llamada correcta sube el ritmo un poco"""
+        with self._guard():
+            self.rate = min(self.max_rate, self.rate + self.increase / max(self.rate, 1.0))
+            self.burst = min(self._max_burst, max(1.0, self.rate))
+
+    def on_throttle(self, retry_after=None):
+        """
+        Bajada multiplicativa tras un 429 o 503
+
+        Args:
+            retry_after: Segundos indicados por el servidor; mientras no
+                pasen, ningún hilo recibe tokens
+        """
+        with self._guard():
+            now = self._clock()
+            # Los 429 de peticiones que ya estaban en vuelo cuentan como uno
+            if now - self._last_decrease >= 1.0:
+                self._last_decrease = now
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.burst = max(1.0, min(self.burst, self.rate))
+                self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+class SharedRateLimiter(AdaptiveRateLimiter):
+    """
+    AdaptiveRateLimiter cuyo estado (tokens, ritmo, bloqueo por Retry-After)
+    se comparte entre procesos a través de un fichero
+
+    Cada operación toma el ProcessLock de la API, lee el estado, lo
+    actualiza y lo vuelve a escribir; los tiempos son de reloj de pared
+    para que signifiquen lo mismo en todos los procesos.
+
+    Args:
+        name: Nombre de la API (fichero <directory>/<name>.json)
+        directory: Directorio del estado compartido
+        Resto: como AdaptiveRateLimiter (valores iniciales si no hay estado)
+    """
+
+    _clock = staticmethod(time.time)
+    _FIELDS = ('rate', 'burst', '_tokens', '_updated', '_blocked_until', '_last_decrease')
+
+    def __init__(self, name, rate, max_rate=None, directory=None, **kwargs):
+        super().__init__(rate, max_rate, **kwargs)
+        directory = directory or RATE_LIMIT_DIR
+        self.path = os.path.join(directory, f"{name}.json")
+        self._process_lock = ProcessLock(f"ratelimit-{name}", directory)
+
+    @contextmanager
+    def _guard(self):
+        # La sección crítica dura microsegundos: esperar el cerrojo con el
+        # sondeo por defecto (0,5 s) frenaría a todos los procesos
+        self._process_lock.acquire(poll_interval=LOCK_POLL_INTERVAL)
+        try:
+            self._load()
+            yield
+            self._save()
+        finally:
+            self._process_lock.release()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for field in self._FIELDS:
+            if field in state:
+                setattr(self, field, state[field])
+        # Si cambió la configuración, el ritmo guardado se ajusta a ella
+        self.rate = min(max(self.rate, self.min_rate), self.max_rate)
+        self.burst = min(self.burst, self._max_burst)
+
+    def _save(self):
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump({field: getattr(self, field) for field in self._FIELDS}, f)
+        except OSError as e:
+            print(f"⚠️  No se pudo guardar el estado del limitador {self.path}: {e}")
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(api):
+    """Devuelve el limitador de una API ('custom_search', 'sheets'), compartido entre procesos"""
+    limiter = _limiters.get(api)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(api)
+            if limiter is None:
+                rate, max_rate = API_RATES.get(api, (1.0, 1.0))
+                limiter = _limiters[api] = SharedRateLimiter(api, rate, max_rate)
+    return limiter
+
+def _response_of(error):
+    """Respuesta HTTP asociada a la excepción (requests o gspread), o None"""
+    return getattr(error, 'response', None)
+
+def parse_retry_after(value):
+    """
+    Interpreta la cabecera Retry-After (segundos o fecha HTTP)
+
+    Returns:
+        Segundos de espera, o None si no hay cabecera o no se entiende
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+def _classify(error, idempotent=True):
+    """
+    Devuelve (reintentable, es_limite_de_cuota, retry_after) para un error
+
+    Con idempotent=False solo se reintenta el 429: tras un timeout, un
+    error de conexión o un 5xx el servidor puede haber aplicado ya la
+    llamada y repetirla la duplicaría.
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return idempotent, False, None
+    response = _response_of(error)
+    status = getattr(response, 'status_code', None)
+    if status not in RETRYABLE_STATUS or (not idempotent and status != 429):
+        return False, False, None
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    return True, status in (429, 503), retry_after
+
+def backoff_delay(attempt, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+    """Espera del reintento attempt (base 0) con jitter completo"""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+def call_with_retry(api, func, *args, max_retries=MAX_RETRIES, idempotent=True, **kwargs):
+    """
+    Llama a func respetando el limitador de api y reintentando los fallos
+    transitorios
+
+    Cada intento consume un token y una unidad de cuota. Con Retry-After se
+    espera al menos lo indicado por el servidor; sin él, backoff exponencial
+    con jitter para que los hilos no reintenten todos a la vez.
+
+    Args:
+        api: Nombre de la API ('custom_search', 'sheets')
+        func: Llamada a proteger; debe lanzar una excepción con .response
+            (requests.HTTPError, gspread APIError) para los errores HTTP
+        idempotent: False si repetir la llamada no es seguro (p. ej. añadir
+            filas); entonces solo se reintenta el 429
+
+    Returns:
+        Lo que devuelva func
+
+    Raises:
+        La última excepción si no es reintentable o se agotan los reintentos
+    """
+    limiter = get_limiter(api)
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            retryable, throttled, retry_after = _classify(e, idempotent)
+            if not retryable or attempt >= max_retries:
+                raise
+            if throttled:
+                limiter.on_throttle(retry_after)
+                metrics.count('api_throttled', api)
+            metrics.count('api_retries', api)
+            delay = backoff_delay(attempt)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        limiter.on_success()
+        return result
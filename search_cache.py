@@ -0,0 +1,122 @@
+"""
+Caché persistente en disco (SQLite) para las respuestas de Custom Search
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.environ.get('SEARCH_CACHE_PATH', '/app/cache/search_cache.sqlite')
+# TTL por defecto de cada página cacheada, en segundos (6 horas)
+DEFAULT_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 6 * 3600))
+# Número máximo de páginas guardadas antes de expulsar las menos usadas
+MAX_ENTRIES = int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', 5000))
+CACHE_DISABLED = os.environ.get('SEARCH_CACHE_DISABLED', '').lower() in ('1', 'true', 'yes')
+
+def normalize_query(query):
+    """Normaliza la query para que variaciones triviales compartan entrada"""
+    return ' '.join(query.lower().split())
+
+class SearchCache:
+    """
+    Caché de páginas de resultados con TTL y tamaño acotado
+
+    Cada entrada se identifica por (query normalizada, start, num, engine id).
+    Es segura entre hilos: una sola conexión protegida por un lock.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                query TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                num INTEGER NOT NULL,
+                engine_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (query, start, num, engine_id)
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages (accessed_at)')
+        self._conn.commit()
+
+    def get(self, query, start, num, engine_id, ttl=DEFAULT_TTL):
+        """
+        Devuelve la página cacheada o None si no existe o ha caducado
+
+        Args:
+            ttl: Antigüedad máxima aceptada en segundos para esta query
+        """
+        key = (normalize_query(query), start, num, engine_id)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT payload, fetched_at FROM pages '
+                'WHERE query = ? AND start = ? AND num = ? AND engine_id = ?',
+                key
+            ).fetchone()
+            if row is None or now - row[1] > ttl:
+                return None
+            self._conn.execute(
+                'UPDATE pages SET accessed_at = ? '
+                'WHERE query = ? AND start = ? AND num = ? AND engine_id = ?',
+                (now,) + key
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, query, start, num, engine_id, page):
+        """Guarda una página y expulsa las entradas menos usadas si sobra"""
+        now = time.time()
+        payload = json.dumps(page, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages '
+                '(query, start, num, engine_id, payload, fetched_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (normalize_query(query), start, num, engine_id, payload, now, now)
+            )
+            count = self._conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM pages WHERE rowid IN '
+                    '(SELECT rowid FROM pages ORDER BY accessed_at LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def clear(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._conn.execute('DELETE FROM pages')
+            self._conn.commit()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_search_cache():
+    """
+    Devuelve la caché compartida del proceso, o None si está desactivada
+    o no se puede abrir el fichero
+    """
+    global _cache
+    if CACHE_DISABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = SearchCache()
+                except Exception as e:
+                    print(f"⚠️  No se pudo abrir la caché de búsquedas: {e}")
+                    return None
+    return _cache
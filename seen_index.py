@@ -0,0 +1,136 @@
+"""
+Índice persistente (SQLite) de las URLs vistas en ejecuciones anteriores
+
+Guarda por URL canónica la fecha en que se vio por primera y por última
+vez y una huella del contenido del resultado, para que el motor solo
+procese los resultados nuevos o que han cambiado.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+SEEN_INDEX_PATH = os.environ.get('SEEN_INDEX_PATH', '/app/data/seen_index.sqlite')
+# '0' vuelve a procesar todos los resultados en cada ejecución
+INCREMENTAL_RUNS = os.environ.get('INCREMENTAL_RUNS', '1') == '1'
+
+# Claves por consulta en las sentencias IN (...), por debajo del límite de SQLite
+_LOOKUP_CHUNK = 500
+
+def _hash64(text):
+    """Entero con signo de 64 bits derivado de SHA-1 (cabe en un INTEGER de SQLite)"""
+    value = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'big')
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def url_key(canonical_url):
+    """Clave compacta de una URL ya canonicalizada"""
+    return _hash64(canonical_url)
+
+def fingerprint(result, salt=''):
+    """
+    Huella del contenido de un resultado
+
+    Cubre los campos de los que sale la señal (título, snippet, queries
+    que lo devolvieron, URLs agrupadas como casi duplicadas y contactos
+    tomados de ellas).
+
+    salt permite invalidar todas las huellas cuando cambia la forma de
+    procesar (p. ej. las reglas de prioridad).
+    """
+    parts = [
+        salt,
+        result.get('titulo', ''),
+        result.get('snippet', ''),
+        '\x1f'.join(sorted(result.get('keywords') or [])),
+        '\x1f'.join(sorted(result.get('urls_duplicadas') or []))
+    ]
+    # Solo los grupos con contacto fusionado: el resto conserva su huella
+    contacts = [result.get('email') or '', result.get('telefono') or '']
+    if any(contacts):
+        parts.extend(contacts)
+    return _hash64('\x1e'.join(parts))
+
+class SeenIndex:
+    """
+    Conjunto de URLs vistas con sus fechas y huellas
+
+    Cada URL ocupa una fila de tres enteros y dos fechas (tabla WITHOUT
+    ROWID con clave de 64 bits), así el índice sigue siendo pequeño con
+    cientos de miles de URLs. Una sola conexión protegida por lock.
+    """
+
+    def __init__(self, path=SEEN_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS seen (
+                key INTEGER PRIMARY KEY,
+                fingerprint INTEGER NOT NULL,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_seen_first ON seen (first_seen);
+        ''')
+        self._conn.commit()
+
+    def lookup(self, keys):
+        """
+        Devuelve {clave: (huella, first_seen, last_seen)} de las claves conocidas
+        """
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[i:i + _LOOKUP_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT key, fingerprint, first_seen, last_seen FROM seen "
+                    f"WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, fp, first_seen, last_seen in rows:
+                    found[key] = (fp, first_seen, last_seen)
+        return found
+
+    def mark_seen(self, entries, day=None):
+        """
+        Registra las URLs vistas hoy
+
+        Args:
+            entries: Iterable de (clave, huella)
+            day: Fecha 'YYYY-MM-DD' de la ejecución (por defecto hoy); se
+                guarda como last_seen y, en las URLs nuevas, como first_seen
+        """
+        day = day or datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            self._conn.executemany('''
+                INSERT INTO seen (key, fingerprint, first_seen, last_seen) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    fingerprint = excluded.fingerprint,
+                    last_seen = excluded.last_seen
+            ''', ((key, fp, day, day) for key, fp in entries))
+            self._conn.commit()
+
+    def count_new_since(self, day):
+        """Número de URLs vistas por primera vez desde day ('YYYY-MM-DD') incluido"""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM seen WHERE first_seen >= ?', (day,)).fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_seen_index():
+    """Devuelve el índice compartido del proceso (se crea en el primer uso)"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SeenIndex()
+    return _index
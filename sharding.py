@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Ejecución del motor repartida en shards
+
+Las queries del catálogo se reparten entre N shards con un hash estable
+(el mismo en cualquier proceso o máquina). Cada shard busca, extrae,
+enriquece y clasifica solo sus queries y escribe una instantánea parcial
+en SHARD_DIR, sin tocar el almacén ni Google Sheets. El merge une las
+parciales (misma URL devuelta por queries de shards distintos, casi
+duplicados entre shards), las ordena como lo haría una ejecución en un
+solo proceso y hace una única escritura en el almacén y en Sheets.
+
+Uso:
+    python sharding.py --processes 4                # 4 shards en esta máquina y merge
+    python sharding.py --shard 0 --shards 4         # un shard (p. ej. en otra máquina)
+    python sharding.py --merge --shards 4           # unir las parciales y escribir
+
+Los shards leen el índice de URLs vistas y el almacén locales para no
+reprocesar lo que no ha cambiado; en una máquina sin ellos procesan todo y
+el merge decide qué se escribe.
+"""
+import argparse
+import hashlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
+
+import metrics
+from dedup import canonicalize_url, make_signal_id
+from google_search import search_many
+from main import (
+    OUTPUT_FILE, RESULTS_PER_QUERY, SEARCH_WORKERS, build_signals, classify_signals, merge_results,
+    plan_incremental, result_counts, save_signals, split_search_results
+)
+from near_dedup import NEAR_DEDUP_ENABLED, find_clusters, representative
+from process_lock import ProcessLock
+from query_planner import get_query_planner, get_search_budget, measure_yield
+from seen_index import INCREMENTAL_RUNS, get_seen_index
+from signal_store import SIGNAL_BACKEND, get_signal_store
+from shared_snapshot import invalidate_published
+from snapshot_file import iter_signals, read_header, read_meta, write_snapshot
+
+SHARD_DIR = os.environ.get('SHARD_DIR', '/app/data/shards')
+
+def shard_of(query, num_shards):
+    """Shard de una query: hash SHA-1 estable (hash() cambia entre procesos)"""
+    digest = hashlib.sha1(query.strip().lower().encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+def shard_queries(queries, shard, num_shards):
+    """Queries del catálogo que le tocan a un shard, en el orden del catálogo"""
+    return [query for query in queries if shard_of(query, num_shards) == shard]
+
+def catalogue_digest(queries):
+    """Identifica el catálogo planificado: todos los shards deben compartirlo"""
+    return hashlib.sha1('\n'.join(queries).encode('utf-8')).hexdigest()[:12]
+
+def partial_path(shard, num_shards, directory=SHARD_DIR):
+    return os.path.join(directory, f"shard-{shard}-of-{num_shards}.ndjson")
+
+def _incremental():
+    # Igual que main.main: Sheets necesita la lista completa
+    return INCREMENTAL_RUNS and SIGNAL_BACKEND != 'sheets'
+
+def _first_positions(successful, catalogue_index):
+    """
+    Primera aparición de cada URL canónica
+
+    Returns:
+        {url canónica: (posición de la query en el catálogo, posición del
+        resultado en su query)}; ordenar por esto da el mismo orden que
+        dedup_results sobre el catálogo completo
+    """
+    positions = {}
+    for query, results in successful:
+        query_index = catalogue_index[query]
+        for rank, result in enumerate(results):
+            canonical = canonicalize_url(result.get('url', ''))
+            if canonical:
+                positions.setdefault(canonical, (query_index, rank))
+    return positions
+
+def _occurrences(successful, catalogue_index):
+    """
+    Apariciones de cada URL en los resultados
+
+    Returns:
+        {id de señal: [[posición de la query en el catálogo, posición del
+        resultado, snippet], ...]}; el merge las une entre shards en el
+        mismo orden que dedup_results
+    """
+    occurrences = {}
+    for query, results in successful:
+        query_index = catalogue_index[query]
+        for rank, result in enumerate(results):
+            if canonicalize_url(result.get('url', '')):
+                occurrences.setdefault(make_signal_id(result['url']), []).append(
+                    [query_index, rank, result.get('snippet', '')]
+                )
+    return occurrences
+
+def _joined_snippet(occurrences):
+    """Snippet de una URL devuelta varias veces: los distintos, como en dedup_results"""
+    snippet = ''
+    for _, _, other in sorted(occurrences, key=lambda occurrence: occurrence[:2]):
+        if other and other not in snippet:
+            snippet = f"{snippet} … {other}" if snippet else other
+    return snippet
+
+def _order_key(urls, positions):
+    keys = [positions[canonical] for canonical in map(canonicalize_url, urls) if canonical in positions]
+    return list(min(keys)) if keys else [len(positions), 0]
+
+def run_shard(shard, num_shards, directory=SHARD_DIR, use_cache=True):
+    """
+    Ejecuta un shard y escribe su instantánea parcial
+
+    Args:
+        shard: Número de shard (0 a num_shards - 1)
+        num_shards: Número total de shards
+        directory: Directorio de las instantáneas parciales
+        use_cache: False para ignorar la caché de búsquedas
+
+    Returns:
+        Ruta de la instantánea parcial
+    """
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"Shard {shard} fuera de rango (0-{num_shards - 1})")
+    metrics_before = metrics.snapshot()
+    today = datetime.now().strftime('%Y-%m-%d')
+    print(f"🧩 Shard {shard + 1}/{num_shards}")
+
+    # Todos los shards planifican el catálogo completo y se quedan con su parte
+    query_plan = get_query_planner().plan(get_search_budget(), default_results=RESULTS_PER_QUERY)
+    catalogue = query_plan['queries']
+    queries = shard_queries(catalogue, shard, num_shards)
+    print(f"🔍 Lanzando {len(queries)} de {len(catalogue)} búsquedas ({SEARCH_WORKERS} en paralelo)")
+    api_calls = {}
+    search_results = search_many(queries, num_results=query_plan['num_results'],
+                                 max_workers=SEARCH_WORKERS, use_cache=use_cache, api_calls=api_calls)
+    successful, failed_queries = split_search_results(search_results)
+    unique_results = merge_results(successful)
+
+    incremental = _incremental()
+    plan = plan_incremental(unique_results, today, skip_unchanged=incremental)
+    signals = {signal['id']: signal for signal in build_signals(plan['to_process'], plan['first_seen'], today)}
+    store = get_signal_store() if incremental else None
+
+    catalogue_index = {query: i for i, query in enumerate(catalogue)}
+    positions = _first_positions(successful, catalogue_index)
+    occurrences = _occurrences(successful, catalogue_index)
+    partial = []
+    order = {}
+    for result, signal_id in zip(unique_results, plan['active_ids']):
+        # Sin cambios: la señal que ya está en el almacén local
+        signal = signals.get(signal_id) or (store.get_signal(signal_id) if store else None)
+        if signal is None:
+            continue
+        partial.append(signal)
+        order[signal_id] = _order_key([result['url']] + (result.get('urls_duplicadas') or []), positions)
+
+    path = partial_path(shard, num_shards, directory)
+    write_snapshot(
+        partial, path,
+        header={
+            'fecha_generacion': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'shard': shard,
+            'num_shards': num_shards,
+            'catalogo': catalogue_digest(catalogue),
+            'incremental': plan['stats'],
+            'num_queries_fallidas': len(failed_queries)
+        },
+        meta={
+            'catalogo_queries': catalogue,
+            'presupuesto': query_plan['budget'],
+            'orden': order,
+            'apariciones': {signal['id']: occurrences.get(signal['id'], []) for signal in partial},
+            'resultados': result_counts(search_results),
+            'llamadas': api_calls,
+            'queries_fallidas': failed_queries,
+            'metricas': metrics.diff(metrics_before, metrics.snapshot())
+        }
+    )
+    print(f"📄 Shard {shard + 1}/{num_shards}: {len(partial)} señales en {path}")
+    return path
+
+def _split_keywords(signal):
+    return [k.strip() for k in (signal.get('keyword_origen') or '').split(' | ') if k.strip()]
+
+def _merge_into(target, other, catalogue_index, as_duplicate=False):
+    """
+    Une other en target (misma URL, o casi duplicado si as_duplicate)
+
+    Se conservan el título, la URL y el snippet de target (el de la misma
+    URL en varios shards lo rehace merge_partials); se juntan las keywords
+    (en el orden del catálogo), las URLs agrupadas y los contactos que
+    falten.
+    """
+    keywords = _split_keywords(target)
+    for keyword in _split_keywords(other):
+        if keyword not in keywords:
+            keywords.append(keyword)
+    keywords.sort(key=lambda k: catalogue_index.get(k, len(catalogue_index)))
+    target['keyword_origen'] = ' | '.join(keywords)
+
+    duplicates = list(target.get('urls_duplicadas') or [])
+    extra = ([other.get('url', '')] if as_duplicate else []) + list(other.get('urls_duplicadas') or [])
+    for url in extra:
+        if url and url != target.get('url') and url not in duplicates:
+            duplicates.append(url)
+    if duplicates:
+        target['urls_duplicadas'] = duplicates
+
+    for field in ('email', 'telefono'):
+        if not target.get(field) and other.get(field):
+            target[field] = other[field]
+    if other.get('fecha_detectada') and other['fecha_detectada'] < (target.get('fecha_detectada') or '9999'):
+        target['fecha_detectada'] = other['fecha_detectada']
+
+def load_partials(num_shards, directory=SHARD_DIR):
+    """
+    Lee y valida las instantáneas parciales de todos los shards
+
+    Returns:
+        Lista de (cabecera, meta, señales) en orden de shard
+
+    Raises:
+        ValueError: si falta algún shard o no comparten catálogo
+    """
+    partials = []
+    for shard in range(num_shards):
+        path = partial_path(shard, num_shards, directory)
+        header = read_header(path)
+        if header is None:
+            raise ValueError(f"Falta la instantánea del shard {shard} ({path})")
+        if header.get('shard') != shard or header.get('num_shards') != num_shards:
+            raise ValueError(f"{path} no es el shard {shard} de {num_shards}")
+        partials.append((header, read_meta(path), list(iter_signals(path))))
+    digests = {header['catalogo'] for header, _, _ in partials}
+    if len(digests) > 1:
+        raise ValueError("Los shards se planificaron con catálogos distintos; vuelve a ejecutarlos")
+    return partials
+
+def merge_partials(partials, known_ids=()):
+    """
+    Une las señales de los shards en una lista determinista
+
+    Args:
+        partials: Lista de (cabecera, meta, señales) de load_partials
+        known_ids: Ids de señal ya guardados (representantes de los casi
+            duplicados, como en near_dedup)
+
+    Returns:
+        Tupla (señales, orden): señales sin repetir, ordenadas por la primera
+        aparición en el catálogo, y {id: clave de orden}
+    """
+    catalogue_index = {query: i for i, query in enumerate(partials[0][1]['catalogo_queries'])}
+    copies = [
+        (meta['orden'].get(signal['id'], [len(catalogue_index), 0]), shard, signal)
+        for shard, (_, meta, signals) in enumerate(partials)
+        for signal in signals
+    ]
+    # Por orden de aparición: la primera copia manda, como en dedup_results
+    copies.sort(key=lambda copy: (copy[0], copy[1]))
+    merged = {}
+    order = {}
+    occurrences = {}
+    for key, shard, signal in copies:
+        signal_occurrences = partials[shard][1].get('apariciones', {}).get(signal['id'], [])
+        if signal['id'] in merged:
+            _merge_into(merged[signal['id']], signal, catalogue_index)
+            occurrences[signal['id']].extend(signal_occurrences)
+            merged[signal['id']]['snippet'] = _joined_snippet(occurrences[signal['id']])
+        else:
+            merged[signal['id']] = dict(signal)
+            order[signal['id']] = key
+            occurrences[signal['id']] = list(signal_occurrences)
+    signals = sorted(merged.values(), key=lambda s: (order[s['id']], s['id']))
+
+    # Casi duplicados entre shards (dentro de cada shard ya se agruparon)
+    if NEAR_DEDUP_ENABLED:
+        texts = [f"{s.get('titulo', '')} {s.get('snippet', '')}" for s in signals]
+        collapsed = []
+        for group in find_clusters(texts):
+            rep = signals[group[representative([signals[i]['url'] for i in group], known_ids)]]
+            for i in group:
+                member = signals[i]
+                if member is not rep:
+                    _merge_into(rep, member, catalogue_index, as_duplicate=True)
+                    order[rep['id']] = min(order[rep['id']], order[member['id']])
+            collapsed.append(rep)
+        if len(collapsed) < len(signals):
+            print(f"🧬 {len(signals) - len(collapsed)} casi duplicados agrupados entre shards")
+        signals = sorted(collapsed, key=lambda s: (order[s['id']], s['id']))
+    return signals, order
+
+def merge_shards(num_shards, directory=SHARD_DIR, started_at=None):
+    """
+    Une las parciales y hace la escritura consolidada
+
+    Toda la escritura (almacén, índice de URLs vistas, historial del
+    planificador) se hace con el cerrojo 'motor', el mismo que toma
+    /regenerate, y al terminar se invalida la instantánea de /api/signals.
+
+    Returns:
+        Lista de señales vigentes tras la escritura
+    """
+    motor_lock = ProcessLock('motor')
+    if not motor_lock.acquire(blocking=False):
+        print("⏳ Hay una ejecución del motor en curso; el merge espera a que termine")
+        motor_lock.acquire()
+    try:
+        signals = _merge_and_write(num_shards, directory, started_at)
+    finally:
+        motor_lock.release()
+    invalidate_published()
+    return signals
+
+def _merge_and_write(num_shards, directory, started_at):
+    started_at = started_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    today = datetime.now().strftime('%Y-%m-%d')
+    partials = load_partials(num_shards, directory)
+    incremental = _incremental()
+    known_ids = ()
+    if NEAR_DEDUP_ENABLED and SIGNAL_BACKEND != 'sheets':
+        known_ids = get_signal_store().active_ids(signal['id'] for _, _, signals in partials for signal in signals)
+    signals, _ = merge_partials(partials, known_ids)
+    print(f"🧩 {sum(len(p[2]) for p in partials)} señales de {num_shards} shards, {len(signals)} tras unirlas")
+    classify_signals(signals)
+
+    failed_queries = [failed for _, meta, _ in partials for failed in meta['queries_fallidas']]
+    counts = {}
+    api_calls = {}
+    for _, meta, _ in partials:
+        counts.update(meta['resultados'])
+        api_calls.update(meta.get('llamadas', {}))
+
+    # Qué ha cambiado respecto a lo que ya está escrito (mismas huellas que main)
+    pseudo_results = [{
+        'url': signal['url'],
+        'url_canonica': canonicalize_url(signal['url']),
+        'titulo': signal.get('titulo', ''),
+        'snippet': signal.get('snippet', ''),
+        'keywords': _split_keywords(signal),
+        'urls_duplicadas': signal.get('urls_duplicadas') or [],
+        # Como los grupos de near_dedup, que traen el contacto de sus miembros
+        'email': signal.get('email') if signal.get('urls_duplicadas') else None,
+        'telefono': signal.get('telefono') if signal.get('urls_duplicadas') else None
+    } for signal in signals]
+    plan = plan_incremental(pseudo_results, today, skip_unchanged=incremental)
+    changed_ids = {id(result) for result in plan['to_process']}
+    changed = [signal for signal, result in zip(signals, pseudo_results) if id(result) in changed_ids]
+    for signal in changed:
+        signal['fecha_detectada'] = plan['first_seen'].get(signal['id'], today)
+    stats = plan['stats']
+    print(f"🆕 {stats['nuevas']} nuevas, {stats['modificadas']} modificadas, "
+          f"{stats['sin_cambios']} sin cambios desde la última ejecución")
+
+    with metrics.timed('save_signals', items=len(changed)):
+        save_signals(changed if incremental else signals, started_at, failed_queries,
+                     active_ids=plan['active_ids'] if incremental else None,
+                     searched_queries=set(counts))
+    get_seen_index().mark_seen(plan['seen'], today)
+    if SIGNAL_BACKEND != 'sheets':
+        signals = get_signal_store().get_signals()
+    get_query_planner().record_run(measure_yield(counts, signals, today, api_calls),
+                                   budget=partials[0][1]['presupuesto'])
+
+    write_snapshot(
+        signals, OUTPUT_FILE,
+        header={
+            'fecha_generacion': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'incremental': stats,
+            'num_queries_fallidas': len(failed_queries),
+            'shards': num_shards
+        },
+        meta={
+            'queries_fallidas': failed_queries,
+            'metricas': [meta['metricas'] for _, meta, _ in partials]
+        }
+    )
+    print(f"\n✅ Merge completado: {len(signals)} señales")
+    print(f"📄 Instantánea: {OUTPUT_FILE}")
+    return signals
+
+def _run_shard_process(args):
+    return run_shard(*args)
+
+def run_local(num_shards, processes=None, directory=SHARD_DIR, use_cache=True):
+    """
+    Ejecuta todos los shards en procesos de esta máquina y después el merge
+
+    Returns:
+        Lista de señales vigentes tras la escritura
+    """
+    started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    processes = processes or num_shards
+    # spawn: los hijos no heredan conexiones SQLite ni hilos del padre
+    context = multiprocessing.get_context('spawn')
+    jobs = [(shard, num_shards, directory, use_cache) for shard in range(num_shards)]
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        list(executor.map(_run_shard_process, jobs))
+    return merge_shards(num_shards, directory, started_at=started_at)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Motor de señales repartido en shards')
+    parser.add_argument('--shards', type=int, help='Número total de shards (por defecto, --processes)')
+    parser.add_argument('--shard', type=int, help='Ejecutar solo este shard (0 a shards - 1)')
+    parser.add_argument('--merge', action='store_true', help='Unir las parciales y escribir')
+    parser.add_argument('--processes', type=int, help='Ejecutar todos los shards en N procesos y unirlos')
+    parser.add_argument('--dir', default=SHARD_DIR, help='Directorio de las instantáneas parciales')
+    parser.add_argument('--no-cache', action='store_true', help='Ignorar la caché de búsquedas')
+    args = parser.parse_args(argv)
+
+    num_shards = args.shards or args.processes
+    if not num_shards or num_shards < 1:
+        parser.error('indica --shards o --processes')
+    if args.shard is not None:
+        run_shard(args.shard, num_shards, args.dir, use_cache=not args.no_cache)
+    elif args.merge:
+        try:
+            merge_shards(num_shards, args.dir)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+    elif args.processes:
+        run_local(num_shards, args.processes, args.dir, use_cache=not args.no_cache)
+    else:
+        parser.error('indica --shard, --merge o --processes')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""
+Instantánea de /api/signals en un fichero compartido por todos los workers
+
+Un worker construye el fichero (respuesta JSON ya serializada, posiciones
+de cada señal dentro de ella, ordenaciones, texto de búsqueda, índices y
+estadísticas) y todos lo abren con mmap de solo lectura. Las páginas del
+fichero viven una sola vez en la caché del sistema operativo, así la
+memoria no crece con el número de workers; cada worker solo guarda la
+cabecera y, si se filtra, los índices.
+
+Estructura del fichero:
+    1. Cabecera de HEADER_SIZE bytes (JSON rellenado con espacios) con el
+       ETag, la fecha de construcción y la posición de cada sección.
+    2. Secciones alineadas a 8 bytes: body, row_start/row_end (uint64 por
+       señal), order_<campo> y rank_<campo> (uint32 por señal: orden y
+       posición de cada señal en ese orden), search y search_start,
+       indexes (JSON) y stats (cuerpo de /api/signals/stats).
+"""
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+from process_lock import ProcessLock
+from signal_cache import (
+    SIGNALS_CACHE_TTL, SORTABLE_FIELDS, SignalQueries, index_signals, signal_stats, sort_positions
+)
+
+SHARED_SNAPSHOT_PATH = os.environ.get('SIGNALS_API_SNAPSHOT_PATH', '/app/data/api_signals.snapshot')
+SHARED_SNAPSHOT_FORMAT = 'signals-api/1'
+HEADER_SIZE = 4096
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _uint_array(typecode, values):
+    result = array(typecode, values)
+    if result.itemsize != {'I': 4, 'Q': 8}[typecode]:
+        raise RuntimeError(f"array('{typecode}') no tiene el tamaño esperado en esta plataforma")
+    return result
+
+def publish(payload, path=SHARED_SNAPSHOT_PATH):
+    """
+    Escribe la instantánea compartida de un payload de /api/signals
+
+    Se escribe en un temporal del mismo directorio y se renombra, así los
+    workers que ya la tienen abierta siguen leyendo la anterior.
+
+    Args:
+        payload: Diccionario de /api/signals con la lista 'signals'
+        path: Ruta del fichero
+
+    Returns:
+        ETag de la respuesta completa
+    """
+    signals = payload.get('signals', [])
+    rest = {key: value for key, value in payload.items() if key != 'signals'}
+
+    # Cuerpo de la respuesta a mano para conocer dónde empieza cada señal
+    prefix = _dumps(rest)[:-1] + (b',' if rest else b'') + b'"signals":['
+    row_start, row_end = [], []
+    parts = [prefix]
+    offset = len(prefix)
+    for position, signal in enumerate(signals):
+        if position:
+            parts.append(b',')
+            offset += 1
+        row = _dumps(signal)
+        parts.append(row)
+        row_start.append(offset)
+        offset += len(row)
+        row_end.append(offset)
+    parts.append(b']}')
+    body = b''.join(parts)
+    etag = hashlib.sha256(body).hexdigest()[:32]
+
+    indexes = index_signals(signals)
+    search = indexes.pop('search_text')
+    search_start, position = [], 0
+    for text in search:
+        search_start.append(position)
+        position += len(text.encode('utf-8')) + 1
+    stats_body = _dumps({
+        'success': True, 'stats': signal_stats(indexes, len(signals), payload.get('last_execution'))
+    })
+
+    sections = [
+        ('body', body),
+        ('row_start', _uint_array('Q', row_start).tobytes()),
+        ('row_end', _uint_array('Q', row_end).tobytes()),
+    ]
+    for field in SORTABLE_FIELDS:
+        order = sort_positions(signals, field)
+        rank = [0] * len(order)
+        for index, position in enumerate(order):
+            rank[position] = index
+        sections.append((f"order_{field}", _uint_array('I', order).tobytes()))
+        sections.append((f"rank_{field}", _uint_array('I', rank).tobytes()))
+    sections += [
+        ('search', '\n'.join(search).encode('utf-8') + b'\n'),
+        ('search_start', _uint_array('Q', search_start).tobytes()),
+        ('indexes', _dumps({
+            'by_priority': indexes['by_priority'],
+            'by_institution': indexes['by_institution'],
+            'by_keyword': indexes['by_keyword']
+        })),
+        ('stats', stats_body)
+    ]
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.api-snapshot-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b' ' * (HEADER_SIZE - 1) + b'\n')
+            layout = {}
+            for name, data in sections:
+                padding = -f.tell() % 8
+                f.write(b'\0' * padding)
+                layout[name] = [f.tell(), len(data)]
+                f.write(data)
+            header = _dumps({
+                'formato': SHARED_SNAPSHOT_FORMAT,
+                'etag': etag,
+                'stats_etag': hashlib.sha256(stats_body).hexdigest()[:32],
+                'built_at': time.time(),
+                'total': len(signals),
+                'last_execution': payload.get('last_execution'),
+                'sections': layout
+            })
+            if len(header) > HEADER_SIZE - 1:
+                raise ValueError(f"Cabecera de la instantánea compartida demasiado grande ({len(header)} bytes)")
+            f.seek(0)
+            f.write(header + b' ' * (HEADER_SIZE - 1 - len(header)) + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return etag
+
+class MappedSignalSnapshot(SignalQueries):
+    """
+    Instantánea compartida abierta con mmap, consultable con SignalQueries
+
+    body es un memoryview sobre el fichero: se envía sin copiarlo.
+    query() decodifica solo las señales de la página y query_body() las
+    copia del fichero sin decodificarlas.
+    """
+
+    def __init__(self, path=SHARED_SNAPSHOT_PATH):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = json.loads(mapped[:HEADER_SIZE].decode('utf-8'))
+        if header.get('formato') != SHARED_SNAPSHOT_FORMAT:
+            raise ValueError(f"{path} no es una instantánea {SHARED_SNAPSHOT_FORMAT}")
+        self.path = path
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        self.built_at = header['built_at']
+        self.count = header['total']
+        self.etag = header['etag']
+        self.stats_etag = header['stats_etag']
+        self.payload = {'total': self.count, 'last_execution': header['last_execution']}
+        self._mmap = mapped
+        self._view = memoryview(mapped)
+        self._sections = header['sections']
+        self.body = self._section('body')
+        self.stats_body = bytes(self._section('stats'))
+        self._row_start = self._section('row_start').cast('Q')
+        self._row_end = self._section('row_end').cast('Q')
+        self._search_start = self._section('search_start').cast('Q')
+        self._indexes = None
+        self._indexes_lock = threading.Lock()
+
+    def _section(self, name):
+        offset, length = self._sections[name]
+        return self._view[offset:offset + length]
+
+    def _load_indexes(self):
+        if self._indexes is None:
+            with self._indexes_lock:
+                if self._indexes is None:
+                    self._indexes = json.loads(bytes(self._section('indexes')).decode('utf-8'))
+        return self._indexes
+
+    @property
+    def by_priority(self):
+        return self._load_indexes()['by_priority']
+
+    @property
+    def by_institution(self):
+        return self._load_indexes()['by_institution']
+
+    @property
+    def by_keyword(self):
+        return self._load_indexes()['by_keyword']
+
+    def _row(self, position):
+        start, end = self._row_start[position], self._row_end[position]
+        return json.loads(self.body[start:end].tobytes().decode('utf-8'))
+
+    def _sorted_positions(self, field):
+        return self._section(f"order_{field}").cast('I')
+
+    def _order_candidates(self, field, candidates):
+        # Ordenar solo los candidatos por su rango: no recorre todas las señales
+        return sorted(candidates, key=self._section(f"rank_{field}").cast('I').__getitem__)
+
+    def query_body(self, extra=None, **params):
+        """Como SignalQueries.query_body, copiando las señales tal cual del fichero"""
+        positions, info = self._page(**params)
+        body = self.body
+        rows = b','.join(body[self._row_start[p]:self._row_end[p]] for p in positions)
+        info.update(extra or {})
+        return b'{"signals":[' + rows + b'],' + _dumps(info)[1:]
+
+    def _search(self, needle, pool):
+        """Busca needle en la sección de texto con mmap.find, sin decodificarla"""
+        needle = needle.encode('utf-8')
+        offset, length = self._sections['search']
+        end = offset + length
+        found = set()
+        position = self._mmap.find(needle, offset, end)
+        while position != -1:
+            line = bisect_right(self._search_start, position - offset) - 1
+            found.add(line)
+            # Seguir desde la línea siguiente: una coincidencia por señal basta
+            next_start = offset + self._search_start[line + 1] if line + 1 < self.count else end
+            position = self._mmap.find(needle, next_start, end)
+        if not isinstance(pool, range):
+            found &= pool
+        return found
+
+def invalidate_published(path=SHARED_SNAPSHOT_PATH):
+    """
+    Borra la instantánea publicada para que los workers la reconstruyan
+
+    Se puede llamar desde cualquier proceso (p. ej. el merge de sharding).
+    Espera a que termine una reconstrucción en curso, que podría haber
+    leído datos anteriores.
+    """
+    with ProcessLock('signals-snapshot'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+class SharedSnapshotCache:
+    """
+    Caché de /api/signals compartida entre procesos a través del fichero
+
+    Cada petición comprueba con un stat si otro worker ha publicado una
+    instantánea nueva. Cuando caduca (ttl) o se invalida, un solo worker
+    (ProcessLock) vuelve a llamar a loader() y publica; los demás siguen
+    sirviendo la que tienen abierta hasta que aparece la nueva.
+    """
+
+    def __init__(self, loader, path=SHARED_SNAPSHOT_PATH, ttl=SIGNALS_CACHE_TTL):
+        self.loader = loader
+        self.path = path
+        self.ttl = ttl
+        self._snapshot = None
+        self._load_lock = threading.Lock()
+        self._process_lock = ProcessLock('signals-snapshot')
+
+    def _file_identity(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _is_fresh(self, snapshot):
+        return snapshot is not None and time.time() - snapshot.built_at < self.ttl
+
+    def _open_published(self):
+        """Abre el fichero publicado si existe y no ha caducado"""
+        snapshot = self._snapshot
+        identity = self._file_identity()
+        if identity is None:
+            return None
+        if snapshot is None or snapshot.identity != identity:
+            try:
+                snapshot = MappedSignalSnapshot(self.path)
+            except (OSError, ValueError):
+                return None
+        return snapshot if self._is_fresh(snapshot) else None
+
+    def get(self):
+        """Devuelve la instantánea vigente, reconstruyéndola si hace falta"""
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot) and self._file_identity() == snapshot.identity:
+            return snapshot
+
+        with self._load_lock:
+            published = self._open_published()
+            if published is not None:
+                self._snapshot = published
+                return published
+            # Si hay una instantánea abierta, servirla mientras otro worker reconstruye
+            if not self._process_lock.acquire(blocking=self._snapshot is None):
+                return self._snapshot
+            try:
+                published = self._open_published()
+                if published is None:
+                    publish(self.loader(), self.path)
+                    published = MappedSignalSnapshot(self.path)
+                self._snapshot = published
+                return published
+            finally:
+                self._process_lock.release()
+
+    def invalidate(self):
+        """Descarta la instantánea en todos los workers (ver invalidate_published)"""
+        invalidate_published(self.path)
@@ -0,0 +1,118 @@
+"""
+Réplica asíncrona del almacén local de señales hacia Google Sheets
+"""
+import os
+import threading
+import time
+
+from process_lock import ProcessLock
+
+# Espera tras un aviso para agrupar varios cambios en una sola escritura
+REPLICATION_DEBOUNCE = float(os.environ.get('SHEETS_REPLICATION_DEBOUNCE', 2))
+# Comprobación periódica aunque no lleguen avisos (p. ej. tras un fallo)
+REPLICATION_INTERVAL = float(os.environ.get('SHEETS_REPLICATION_INTERVAL', 60))
+# Espera máxima entre reintentos cuando Sheets no responde
+MAX_RETRY_DELAY = 600
+
+class SheetsReplicator:
+    """
+    Copia el estado del almacén al sheet cuando cambia su versión
+
+    Cada sincronización envía el conjunto completo de señales activas a
+    write_signals_to_sheet, que en modo incremental solo escribe las filas
+    que difieren. Si Sheets falla, el almacén sigue sirviendo lecturas y
+    escrituras y la réplica se reintenta con espera creciente.
+    """
+
+    def __init__(self, store, debounce=REPLICATION_DEBOUNCE, interval=REPLICATION_INTERVAL):
+        self.store = store
+        self.debounce = debounce
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._sync_lock = threading.Lock()
+        # Con varios workers WSGI, las sincronizaciones de todos se turnan
+        self._process_lock = ProcessLock('sheets-sync')
+        self._thread = None
+        self._failures = 0
+        self.last_error = None
+        self.last_sync_at = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Arranca el hilo de réplica (idempotente)"""
+        if self.is_running():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='sheets-replicator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self):
+        """Avisa de que el almacén ha cambiado"""
+        self._wake.set()
+
+    def pending(self):
+        """True si hay cambios sin replicar"""
+        return self.store.version() > self.store.replicated_version()
+
+    def sync_once(self):
+        """
+        Replica ahora si hay cambios pendientes
+
+        Returns:
+            True si el sheet quedó al día, False si falló la escritura
+        """
+        from sheets_writer import write_signals_to_sheet
+
+        with self._sync_lock, self._process_lock:
+            version = self.store.version()
+            if version <= self.store.replicated_version():
+                return True
+            signals = self.store.get_signals()
+            if not write_signals_to_sheet(signals):
+                self.last_error = 'write_signals_to_sheet devolvió False'
+                return False
+            self.store.mark_replicated(version)
+            self.last_error = None
+            self.last_sync_at = time.time()
+            return True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if self._failures:
+                timeout = min(self.debounce * 2 ** self._failures, MAX_RETRY_DELAY)
+            else:
+                timeout = self.interval
+            self._wake.wait(timeout)
+            if self._stop.is_set():
+                return
+            if self._wake.is_set():
+                # Agrupar los avisos que lleguen durante la espera
+                time.sleep(self.debounce)
+                self._wake.clear()
+            try:
+                ok = self.sync_once()
+            except Exception as e:
+                print(f"❌ Error replicando señales en Google Sheets: {e}")
+                self.last_error = str(e)
+                ok = False
+            self._failures = 0 if ok else self._failures + 1
+
+_replicator = None
+_replicator_lock = threading.Lock()
+
+def get_replicator():
+    """Devuelve el replicador compartido del proceso (sin arrancarlo)"""
+    global _replicator
+    if _replicator is None:
+        with _replicator_lock:
+            if _replicator is None:
+                from signal_store import get_signal_store
+                _replicator = SheetsReplicator(get_signal_store())
+    return _replicator
@@ -3,8 +3,16 @@ Módulo para escribir y leer señales en Google Sheets usando gspread
 """
 import gspread
 from google.oauth2.service_account import Credentials
+import google.auth.exceptions
+import requests
 import json
 import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from rate_limit import call_with_retry
 
 SHEET_ID = "1-6e0U1SATcgs2V8u2fOoDoKIrLjzwJi8GxJtUwy9t_U"
 SHEET_URL = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/edit"
@@ -12,78 +20,331 @@ SHEET_URL = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/edit"
 # Credenciales de servicio (se cargarán desde variable de entorno en Railway)
 SERVICE_ACCOUNT_JSON = os.environ.get('GOOGLE_SERVICE_ACCOUNT_JSON')
 
-def get_sheet_client():
-    """Obtiene cliente autenticado de Google Sheets"""
-    try:
-        if SERVICE_ACCOUNT_JSON:
-            # Cargar credenciales desde variable de entorno
-            creds_dict = json.loads(SERVICE_ACCOUNT_JSON)
-            creds = Credentials.from_service_account_info(
-                creds_dict,
-                scopes=['https://www.googleapis.com/auth/spreadsheets']
-            )
-        else:
-            # Fallback: intentar cargar desde archivo local (solo para desarrollo)
-            creds = Credentials.from_service_account_file(
-                'service_account.json',
-                scopes=['https://www.googleapis.com/auth/spreadsheets']
-            )
-        
-        client = gspread.authorize(creds)
-        return client
-    except Exception as e:
-        print(f"❌ Error autenticando con Google Sheets: {e}")
-        return None
+# 'incremental' sincroniza solo las diferencias; 'full' reescribe todo el sheet
+SYNC_MODE = os.environ.get('SHEETS_SYNC_MODE', 'incremental')
+
+# Orden de las columnas del sheet (A..J)
+SHEET_COLUMNS = [
+    'id',
+    'tipo_senal',
+    'keyword_origen',
+    'url',
+    'titulo',
+    'nombre_persona_o_institucion',
+    'email',
+    'telefono',
+    'prioridad',
+    'fecha_evento'
+]
+LAST_COLUMN = chr(ord('A') + len(SHEET_COLUMNS) - 1)
+URL_COLUMN = SHEET_COLUMNS.index('url')
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+# Handles de worksheet abiertos a la vez (peticiones de Flask + motor)
+POOL_SIZE = int(os.environ.get('SHEETS_POOL_SIZE', 4))
+
+_service_account_info = None
+_service_account_lock = threading.Lock()
+
+def _build_credentials():
+    """Crea credenciales de servicio leyendo el JSON una sola vez por proceso"""
+    global _service_account_info
+    if _service_account_info is None:
+        with _service_account_lock:
+            if _service_account_info is None:
+                if SERVICE_ACCOUNT_JSON:
+                    # Cargar credenciales desde variable de entorno
+                    _service_account_info = json.loads(SERVICE_ACCOUNT_JSON)
+                else:
+                    # Fallback: intentar cargar desde archivo local (solo para desarrollo)
+                    with open('service_account.json', 'r', encoding='utf-8') as f:
+                        _service_account_info = json.load(f)
+    # El token se pide (y se renueva al caducar) en la primera llamada a la API
+    return Credentials.from_service_account_info(_service_account_info, scopes=SCOPES)
+
+def _should_reconnect(error):
+    """Indica si el error invalida el handle (autenticación o transporte)"""
+    if isinstance(error, gspread.exceptions.APIError):
+        response = getattr(error, 'response', None)
+        return response is not None and response.status_code == 401
+    return isinstance(error, (
+        google.auth.exceptions.RefreshError,
+        google.auth.exceptions.TransportError,
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout
+    ))
+
+def sheets_call(kind, func, *args, idempotent=True, **kwargs):
+    """
+    Llama a la API de Sheets a través del limitador compartido
+
+    Los 429 y 5xx se reintentan con backoff en lugar de hacer fallar toda
+    la escritura; cada intento cuenta como una unidad de cuota. Todas las
+    escrituras de este módulo son idempotentes (rangos fijos, resize a un
+    tamaño absoluto); una llamada que no lo sea debe pasar
+    idempotent=False para no repetirse tras un timeout o un 5xx.
+
+    Args:
+        kind: 'sheets_read' o 'sheets_write' (contador de cuota)
+        func: Método de gspread a llamar con args y kwargs
+        idempotent: False si repetir la llamada puede duplicar su efecto
+    """
+    def attempt():
+        metrics.add_api_units(kind, 1)
+        return func(*args, **kwargs)
+    return call_with_retry('sheets', attempt, idempotent=idempotent)
+
+def _ensure_rows(sheet, needed_rows):
+    """Amplía la rejilla hasta needed_rows (tamaño absoluto: se puede repetir)"""
+    if needed_rows > sheet.row_count:
+        sheets_call('sheets_write', sheet.resize, rows=needed_rows)
+
+class SheetHandle:
+    """Cliente autenticado con el spreadsheet y su primera hoja ya abiertos"""
+
+    def __init__(self):
+        self.client = gspread.authorize(_build_credentials())
+        # open_by_key y sheet1 leen cada uno los metadatos del spreadsheet
+        self.spreadsheet = sheets_call('sheets_read', self.client.open_by_key, SHEET_ID)
+        self.worksheet = sheets_call('sheets_read', lambda: self.spreadsheet.sheet1)
+
+    def refresh(self):
+        """Vuelve a leer los metadatos de la hoja (p. ej. row_count)"""
+        self.worksheet = sheets_call('sheets_read', lambda: self.spreadsheet.sheet1)
+
+class WorksheetPool:
+    """
+    Pool de handles de worksheet reutilizables entre hilos
+
+    Cada handle tiene su propio cliente, así las lecturas de Flask y una
+    ejecución del motor no se bloquean entre sí. Un handle solo se descarta
+    (y se recrea en el siguiente uso) tras un error de autenticación o de
+    transporte; el resto de errores no afectan a la conexión.
+    """
+
+    def __init__(self, size=POOL_SIZE, handle_factory=None):
+        self.handle_factory = handle_factory or SheetHandle
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def worksheet(self, fresh=False):
+        """
+        Presta un worksheet del pool durante el bloque with
+
+        Args:
+            fresh: True para releer los metadatos de la hoja antes de usarla;
+                necesario al escribir, porque otro proceso puede haber
+                cambiado el número de filas
+        """
+        self._slots.acquire()
+        handle = None
+        reusable = False
+        try:
+            with self._lock:
+                handle = self._idle.pop() if self._idle else None
+            if handle is None:
+                handle = self.handle_factory()
+            elif fresh:
+                handle.refresh()
+            yield handle.worksheet
+            reusable = True
+        except Exception as e:
+            reusable = handle is not None and not _should_reconnect(e)
+            raise
+        finally:
+            if reusable:
+                with self._lock:
+                    self._idle.append(handle)
+            self._slots.release()
+
+    def reset(self):
+        """Descarta todos los handles inactivos"""
+        with self._lock:
+            self._idle = []
+
+_pool = WorksheetPool()
+
+def worksheet_handle(fresh=False):
+    """Context manager que presta un worksheet del pool compartido"""
+    return _pool.worksheet(fresh=fresh)
+
+def set_worksheet_pool(pool):
+    """Sustituye el pool compartido (p. ej. por uno con un sheet falso en benchmarks)"""
+    global _pool
+    _pool = pool
+
+def signal_to_row(signal):
+    """Convierte una señal en la fila que se guarda en el sheet"""
+    row = [
+        signal.get('id', ''),
+        signal.get('tipo_senal', ''),
+        signal.get('keyword_origen', ''),
+        signal.get('url', ''),
+        signal.get('titulo', ''),
+        signal.get('nombre_persona_o_institucion', ''),
+        signal.get('email', ''),
+        signal.get('telefono', ''),
+        signal.get('prioridad', ''),
+        signal.get('fecha_evento', signal.get('fecha_detectada', ''))
+    ]
+    # El sheet devuelve siempre strings: normalizar para poder comparar filas
+    return ['' if value is None else str(value) for value in row]
+
+def _row_keys(rows):
+    """
+    Calcula la clave estable de cada fila: (url, nº de aparición)
 
-def write_signals_to_sheet(signals):
+    El número de aparición distingue filas repetidas con la misma URL.
+    Las filas sin URL no tienen clave y se consideran huecos libres.
+    """
+    seen = {}
+    keys = []
+    for row in rows:
+        url = row[URL_COLUMN].strip() if len(row) > URL_COLUMN else ''
+        if not url:
+            keys.append(None)
+            continue
+        seen[url] = seen.get(url, 0) + 1
+        keys.append((url, seen[url]))
+    return keys
+
+def _row_range(first_row, last_row):
+    """Rango A1 que cubre filas completas del sheet (1-based, inclusivo)"""
+    return f"A{first_row}:{LAST_COLUMN}{last_row}"
+
+def compute_sheet_delta(existing_rows, new_rows):
+    """
+    Calcula los cambios mínimos para que el sheet pase a contener new_rows
+
+    Las filas que ya existen se quedan en su posición; las nuevas ocupan
+    los huecos que dejan las borradas y, si no caben, se añaden al final.
+    Si sobran filas, las del final se mueven a los huecos y el resto se vacía.
+
+    Args:
+        existing_rows: Filas de datos actuales (sin encabezados)
+        new_rows: Filas deseadas, ya convertidas con signal_to_row
+
+    Returns:
+        Tupla (updates, clear_from, total_rows): updates es una lista de
+        (fila_sheet, valores) con los bloques contiguos a escribir;
+        clear_from es la primera fila del sheet a vaciar (o None) y
+        total_rows el número de filas de datos resultante.
+    """
+    width = len(SHEET_COLUMNS)
+    existing = [(list(row) + [''] * width)[:width] for row in existing_rows]
+    existing_keys = _row_keys(existing)
+    new_keys = _row_keys(new_rows)
+    new_by_key = {key: row for key, row in zip(new_keys, new_rows) if key is not None}
+
+    total = len(new_rows)
+    final = [None] * total
+    placed = set()
+
+    # Filas que siguen existiendo y caben en el nuevo tamaño: no se mueven
+    for position, key in enumerate(existing_keys):
+        if position < total and key in new_by_key and key not in placed:
+            final[position] = new_by_key[key]
+            placed.add(key)
+
+    # El resto (nuevas o que estaban más allá del final) rellena los huecos
+    pending = (row for key, row in zip(new_keys, new_rows) if key is None or key not in placed)
+    for position in range(total):
+        if final[position] is None:
+            final[position] = next(pending)
+
+    # Agrupar las filas que cambian en bloques contiguos
+    updates = []
+    block_start = None
+    block = []
+    for position, row in enumerate(final):
+        changed = position >= len(existing) or existing[position] != row
+        if changed:
+            if block_start is None:
+                block_start = position
+            block.append(row)
+        elif block:
+            updates.append((block_start + 2, block))
+            block_start, block = None, []
+    if block:
+        updates.append((block_start + 2, block))
+
+    clear_from = total + 2 if total < len(existing) else None
+    return updates, clear_from, total
+
+def _sync_sheet_incremental(sheet, rows):
+    """
+    Aplica solo las diferencias entre el contenido del sheet y rows
+
+    Usa una lectura y como mucho tres escrituras (resize, batch_update y
+    batch_clear), sin dejar nunca el sheet vacío entre medias.
+
+    Returns:
+        Diccionario con el número de filas escritas y vaciadas
+    """
+    existing = sheets_call('sheets_read', sheet.get_all_values)[1:]
+    updates, clear_from, total = compute_sheet_delta(existing, rows)
+
+    _ensure_rows(sheet, total + 1)
+
+    if updates:
+        sheets_call('sheets_write', sheet.batch_update, [
+            {'range': _row_range(first_row, first_row + len(block) - 1), 'values': block}
+            for first_row, block in updates
+        ])
+
+    cleared = 0
+    if clear_from is not None:
+        last_row = len(existing) + 1
+        sheets_call('sheets_write', sheet.batch_clear, [_row_range(clear_from, last_row)])
+        cleared = last_row - clear_from + 1
+
+    return {'escritas': sum(len(block) for _, block in updates), 'vaciadas': cleared}
+
+def write_signals_to_sheet(signals, mode=None):
     """
     Escribe señales en Google Sheets
     
     Args:
         signals: Lista de diccionarios con señales
+        mode: 'incremental' (solo diferencias) o 'full' (borra y reescribe);
+            por defecto SHEETS_SYNC_MODE
     
     Returns:
         True si se escribió correctamente, False en caso contrario
     """
+    mode = mode or SYNC_MODE
+    start = time.perf_counter()
     try:
-        client = get_sheet_client()
-        if not client:
-            print("⚠️  No se pudo autenticar con Google Sheets")
-            return False
-        
-        # Abrir el sheet
-        sheet = client.open_by_key(SHEET_ID).sheet1
-        
-        # Limpiar datos existentes (excepto encabezados)
-        sheet.delete_rows(2, sheet.row_count)
-        
         # Preparar datos
-        rows = []
-        for signal in signals:
-            row = [
-                signal.get('id', ''),
-                signal.get('tipo_senal', ''),
-                signal.get('keyword_origen', ''),
-                signal.get('url', ''),
-                signal.get('titulo', ''),
-                signal.get('nombre_persona_o_institucion', ''),
-                signal.get('email', ''),
-                signal.get('telefono', ''),
-                signal.get('prioridad', ''),
-                signal.get('fecha_evento', signal.get('fecha_detectada', ''))
-            ]
-            rows.append(row)
+        rows = [signal_to_row(signal) for signal in signals]
         
-        # Escribir datos
-        if rows:
-            sheet.append_rows(rows)
+        with worksheet_handle(fresh=True) as sheet:
+            if mode == 'full':
+                # Escribir todas las filas en su rango y vaciar lo que sobre
+                # (rangos fijos: un reintento no duplica filas)
+                last_row = len(rows) + 1
+                _ensure_rows(sheet, last_row)
+                if rows:
+                    sheets_call('sheets_write', sheet.update, range_name=_row_range(2, last_row), values=rows)
+                if sheet.row_count > last_row:
+                    sheets_call('sheets_write', sheet.batch_clear, [_row_range(last_row + 1, sheet.row_count)])
+                
+                print(f"✅ {len(signals)} señales escritas en Google Sheets")
+            else:
+                stats = _sync_sheet_incremental(sheet, rows)
+                print(f"✅ {len(signals)} señales sincronizadas en Google Sheets "
+                      f"({stats['escritas']} filas escritas, {stats['vaciadas']} vaciadas)")
         
-        print(f"✅ {len(signals)} señales escritas en Google Sheets")
         print(f"📊 URL del Sheet: {SHEET_URL}")
+        metrics.registry.observe('write_signals_to_sheet', time.perf_counter() - start, len(signals))
         
         return True
         
     except Exception as e:
+        metrics.registry.observe('write_signals_to_sheet', time.perf_counter() - start,
+                                 len(signals), error=True)
         print(f"❌ Error escribiendo en Google Sheets: {e}")
         import traceback
         traceback.print_exc()
@@ -96,20 +357,15 @@ def get_signals_from_sheet():
     Returns:
         Lista de diccionarios con señales
     """
+    start = time.perf_counter()
     try:
-        client = get_sheet_client()
-        if not client:
-            print("⚠️  No se pudo autenticar con Google Sheets")
-            return []
-        
-        # Abrir el sheet
-        sheet = client.open_by_key(SHEET_ID).sheet1
-        
         # Obtener todos los valores
-        rows = sheet.get_all_values()
+        with worksheet_handle() as sheet:
+            rows = sheets_call('sheets_read', sheet.get_all_values)
         
         if len(rows) <= 1:
             print("[DEBUG] Google Sheets vacío (solo encabezados)")
+            metrics.registry.observe('get_signals_from_sheet', time.perf_counter() - start, 0)
             return []
         
         # Saltar encabezados
@@ -131,9 +387,11 @@ def get_signals_from_sheet():
                 signals.append(signal)
         
         print(f"[DEBUG] Leídas {len(signals)} señales desde Google Sheets")
+        metrics.registry.observe('get_signals_from_sheet', time.perf_counter() - start, len(signals))
         return signals
         
     except Exception as e:
+        metrics.registry.observe('get_signals_from_sheet', time.perf_counter() - start, 0, error=True)
         print(f"❌ Error leyendo desde Google Sheets: {e}")
         import traceback
         traceback.print_exc()
@@ -0,0 +1,161 @@
+"""
+Índices, estadísticas y paginación de la respuesta de /api/signals
+
+La instantánea que se sirve (y su caché entre workers) está en
+shared_snapshot.
+"""
+import json
+import os
+
+# Segundos que se sirve la misma instantánea antes de volver a leer el sheet
+SIGNALS_CACHE_TTL = float(os.environ.get('SIGNALS_CACHE_TTL', 60))
+
+# Orden semántico de las prioridades (no alfabético)
+PRIORITY_RANK = {'Alta': 0, 'Media': 1, 'Baja': 2}
+SORTABLE_FIELDS = (
+    'id', 'prioridad', 'titulo', 'tipo_senal', 'email', 'telefono',
+    'nombre_persona_o_institucion', 'keyword_origen', 'fecha_evento', 'url'
+)
+MAX_PAGE_SIZE = 500
+
+def _split_keywords(value):
+    """keyword_origen puede contener varias queries separadas por ' | '"""
+    return [k.strip().lower() for k in (value or '').split(' | ') if k.strip()]
+
+def index_signals(signals):
+    """
+    Índices de posiciones y totales de una lista de señales
+
+    Returns:
+        Diccionario con by_priority, by_institution y by_keyword
+        ({valor: [posiciones]}), search_text (texto en minúsculas por
+        señal para la búsqueda libre), con_email y con_telefono
+    """
+    by_priority = {}
+    by_institution = {}
+    by_keyword = {}
+    search_text = []
+    con_email = 0
+    con_telefono = 0
+    for position, signal in enumerate(signals):
+        by_priority.setdefault(signal.get('prioridad') or '', []).append(position)
+        institution = (signal.get('nombre_persona_o_institucion') or '').lower()
+        by_institution.setdefault(institution, []).append(position)
+        for keyword in _split_keywords(signal.get('keyword_origen')):
+            by_keyword.setdefault(keyword, []).append(position)
+        search_text.append(' '.join(
+            str(signal.get(field) or '') for field in ('titulo', 'nombre_persona_o_institucion', 'url', 'email')
+        ).lower())
+        if signal.get('email'):
+            con_email += 1
+        if signal.get('telefono'):
+            con_telefono += 1
+    return {
+        'by_priority': by_priority,
+        'by_institution': by_institution,
+        'by_keyword': by_keyword,
+        'search_text': search_text,
+        'con_email': con_email,
+        'con_telefono': con_telefono
+    }
+
+def signal_stats(indexes, total, last_execution):
+    """Estadísticas de /api/signals/stats a partir de index_signals"""
+    return {
+        'total': total,
+        'por_prioridad': {priority: len(indexes['by_priority'].get(priority, [])) for priority in PRIORITY_RANK},
+        'con_email': indexes['con_email'],
+        'con_telefono': indexes['con_telefono'],
+        'instituciones': len(indexes['by_institution']),
+        'last_execution': last_execution
+    }
+
+def sort_positions(signals, field):
+    """Posiciones de todas las señales ordenadas ascendentemente por field"""
+    if field == 'prioridad':
+        key = lambda p: (PRIORITY_RANK.get(signals[p].get('prioridad'), len(PRIORITY_RANK)), p)
+    else:
+        key = lambda p: (str(signals[p].get(field) or '').lower(), p)
+    return sorted(range(len(signals)), key=key)
+
+class SignalQueries:
+    """
+    Filtrado, ordenación y paginación sobre índices de posiciones
+
+    Las clases que lo usan definen by_priority, by_institution,
+    by_keyword, count, _row(posición), _sorted_positions(campo) y
+    _search(texto, posiciones); pueden redefinir _order_candidates y
+    query_body si tienen una forma más rápida.
+    """
+
+    def _order_candidates(self, field, candidates):
+        """Posiciones de candidates en el orden ascendente de field"""
+        return [p for p in self._sorted_positions(field) if p in candidates]
+
+    def _page(self, page=1, page_size=25, sort='prioridad', order='asc',
+              prioridad=None, institucion=None, keyword=None, q=None):
+        """Posiciones de la página pedida y su contexto (ver query)"""
+        candidates = None
+        for value, index_name in ((prioridad, 'by_priority'),
+                                  ((institucion or '').lower() or None, 'by_institution'),
+                                  ((keyword or '').lower() or None, 'by_keyword')):
+            if value is None:
+                continue
+            positions = set(getattr(self, index_name).get(value, ()))
+            candidates = positions if candidates is None else candidates & positions
+        if q:
+            pool = range(self.count) if candidates is None else candidates
+            candidates = self._search(q.lower(), pool)
+
+        field = sort if sort in SORTABLE_FIELDS else 'prioridad'
+        if candidates is None:
+            ordered = self._sorted_positions(field)
+        else:
+            ordered = self._order_candidates(field, candidates)
+        if order == 'desc':
+            ordered = ordered[::-1]
+
+        page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+        page = max(1, int(page))
+        start = (page - 1) * page_size
+        return ordered[start:start + page_size], {
+            'filtered': len(ordered),
+            'total': self.count,
+            'page': page,
+            'page_size': page_size
+        }
+
+    def query(self, **params):
+        """
+        Filtra, ordena y pagina las señales usando los índices
+
+        Args:
+            page: Página (base 1)
+            page_size: Señales por página (máximo MAX_PAGE_SIZE)
+            sort: Campo de ordenación (ver SORTABLE_FIELDS)
+            order: 'asc' o 'desc'
+            prioridad: Filtro exacto por prioridad
+            institucion: Filtro exacto por institución (sin mayúsculas)
+            keyword: Filtro por query de origen (sin mayúsculas)
+            q: Texto libre buscado en título, institución, URL y email
+
+        Returns:
+            Diccionario con 'signals' (la página), 'filtered' y 'total'
+        """
+        positions, info = self._page(**params)
+        return dict(signals=[self._row(p) for p in positions], **info)
+
+    def query_body(self, extra=None, **params):
+        """
+        Resultado de query() serializado en JSON
+
+        Args:
+            extra: Campos que se añaden a la respuesta
+            **params: Parámetros de query()
+
+        Returns:
+            bytes UTF-8
+        """
+        result = self.query(**params)
+        result.update(extra or {})
+        return json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
@@ -0,0 +1,353 @@
+"""
+Almacén local de señales (SQLite): fuente de verdad del motor y del dashboard
+
+Google Sheets pasa a ser una réplica que mantiene sheets_replicator en
+segundo plano.
+"""
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+STORE_PATH = os.environ.get('SIGNAL_STORE_PATH', '/app/data/signals.sqlite')
+# 'sqlite' usa el almacén local; 'sheets' vuelve a leer/escribir directamente en Google Sheets
+SIGNAL_BACKEND = os.environ.get('SIGNAL_BACKEND', 'sqlite')
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def was_searched(signal, searched_queries):
+    """
+    True si se lanzaron en esta ejecución todas las queries de origen de la señal
+
+    Una señal que falta en los resultados solo se da de baja si todas sus
+    queries buscaron y no la devolvieron; las de queries pausadas, sin
+    presupuesto o fallidas se conservan.
+    """
+    origins = [q.strip() for q in (signal.get('keyword_origen') or '').split(' | ') if q.strip()]
+    return all(query in searched_queries for query in origins)
+
+class SignalStore(ABC):
+    """
+    Interfaz del almacén de señales
+
+    Cada cambio real en una señal incrementa una versión global; la réplica
+    compara esa versión con la última replicada para saber si hay trabajo.
+    """
+
+    @abstractmethod
+    def upsert_signals(self, signals):
+        """Inserta o actualiza señales por id; devuelve cuántas cambiaron"""
+
+    @abstractmethod
+    def replace_signals(self, signals, searched_queries=None):
+        """
+        Deja como activas estas señales (upsert + baja del resto)
+
+        Con searched_queries (queries lanzadas en la ejecución) solo se dan
+        de baja las señales de esas queries (ver was_searched); el resto
+        sigue activo detrás de las de la ejecución.
+        """
+
+    @abstractmethod
+    def update_signals(self, changed, active_ids, searched_queries=None):
+        """
+        Variante incremental de replace_signals
+
+        Solo recibe las señales nuevas o modificadas; active_ids es la lista
+        ordenada de todas las que deben quedar activas (incluidas las que no
+        cambiaron, que se conservan tal cual). searched_queries como en
+        replace_signals.
+        """
+
+    @abstractmethod
+    def active_ids(self, ids):
+        """Subconjunto de ids que corresponden a señales activas"""
+
+    @abstractmethod
+    def get_signals(self):
+        """Lista de señales activas en el orden de la última escritura"""
+
+    @abstractmethod
+    def get_signal(self, signal_id):
+        """Señal activa con ese id, o None"""
+
+    @abstractmethod
+    def count(self):
+        """Número de señales activas"""
+
+    @abstractmethod
+    def record_run(self, started_at, status, total=0, details=None):
+        """Guarda en el historial una ejecución terminada y devuelve su id"""
+
+    @abstractmethod
+    def last_run(self, status='succeeded'):
+        """Última ejecución con ese estado, o None"""
+
+    @abstractmethod
+    def version(self):
+        """Versión actual de los datos"""
+
+    @abstractmethod
+    def replicated_version(self):
+        """Última versión enviada a la réplica"""
+
+    @abstractmethod
+    def mark_replicated(self, version):
+        """Registra que la réplica está al día hasta version"""
+
+class SQLiteSignalStore(SignalStore):
+    """Implementación en un fichero SQLite (una conexión protegida por lock)"""
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS signals (
+                id TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                prioridad TEXT,
+                fecha_detectada TEXT,
+                data TEXT NOT NULL,
+                position INTEGER NOT NULL DEFAULT 0,
+                active INTEGER NOT NULL DEFAULT 1,
+                version INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_signals_url ON signals (url);
+            CREATE INDEX IF NOT EXISTS idx_signals_prioridad ON signals (prioridad);
+            CREATE INDEX IF NOT EXISTS idx_signals_fecha ON signals (fecha_detectada);
+            CREATE INDEX IF NOT EXISTS idx_signals_active ON signals (active, position);
+
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TEXT NOT NULL,
+                finished_at TEXT,
+                status TEXT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                details TEXT
+            );
+
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('replicated_version', 0);
+        ''')
+        self._conn.commit()
+
+    def _get_meta(self, key):
+        return self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()[0]
+
+    def _upsert(self, signals, version, now, reposition, positions=None):
+        """
+        Upsert sin commit; devuelve cuántas filas cambiaron
+
+        Con reposition las señales quedan en el orden de la lista (o en el
+        indicado por positions, {id: posición}); sin él las existentes
+        conservan su posición y las nuevas van al final.
+        """
+        changed = 0
+        base = 0
+        if not reposition:
+            base = self._conn.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM signals').fetchone()[0]
+        for offset, signal in enumerate(signals):
+            position = positions[signal['id']] if positions else base + offset
+            data = json.dumps(signal, ensure_ascii=False, sort_keys=True)
+            cursor = self._conn.execute('''
+                INSERT INTO signals (id, url, prioridad, fecha_detectada, data, position, active, version, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    url = excluded.url,
+                    prioridad = excluded.prioridad,
+                    fecha_detectada = excluded.fecha_detectada,
+                    data = excluded.data,
+                    position = CASE WHEN ? THEN excluded.position ELSE signals.position END,
+                    active = 1,
+                    version = excluded.version,
+                    updated_at = excluded.updated_at
+                WHERE signals.data != excluded.data OR signals.active = 0
+                    OR (? AND signals.position != excluded.position)
+            ''', (
+                signal['id'], signal.get('url', ''), signal.get('prioridad'),
+                signal.get('fecha_detectada'), data, position, version, now,
+                reposition, reposition
+            ))
+            changed += cursor.rowcount
+        return changed
+
+    def _bump_version(self):
+        # El UPDATE abre la transacción antes de leer: seguro entre procesos
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return self._get_meta('version')
+
+    def upsert_signals(self, signals):
+        with self._lock:
+            version = self._bump_version()
+            changed = self._upsert(signals, version, _now(), reposition=False)
+            if not changed:
+                self._conn.rollback()
+                return 0
+            self._conn.commit()
+            return changed
+
+    def replace_signals(self, signals, searched_queries=None):
+        with self._lock:
+            version = self._bump_version()
+            now = _now()
+            changed = self._upsert(signals, version, now, reposition=True)
+            changed += self._deactivate_others([signal['id'] for signal in signals], version, now,
+                                               searched_queries)
+            if not changed:
+                self._conn.rollback()
+                return 0
+            self._conn.commit()
+            return changed
+
+    def _deactivate_others(self, ids, version, now, searched_queries=None):
+        """
+        Da de baja las señales activas que no están en ids (sin commit)
+
+        Con searched_queries solo las de queries lanzadas; las demás pasan
+        detrás de ids conservando su orden.
+        """
+        self._conn.execute('CREATE TEMP TABLE IF NOT EXISTS keep_ids (id TEXT PRIMARY KEY)')
+        self._conn.execute('DELETE FROM keep_ids')
+        self._conn.executemany('INSERT OR IGNORE INTO keep_ids (id) VALUES (?)', ((i,) for i in ids))
+        if searched_queries is None:
+            cursor = self._conn.execute('''
+                UPDATE signals SET active = 0, version = ?, updated_at = ?
+                WHERE active = 1 AND id NOT IN (SELECT id FROM keep_ids)
+            ''', (version, now))
+            return cursor.rowcount
+
+        rows = self._conn.execute('''
+            SELECT id, data, position FROM signals
+            WHERE active = 1 AND id NOT IN (SELECT id FROM keep_ids) ORDER BY position, id
+        ''').fetchall()
+        dropped = []
+        kept = []
+        for row in rows:
+            if was_searched(json.loads(row['data']), searched_queries):
+                dropped.append(row['id'])
+            else:
+                kept.append(row)
+        self._conn.executemany(
+            'UPDATE signals SET active = 0, version = ?, updated_at = ? WHERE id = ?',
+            ((version, now, signal_id) for signal_id in dropped)
+        )
+        base = len(ids)
+        moved = [(base + offset, row['id']) for offset, row in enumerate(kept) if row['position'] != base + offset]
+        self._conn.executemany(
+            'UPDATE signals SET position = ?, version = ?, updated_at = ? WHERE id = ?',
+            ((position, version, now, signal_id) for position, signal_id in moved)
+        )
+        return len(dropped) + len(moved)
+
+    def update_signals(self, changed, active_ids, searched_queries=None):
+        with self._lock:
+            version = self._bump_version()
+            now = _now()
+            positions = {signal_id: position for position, signal_id in enumerate(active_ids)}
+            count = self._upsert(changed, version, now, reposition=True, positions=positions)
+            # Las que no cambiaron solo se tocan si se movieron de sitio
+            changed_ids = {signal['id'] for signal in changed}
+            cursor = self._conn.executemany('''
+                UPDATE signals SET position = ?, version = ?, updated_at = ?
+                WHERE id = ? AND active = 1 AND position != ?
+            ''', (
+                (position, version, now, signal_id, position)
+                for signal_id, position in positions.items() if signal_id not in changed_ids
+            ))
+            count += max(cursor.rowcount, 0)
+            count += self._deactivate_others(active_ids, version, now, searched_queries)
+            if not count:
+                self._conn.rollback()
+                return 0
+            self._conn.commit()
+            return count
+
+    def active_ids(self, ids):
+        ids = list(ids)
+        found = set()
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT id FROM signals WHERE active = 1 AND id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(row['id'] for row in rows)
+        return found
+
+    def get_signals(self):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT data FROM signals WHERE active = 1 ORDER BY position, id'
+            ).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def get_signal(self, signal_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data FROM signals WHERE id = ? AND active = 1', (signal_id,)
+            ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM signals WHERE active = 1').fetchone()[0]
+
+    def record_run(self, started_at, status, total=0, details=None):
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO runs (started_at, finished_at, status, total, details) VALUES (?, ?, ?, ?, ?)',
+                (started_at, _now(), status, total, json.dumps(details or {}, ensure_ascii=False))
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def last_run(self, status='succeeded'):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM runs WHERE status = ? ORDER BY id DESC LIMIT 1', (status,)
+            ).fetchone()
+        if row is None:
+            return None
+        run = dict(row)
+        run['details'] = json.loads(run['details']) if run['details'] else {}
+        return run
+
+    def version(self):
+        with self._lock:
+            return self._get_meta('version')
+
+    def replicated_version(self):
+        with self._lock:
+            return self._get_meta('replicated_version')
+
+    def mark_replicated(self, version):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE meta SET value = MAX(value, ?) WHERE key = 'replicated_version'", (version,)
+            )
+            self._conn.commit()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_signal_store():
+    """Devuelve el almacén compartido del proceso (se crea en el primer uso)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SQLiteSignalStore()
+    return _store
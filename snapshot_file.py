@@ -0,0 +1,154 @@
+"""
+Instantánea en disco de las señales de la última ejecución (NDJSON)
+
+Estructura del fichero:
+    1. Cabecera de tamaño fijo (HEADER_SIZE bytes, JSON rellenado con
+       espacios y terminado en salto de línea) con la fecha de generación,
+       el total, estadísticas y la posición del bloque de metadatos.
+    2. Una señal por línea en JSON compacto.
+    3. Una última línea con los metadatos largos (queries fallidas,
+       métricas...).
+
+La cabecera se lee con una sola lectura de HEADER_SIZE bytes sin tocar el
+resto. El fichero se escribe en un temporal del mismo directorio y se
+renombra al cerrar, así los lectores nunca ven una instantánea a medias.
+"""
+import json
+import os
+import tempfile
+
+SNAPSHOT_PATH = os.environ.get('SIGNALS_SNAPSHOT_PATH', '/app/signals_today.ndjson')
+SNAPSHOT_FORMAT = 'signals-ndjson/1'
+HEADER_SIZE = 4096
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+class SnapshotWriter:
+    """
+    Escribe la instantánea registro a registro (memoria constante)
+
+    Usar como context manager: al salir sin errores se completa la
+    cabecera y se renombra el temporal; si hay una excepción el temporal
+    se borra y la instantánea anterior sigue intacta.
+
+    Args:
+        path: Ruta final de la instantánea
+        header: Campos pequeños para la cabecera (p. ej. fecha_generacion)
+        meta: Datos largos para la línea final de metadatos
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, header=None, meta=None):
+        self.path = path
+        self.header = dict(header or {})
+        self.meta = dict(meta or {})
+        self.total = 0
+        self.by_priority = {}
+        self.with_email = 0
+        self.with_phone = 0
+        self._file = None
+        self._tmp_path = None
+
+    def __enter__(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-', suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        # Hueco para la cabecera; se rellena al cerrar
+        self._file.write(b' ' * (HEADER_SIZE - 1) + b'\n')
+        return self
+
+    def write(self, signal):
+        """Añade una señal al final de la instantánea"""
+        self._file.write(_dumps(signal).encode('utf-8') + b'\n')
+        self.total += 1
+        priority = signal.get('prioridad') or 'N/A'
+        self.by_priority[priority] = self.by_priority.get(priority, 0) + 1
+        if signal.get('email'):
+            self.with_email += 1
+        if signal.get('telefono'):
+            self.with_phone += 1
+
+    def write_all(self, signals):
+        for signal in signals:
+            self.write(signal)
+
+    def _encode_header(self, meta_offset, meta_length):
+        header = dict(
+            self.header,
+            formato=SNAPSHOT_FORMAT,
+            total=self.total,
+            por_prioridad=self.by_priority,
+            con_email=self.with_email,
+            con_telefono=self.with_phone,
+            meta_offset=meta_offset,
+            meta_length=meta_length
+        )
+        encoded = _dumps(header).encode('utf-8')
+        if len(encoded) > HEADER_SIZE - 1:
+            raise ValueError(f"Cabecera de la instantánea demasiado grande ({len(encoded)} bytes)")
+        return encoded + b' ' * (HEADER_SIZE - 1 - len(encoded)) + b'\n'
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                meta_offset = self._file.tell()
+                meta = _dumps(self.meta).encode('utf-8') + b'\n'
+                self._file.write(meta)
+                self._file.seek(0)
+                self._file.write(self._encode_header(meta_offset, len(meta)))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._file.close()
+            if exc_type is None:
+                # mkstemp crea el fichero solo legible por el propietario
+                os.chmod(self._tmp_path, 0o644)
+                os.replace(self._tmp_path, self.path)
+                self._tmp_path = None
+        finally:
+            if self._tmp_path and os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+        return False
+
+def write_snapshot(signals, path=SNAPSHOT_PATH, header=None, meta=None):
+    """Escribe una instantánea completa a partir de un iterable de señales"""
+    with SnapshotWriter(path, header, meta) as writer:
+        writer.write_all(signals)
+    return writer.total
+
+def read_header(path=SNAPSHOT_PATH):
+    """
+    Lee solo la cabecera
+
+    Returns:
+        Diccionario de la cabecera, o None si no hay instantánea válida
+    """
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read(HEADER_SIZE)
+    except FileNotFoundError:
+        return None
+    try:
+        header = json.loads(raw.decode('utf-8'))
+    except ValueError:
+        return None
+    return header if header.get('formato') == SNAPSHOT_FORMAT else None
+
+def read_meta(path=SNAPSHOT_PATH):
+    """Lee la línea de metadatos usando la posición indicada en la cabecera"""
+    header = read_header(path)
+    if header is None:
+        return None
+    with open(path, 'rb') as f:
+        f.seek(header['meta_offset'])
+        return json.loads(f.read(header['meta_length']).decode('utf-8'))
+
+def iter_signals(path=SNAPSHOT_PATH):
+    """Genera las señales de la instantánea una a una"""
+    header = read_header(path)
+    if header is None:
+        return
+    with open(path, 'rb') as f:
+        f.seek(HEADER_SIZE)
+        while f.tell() < header['meta_offset']:
+            yield json.loads(f.readline().decode('utf-8'))
@@ -0,0 +1,68 @@
+"""
+Respuestas estáticas precomprimidas (la página principal)
+
+El HTML se genera una vez al arrancar y se guardan sus variantes gzip y,
+si está instalado el paquete brotli, br. Cada petición solo elige la
+variante según Accept-Encoding y contesta 304 si el ETag coincide.
+"""
+import gzip
+import hashlib
+import os
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Segundos que el navegador puede reutilizar la página sin revalidar
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 300))
+# Por debajo de este tamaño no compensa comprimir
+MIN_COMPRESS_SIZE = 1024
+
+class StaticPage:
+    """
+    Cuerpo fijo con sus variantes comprimidas y su ETag
+
+    Args:
+        body: Contenido (str o bytes)
+        content_type: Cabecera Content-Type de la respuesta
+        max_age: Cache-Control max-age en segundos
+    """
+
+    def __init__(self, body, content_type='text/html; charset=utf-8', max_age=STATIC_MAX_AGE):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.content_type = content_type
+        self.max_age = max_age
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {'identity': body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            # mtime=0: la misma página da siempre los mismos bytes
+            self.variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body, quality=11)
+
+    def _choose_encoding(self):
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted[encoding]:
+                return encoding
+        return 'identity'
+
+    def response(self):
+        """Respuesta para la petición en curso"""
+        encoding = self._choose_encoding()
+        # Un ETag por variante: los proxies no deben mezclar codificaciones
+        etag = self.etag if encoding == 'identity' else f"{self.etag}-{encoding}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.variants[encoding], content_type=self.content_type)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f"public, max-age={self.max_age}"
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
@@ -1,16 +1,58 @@
-from flask import Flask, render_template_string, jsonify
-import json
+from flask import Flask, jsonify, request, Response
 import os
 from datetime import datetime
-import threading
+import hashlib
+from shared_snapshot import SharedSnapshotCache
+from static_page import StaticPage
+from jobs import JOB_STATE_DIR, JobManager, abandon_unfinished
+from events import EVENTS_PATH, event_bus, SubscriptionClosed
+from process_lock import ProcessLock
+from signal_store import SIGNAL_BACKEND, get_signal_store
+from sheets_replicator import get_replicator
+from snapshot_file import SNAPSHOT_PATH, read_header
+import metrics
 
 app = Flask(__name__)
 
-DATA_FILE = '/app/signals_today.json'
+DATA_FILE = SNAPSHOT_PATH
 LAST_EXECUTION = None
 
-def run_motor():
-    """Ejecuta el motor de captación"""
+# Con varios workers (gunicorn) solo uno ejecuta el motor a la vez y solo
+# uno mantiene el hilo de réplica hacia Google Sheets
+motor_lock = ProcessLock('motor')
+replicator_leader = ProcessLock('sheets-replicator')
+
+# El motor corre en un worker y /events o /metrics los puede servir otro:
+# los eventos pasan por un fichero y las métricas se suman entre workers
+event_bus.share(EVENTS_PATH)
+shared_metrics = metrics.SharedMetrics()
+
+def start_background_tasks():
+    """
+    Arranca los hilos de fondo del proceso
+
+    Se llama una vez por worker (gunicorn.conf.py, post_fork) o al
+    arrancar el servidor de desarrollo. El worker que consigue
+    replicator_leader replica el almacén en Google Sheets en segundo plano;
+    el cerrojo se conserva mientras el worker vive. Todos publican sus
+    métricas para /metrics.
+    """
+    shared_metrics.start()
+    if SIGNAL_BACKEND != 'sheets' and replicator_leader.acquire(blocking=False):
+        get_replicator().start()
+
+def finish_run_events(total=0, cancelled=False, error=None):
+    """Avisa a los clientes SSE del final de la ejecución y limpia el historial"""
+    event_bus.publish('run_finished', {'total': total, 'cancelled': cancelled, 'error': error})
+    event_bus.reset_history()
+
+def run_motor(job=None):
+    """
+    Ejecuta el motor de captación
+    
+    Args:
+        job: jobs.Job que recibe el progreso y puede pedir la cancelación
+    """
     global LAST_EXECUTION
     try:
         import sys
@@ -26,8 +68,17 @@ def run_motor():
         print("="*50, flush=True)
         sys.stdout.flush()
         
-        motor_main()
+        if job is not None:
+            signals = motor_main(on_progress=job.record_progress, should_cancel=job.is_cancelled)
+        else:
+            signals = motor_main()
+        if signals is None:
+            print("⛔ MOTOR CANCELADO", flush=True)
+            finish_run_events(cancelled=True)
+            return
         LAST_EXECUTION = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        signals_cache.invalidate()
+        finish_run_events(total=len(signals))
         
         print("\n" + "="*50, flush=True)
         print("✅ MOTOR COMPLETADO", flush=True)
@@ -44,49 +95,205 @@ def run_motor():
         print("="*50 + "\n", flush=True)
         sys.stdout.flush()
         sys.stderr.flush()
+        finish_run_events(error=str(e))
+        # Propagar para que el gestor de trabajos lo marque como fallido
+        raise
+
+# Una sola ejecución del motor a la vez entre todos los workers; las
+# peticiones extra se agrupan en un único trabajo en cola. El estado se
+# publica en JOB_STATE_DIR para que lo vea cualquier worker
+job_manager = JobManager(run_motor, state_dir=JOB_STATE_DIR, lock=motor_lock)
 
 @app.route('/')
 def index():
-    """Página principal con tabla interactiva"""
-    return render_template_string(HTML_TEMPLATE)
+    """Página principal con tabla interactiva (generada una vez al arrancar)"""
+    return INDEX_PAGE.response()
+
+def load_signals_from_sheet():
+    """Lee las señales directamente desde Google Sheets (SIGNAL_BACKEND=sheets)"""
+    print(f"\n[DEBUG] Leyendo desde Google Sheets...", flush=True)
+    from sheets_writer import get_signals_from_sheet
+    signals = get_signals_from_sheet()
+    print(f"[DEBUG] Señales leídas: {len(signals)}", flush=True)
+    
+    # Fecha de la última ejecución desde la cabecera de la instantánea
+    last_exec = LAST_EXECUTION or 'N/A'
+    header = read_header(DATA_FILE)
+    if header:
+        last_exec = header.get('fecha_generacion', last_exec)
+    
+    return signals, last_exec
+
+def load_signals_from_store():
+    """Lee las señales del almacén local"""
+    store = get_signal_store()
+    signals = store.get_signals()
+    last_run = store.last_run()
+    
+    if not signals and last_run is None:
+        # Primer arranque con el almacén vacío: importar lo que ya hay en el sheet
+        from sheets_writer import get_signals_from_sheet
+        signals = get_signals_from_sheet()
+        if signals:
+            store.replace_signals(signals)
+            store.mark_replicated(store.version())
+            print(f"💾 {len(signals)} señales importadas de Google Sheets al almacén local", flush=True)
+    
+    last_exec = last_run['finished_at'] if last_run else (LAST_EXECUTION or 'N/A')
+    return signals, last_exec
+
+def load_signals_payload():
+    """Arma la respuesta de /api/signals desde el backend configurado"""
+    if SIGNAL_BACKEND == 'sheets':
+        signals, last_exec = load_signals_from_sheet()
+    else:
+        signals, last_exec = load_signals_from_store()
+    
+    return {
+        'success': True,
+        'signals': signals,
+        'total': len(signals),
+        'last_execution': last_exec
+    }
+
+# Instantánea de /api/signals en un fichero compartido por todos los workers
+# (mmap); se invalida al terminar el motor
+signals_cache = SharedSnapshotCache(load_signals_payload)
+
+# Tamaño de los trozos en que se envía una respuesta servida desde mmap
+RESPONSE_CHUNK_SIZE = 256 * 1024
+
+# Parámetros que activan la paginación en servidor de /api/signals
+QUERY_PARAMS = ('page', 'page_size', 'sort', 'order', 'prioridad', 'institucion', 'keyword', 'q')
+
+def cached_response(body, etag):
+    """Respuesta JSON con ETag que contesta 304 si el cliente ya la tiene"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif isinstance(body, memoryview):
+        # Cuerpo dentro de la instantánea compartida (mmap): WSGI exige
+        # bytes, así que se copia por trozos sin duplicar la respuesta entera
+        chunks = (body[i:i + RESPONSE_CHUNK_SIZE].tobytes() for i in range(0, body.nbytes, RESPONSE_CHUNK_SIZE))
+        response = Response(chunks, mimetype='application/json')
+        response.content_length = body.nbytes
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Obligar al navegador a revalidar siempre con If-None-Match
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/signals')
 def get_signals():
-    """API para obtener las señales desde Google Sheets"""
+    """
+    API para obtener las señales (servidas desde la caché en memoria)
+    
+    Sin parámetros devuelve todas las señales. Con cualquiera de
+    QUERY_PARAMS filtra, ordena y pagina en el servidor:
+    page, page_size, sort, order ('asc'/'desc'), prioridad, institucion,
+    keyword y q (texto libre).
+    """
     try:
-        print(f"\n[DEBUG] Leyendo desde Google Sheets...", flush=True)
-        from sheets_writer import get_signals_from_sheet
-        signals = get_signals_from_sheet()
-        print(f"[DEBUG] Señales leídas: {len(signals)}", flush=True)
+        snapshot = signals_cache.get()
         
-        # Intentar obtener fecha de última ejecución desde JSON si existe
-        last_exec = LAST_EXECUTION or 'N/A'
-        if os.path.exists(DATA_FILE):
-            try:
-                with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    last_exec = data.get('fecha_generacion', last_exec)
-            except:
-                pass
+        if not any(param in request.args for param in QUERY_PARAMS):
+            return cached_response(snapshot.body, snapshot.etag)
         
-        return jsonify({
-            'success': True,
-            'signals': signals,
-            'total': len(signals),
-            'last_execution': last_exec
-        })
+        args = request.args
+        body = snapshot.query_body(
+            extra={'success': True, 'last_execution': snapshot.payload.get('last_execution')},
+            page=args.get('page', 1, type=int),
+            page_size=args.get('page_size', 25, type=int),
+            sort=args.get('sort', 'prioridad'),
+            order=args.get('order', 'asc'),
+            prioridad=args.get('prioridad') or None,
+            institucion=args.get('institucion') or None,
+            keyword=args.get('keyword') or None,
+            q=args.get('q') or None
+        )
+        # Misma instantánea + mismos parámetros = misma respuesta
+        query_key = hashlib.sha256(request.query_string).hexdigest()[:8]
+        return cached_response(body, f"{snapshot.etag}-{query_key}")
     except Exception as e:
         print(f"[ERROR] Error en /api/signals: {e}", flush=True)
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e), 'signals': [], 'total': 0})
 
+@app.route('/api/signals/stats')
+def get_signals_stats():
+    """Totales por prioridad y de contactos, precalculados con la instantánea"""
+    try:
+        snapshot = signals_cache.get()
+        return cached_response(snapshot.stats_body, snapshot.stats_etag)
+    except Exception as e:
+        print(f"[ERROR] Error en /api/signals/stats: {e}", flush=True)
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/metrics')
+def get_metrics():
+    """Tiempos por etapa, aciertos de caché y cuota de API (de todos los workers) en formato Prometheus"""
+    return Response(shared_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/regenerate', methods=['POST'])
 def regenerate():
     """Regenera el informe ejecutando el motor en segundo plano"""
-    thread = threading.Thread(target=run_motor)
-    thread.start()
-    return jsonify({'success': True, 'message': 'Motor ejecutándose...'})
+    job, coalesced = job_manager.submit()
+    if job['state'] == 'running':
+        message = 'Motor ejecutándose...'
+    else:
+        message = 'Ya hay una ejecución en curso; se ha encolado una más'
+    return jsonify({
+        'success': True,
+        'message': message,
+        'job_id': job['id'],
+        'state': job['state'],
+        'coalesced': coalesced
+    })
+
+@app.route('/events')
+def events():
+    """
+    Server-Sent Events con el progreso y las señales de la ejecución en curso
+    
+    Eventos: 'progress' (etapa y progreso por query), 'signal' (señal ya
+    clasificada) y 'run_finished'. Los clientes que se conectan a mitad de
+    ejecución reciben primero lo emitido hasta ese momento.
+    """
+    subscription = event_bus.subscribe(request.headers.get('Last-Event-ID'))
+    
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                chunk = subscription.get(timeout=15)
+                # Comentario SSE para mantener viva la conexión
+                yield chunk if chunk is not None else ': keepalive\n\n'
+        except SubscriptionClosed:
+            pass
+        finally:
+            event_bus.unsubscribe(subscription)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Estado, tiempos y progreso por query de una ejecución"""
+    state = job_manager.get_state(job_id)
+    if state is None:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify(dict(state, success=True))
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancela una ejecución en cola o pide parar la que está en curso"""
+    state = job_manager.cancel(job_id)
+    if state is None:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify(dict(state, success=True))
 
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -119,10 +326,22 @@ HTML_TEMPLATE = '''
         <div class="mb-4">
             <button id="btnRegenerate" class="btn btn-success">🔄 Regenerar Informe</button>
             <span id="lastExecution" class="ms-3 text-muted"></span>
+            <span id="runProgress" class="ms-3 text-muted"></span>
         </div>
 
         <div class="stats" id="stats"></div>
 
+        <ul id="liveSignals" class="list-group mb-4"></ul>
+
+        <div class="mb-3">
+            <select id="filterPriority" class="form-select form-select-sm" style="width: auto; display: inline-block;">
+                <option value="">Todas las prioridades</option>
+                <option value="Alta">Alta</option>
+                <option value="Media">Media</option>
+                <option value="Baja">Baja</option>
+            </select>
+        </div>
+
         <table id="signalsTable" class="table table-striped table-hover" style="width:100%">
             <thead>
                 <tr>
@@ -148,51 +367,57 @@ HTML_TEMPLATE = '''
     <script src="https://cdn.datatables.net/1.13.6/js/dataTables.bootstrap5.min.js"></script>
     <script>
         let table;
+        let searchProgress = null;
+        // Columnas de la tabla -> campo de ordenación en /api/signals
+        const COLUMN_FIELDS = [
+            'id', 'prioridad', 'titulo', 'tipo_senal', 'email', 'telefono',
+            'nombre_persona_o_institucion', 'keyword_origen', 'fecha_evento', 'url'
+        ];
+        const MAX_LIVE_SIGNALS = 20;
 
         function loadSignals() {
-            fetch('/api/signals')
+            loadStats();
+            if (table) {
+                table.ajax.reload(null, false);
+            } else {
+                initTable();
+            }
+        }
+
+        function loadStats() {
+            fetch('/api/signals/stats')
                 .then(res => res.json())
                 .then(data => {
                     if (data.success) {
-                        updateStats(data.signals);
-                        updateTable(data.signals);
-                        $('#lastExecution').text('Última ejecución: ' + data.last_execution);
+                        updateStats(data.stats);
+                        $('#lastExecution').text('Última ejecución: ' + data.stats.last_execution);
                     }
                 });
         }
 
-        function updateStats(signals) {
-            const alta = signals.filter(s => s.prioridad === 'Alta').length;
-            const media = signals.filter(s => s.prioridad === 'Media').length;
-            const baja = signals.filter(s => s.prioridad === 'Baja').length;
-            const conEmail = signals.filter(s => s.email).length;
-
+        function updateStats(stats) {
             $('#stats').html(`
                 <div class="stat-card" style="background: #e3f2fd;">
-                    <h3>${signals.length}</h3>
+                    <h3>${stats.total}</h3>
                     <p>Total Señales</p>
                 </div>
                 <div class="stat-card" style="background: #ffebee;">
-                    <h3>${alta}</h3>
+                    <h3>${stats.por_prioridad.Alta}</h3>
                     <p>Prioridad Alta</p>
                 </div>
                 <div class="stat-card" style="background: #fff3e0;">
-                    <h3>${media}</h3>
+                    <h3>${stats.por_prioridad.Media}</h3>
                     <p>Prioridad Media</p>
                 </div>
                 <div class="stat-card" style="background: #f3e5f5;">
-                    <h3>${conEmail}</h3>
+                    <h3>${stats.con_email}</h3>
                     <p>Con Email</p>
                 </div>
             `);
         }
 
-        function updateTable(signals) {
-            if (table) {
-                table.destroy();
-            }
-
-            const tableData = signals.map(s => [
+        function signalToRow(s) {
+            return [
                 s.id || '',
                 `<span class="badge badge-${s.prioridad.toLowerCase()}">${s.prioridad}</span>`,
                 s.titulo || '',
@@ -203,16 +428,124 @@ HTML_TEMPLATE = '''
                 s.keyword_origen || '',
                 s.fecha_evento || s.fecha_detectada || '',
                 `<a href="${s.url}" target="_blank" class="url-cell">${s.url}</a>`
-            ]);
+            ];
+        }
 
+        // Muestra (o actualiza, por ID) una señal recibida por SSE en la lista en vivo
+        function upsertSignal(s) {
+            const item = $(`<li class="list-group-item py-1"></li>`)
+                .attr('data-id', s.id)
+                .html(`<span class="badge badge-${s.prioridad.toLowerCase()}">${s.prioridad}</span> `)
+                .append($('<a target="_blank"></a>').attr('href', s.url).text(s.titulo));
+            const existing = $('#liveSignals').children().filter((i, el) => el.dataset.id === s.id);
+            if (existing.length) {
+                existing.replaceWith(item);
+            } else {
+                $('#liveSignals').prepend(item);
+                $('#liveSignals').children().slice(MAX_LIVE_SIGNALS).remove();
+            }
+        }
+
+        function listenEvents() {
+            if (!window.EventSource) {
+                return;
+            }
+            const source = new EventSource('/events');
+            source.addEventListener('progress', e => {
+                const p = JSON.parse(e.data);
+                if (p.stage === 'search') {
+                    searchProgress = { done: 0, total: p.queries.length };
+                    $('#liveSignals').empty();
+                } else if (p.stage === 'query_done' && searchProgress) {
+                    searchProgress.done += 1;
+                }
+                if (searchProgress) {
+                    $('#runProgress').text(`Búsquedas: ${searchProgress.done}/${searchProgress.total} · ${p.stage}`);
+                }
+            });
+            source.addEventListener('signal', e => upsertSignal(JSON.parse(e.data)));
+            source.addEventListener('run_finished', e => {
+                searchProgress = null;
+                $('#runProgress').text('');
+                $('#liveSignals').empty();
+                loadSignals();
+            });
+        }
+
+        // Traduce la petición de DataTables a los parámetros de /api/signals
+        function fetchPage(dt, callback) {
+            const order = dt.order && dt.order.length ? dt.order[0] : { column: 1, dir: 'asc' };
+            const params = new URLSearchParams({
+                page: Math.floor(dt.start / dt.length) + 1,
+                page_size: dt.length,
+                sort: COLUMN_FIELDS[order.column],
+                order: order.dir
+            });
+            if (dt.search && dt.search.value) {
+                params.set('q', dt.search.value);
+            }
+            const prioridad = $('#filterPriority').val();
+            if (prioridad) {
+                params.set('prioridad', prioridad);
+            }
+            fetch('/api/signals?' + params)
+                .then(res => res.json())
+                .then(data => {
+                    callback({
+                        draw: dt.draw,
+                        recordsTotal: data.total || 0,
+                        recordsFiltered: data.filtered || 0,
+                        data: (data.signals || []).map(signalToRow)
+                    });
+                });
+        }
+
+        function initTable() {
             table = $('#signalsTable').DataTable({
-                data: tableData,
-                order: [[1, 'asc'], [0, 'desc']],
+                serverSide: true,
+                ajax: (dt, callback) => fetchPage(dt, callback),
+                searchDelay: 400,
+                order: [[1, 'asc']],
                 pageLength: 25,
                 language: {
                     url: '//cdn.datatables.net/plug-ins/1.13.6/i18n/es-ES.json'
                 }
             });
+            $('#filterPriority').on('change', () => table.ajax.reload());
+        }
+
+        function resetRegenerateButton() {
+            $('#btnRegenerate').prop('disabled', false).text('🔄 Regenerar Informe');
+        }
+
+        function pollJob(jobId) {
+            fetch('/jobs/' + jobId)
+                .then(res => res.json())
+                .then(job => {
+                    if (!job.success) {
+                        resetRegenerateButton();
+                        return;
+                    }
+                    const p = job.progress;
+                    if (job.state === 'queued') {
+                        $('#btnRegenerate').text('⏳ En cola...');
+                    } else if (job.state === 'running') {
+                        $('#btnRegenerate').text(`⏳ Ejecutando... ${p.queries_done}/${p.queries_total}`);
+                    }
+                    if (['succeeded', 'failed', 'cancelled'].includes(job.state)) {
+                        resetRegenerateButton();
+                        // Con varios workers el SSE puede estar conectado a otro
+                        // proceso y no recibir 'run_finished': recargar aquí
+                        // siempre (con el ETag la recarga repetida es un 304)
+                        if (job.state === 'succeeded') {
+                            loadSignals();
+                        } else if (job.state === 'failed') {
+                            alert('Error en el motor: ' + job.error);
+                        }
+                        return;
+                    }
+                    setTimeout(() => pollJob(jobId), 2000);
+                });
         }
 
         $('#btnRegenerate').click(function() {
@@ -220,20 +553,29 @@ HTML_TEMPLATE = '''
             fetch('/regenerate', { method: 'POST' })
                 .then(res => res.json())
                 .then(data => {
-                    alert('Motor ejecutándose. Actualiza la página en 2 minutos.');
-                    setTimeout(() => {
-                        $('#btnRegenerate').prop('disabled', false).text('🔄 Regenerar Informe');
-                    }, 3000);
+                    if (data.success) {
+                        pollJob(data.job_id);
+                    } else {
+                        resetRegenerateButton();
+                    }
                 });
         });
 
         $(document).ready(function() {
             loadSignals();
+            listenEvents();
         });
     </script>
 </body>
 </html>
 '''
 
+# La plantilla no depende de la petición: se genera y comprime una sola vez
+INDEX_PAGE = StaticPage(app.jinja_env.from_string(HTML_TEMPLATE).render())
+
 if __name__ == '__main__':
+    # Servidor de desarrollo; en producción: gunicorn web_app:app (gunicorn.conf.py)
+    abandon_unfinished(JOB_STATE_DIR)
+    shared_metrics.clear()
+    start_background_tasks()
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))